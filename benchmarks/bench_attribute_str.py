@@ -0,0 +1,84 @@
+"""Benchmark runtime.attribute_str against the implementation it replaced.
+
+    python benchmarks/bench_attribute_str.py
+
+"""
+
+from __future__ import print_function
+
+import html
+import re
+import timeit
+
+from six import iteritems
+
+from haml import runtime
+from haml.runtime import _attr_sort_order, flatten_attr_dict, flatten_attr_list
+
+
+# The previous implementation, verbatim.
+
+_camelcase_re = re.compile(r'(?<!^)([A-Z])([A-Z]*)')
+def adapt_camelcase(name, seperator):
+    return _camelcase_re.sub(lambda m: seperator + m.group(0), name).lower()
+
+
+def _format_mako_attr_pair(k, v):
+    if v is True:
+        v = k
+    return ' %s="%s"' % (k, html.escape("%s" % v).replace('"', '&quot;'))
+
+
+def old_attribute_str(*args, **kwargs):
+    x = {}
+    for arg in args:
+        x.update(arg)
+    x.update(kwargs)
+    obj_ref = x.pop('__obj_ref', None)
+    obj_ref_prefix = x.pop('__obj_ref_pre', None)
+    if x.pop('__adapt_camelcase', True):
+        x = dict((adapt_camelcase(k, '-'), v) for k, v in iteritems(x))
+    x['id'] = flatten_attr_list(
+        x.pop('id', [])
+    )
+    x['class'] = list(flatten_attr_list(
+        [x.pop('class', []), x.pop('class_', [])]
+    ))
+    if obj_ref:
+        class_name = adapt_camelcase(obj_ref.__class__.__name__, '_')
+        x['id'] = filter(None, [obj_ref_prefix, class_name, getattr(obj_ref, 'id', None)])
+        x['class'].append((obj_ref_prefix + '_' if obj_ref_prefix else '') + class_name)
+    x['id'] = '_'.join(map(str, x['id']))
+    x['class'] = ' '.join(map(str, x['class']))
+    pairs = []
+    for k, v in iteritems(x):
+        pairs.extend(flatten_attr_dict(k, v))
+    pairs.sort(key=lambda pair: (_attr_sort_order.get(pair[0], 0), pair[0]))
+    return ''.join(_format_mako_attr_pair(k, v) for k, v in pairs if v)
+
+
+class Product(object):
+    id = 42
+
+
+# (name, positional dicts, keyword arguments) as templates pass them.
+mixes = [
+    ('link', [{'class': 'nav'}], dict(href='/products/42', title='Product 42')),
+    ('input', [], dict(type='checkbox', name='opt', value='1', checked=True)),
+    ('classes', [{'id': 'p', 'class': 'card'}], dict(id=42, class_=['sale', None], title='A "quoted" <title>')),
+    ('camelcase', [], dict(dataPrice='9.99', ariaLabel='Price', tabIndex=0)),
+    ('data dict', [], dict(data={'id': 42, 'price': '9.99'}, title='x')),
+    ('obj_ref', [], dict(__obj_ref=Product(), title='x')),
+]
+
+
+def main():
+    for name, args, kwargs in mixes:
+        assert runtime.attribute_str(*args, **kwargs) == old_attribute_str(*args, **kwargs)
+        old = min(timeit.repeat(lambda: old_attribute_str(*args, **kwargs), number=20000, repeat=3)) / 20000
+        new = min(timeit.repeat(lambda: runtime.attribute_str(*args, **kwargs), number=20000, repeat=3)) / 20000
+        print('%-10s old %6.2fus   new %6.2fus   %4.1fx' % (name, old * 1e6, new * 1e6, old / new))
+
+
+if __name__ == '__main__':
+    main()
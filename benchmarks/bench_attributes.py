@@ -0,0 +1,52 @@
+"""Benchmark rendering tag attributes.
+
+    python benchmarks/bench_attributes.py
+
+"""
+
+from __future__ import print_function
+
+import timeit
+
+from mako.template import Template
+
+import haml
+from haml import runtime
+
+
+# (constant attributes, dynamic keyword arguments) as a tag would produce them.
+mixes = [
+    ('link', {'class': 'nav-link'}, dict(href='/products/123', title='Product 123')),
+    ('input', {}, dict(type='checkbox', name='opt', value='1', checked=True, dataId=123)),
+    ('product', {'id': 'p', 'class': 'product card'}, dict(id=123, class_=['sale', None], dataPrice='9.99', title='A "quoted" <title>')),
+]
+
+
+def main():
+
+    print('per-call attribute formatting:')
+    for name, const, kwargs in mixes:
+        formatter = runtime.attribute_formatter(const, tuple(kwargs))
+        assert formatter(**kwargs) == runtime.attribute_str(const, **kwargs)
+        generic = min(timeit.repeat(lambda: runtime.attribute_str(const, **kwargs), number=20000, repeat=3)) / 20000
+        special = min(timeit.repeat(lambda: formatter(**kwargs), number=20000, repeat=3)) / 20000
+        print('  %-10s attribute_str %6.2fus   specialised %6.2fus   %4.1fx' % (
+            name, generic * 1e6, special * 1e6, generic / special))
+
+    source = '''
+%ul.products
+  - for product in products:
+    %li.product(id=product['id'], class_=product['classes'], dataPrice=product['price'])
+      %a.link(href=product['url'], title=product['title'])= product['title']
+'''
+    products = [dict(id=i, classes=['sale'] if i % 3 else None, price='%d.99' % i,
+                     url='/products/%d' % i, title='Product %d' % i) for i in range(1000)]
+
+    node = haml.parse_string(source)
+    template = Template(haml.generate_mako(node))
+    render = min(timeit.repeat(lambda: template.render_unicode(products=products), number=20, repeat=3)) / 20
+    print('render of %d tags: %.2fms' % (2 * len(products), render * 1e3))
+
+
+if __name__ == '__main__':
+    main()
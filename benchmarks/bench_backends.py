@@ -0,0 +1,56 @@
+"""Compare compiling and rendering with the Mako and Python backends.
+
+    python benchmarks/bench_backends.py
+
+"""
+
+from __future__ import print_function
+
+import timeit
+
+import haml
+
+
+source = '''
+!!! 5
+%html
+  %head
+    %title= title
+    :css
+      body { margin: 0; }
+  %body
+    @row(item)
+      %tr(class_=item['class'])
+        %td= item['name']
+        %td&= item['description']
+    #content.main
+      %h1 Items
+      %table
+        - for item in items:
+          +row(item)
+      - if not items:
+        %p.empty Nothing here.
+      - else:
+        %p.count ${len(items)} items
+'''
+
+data = dict(
+    title='Benchmark',
+    items=[dict(name='Item %d' % i, description='<%d>' % i, **{'class': 'odd' if i % 2 else 'even'}) for i in range(100)],
+)
+
+
+def main():
+
+    for backend in ('mako', 'python'):
+        compile_time = min(timeit.repeat(lambda: haml.compile_template(source, backend=backend), number=20, repeat=3)) / 20
+        template = haml.compile_template(source, backend=backend)
+        render_time = min(timeit.repeat(lambda: template.render_unicode(**data), number=200, repeat=3)) / 200
+        print('%-8s compile %7.2fms   render %7.3fms' % (backend, compile_time * 1e3, render_time * 1e3))
+
+    assert haml.compile_template(source, backend='mako').render_unicode(**data) == \
+        haml.compile_template(source, backend='python').render_unicode(**data)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Compare the time for a fresh process to render its first template from a
+bundle, from precompiled modules, and from source (after imports).
+
+    python benchmarks/bench_bundle.py
+
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from haml import precompile
+from haml.bundle import write_bundle
+
+
+template = '''
+%html
+  %body
+    - for i in range(n):
+      %div.row(id='row-%d' % i)
+        %span.name= names[i % len(names)]
+'''
+
+cold_start = '''
+import time
+import haml, haml.bundle, mako.lookup
+start = time.time()
+lookup = %s
+t = lookup.get_template('/page42.haml')
+t.render_unicode(n=10, names=['a'])
+print('%%.2fms' %% ((time.time() - start) * 1000))
+'''
+
+lookups = dict(
+    bundle="haml.bundle.BundleTemplateLookup(%(bundle)r)",
+    modules="mako.lookup.TemplateLookup([%(templates)r], module_directory=%(modules)r, preprocessor=haml.preprocessor)",
+    source="mako.lookup.TemplateLookup([%(templates)r], preprocessor=haml.preprocessor)",
+)
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        paths = dict(
+            templates=os.path.join(directory, 'templates'),
+            modules=os.path.join(directory, 'modules'),
+            bundle=os.path.join(directory, 'templates.bundle'),
+        )
+        os.makedirs(paths['templates'])
+        for i in range(500):
+            with open(os.path.join(paths['templates'], 'page%d.haml' % i), 'w') as fh:
+                fh.write(template)
+        precompile.compile_tree([paths['templates']], paths['modules'])
+        write_bundle(paths['bundle'], [paths['templates']])
+        print('500 templates, bundle is %.1fKB' % (os.path.getsize(paths['bundle']) / 1024.0))
+
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        for name in ('bundle', 'modules', 'source'):
+            code = cold_start % (lookups[name] % paths)
+            times = [subprocess.check_output([sys.executable, '-c', code], env=env).decode().strip() for i in range(5)]
+            print('%-8s %s' % (name, ' '.join(times)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""Benchmark escaping of attribute values.
+
+    python benchmarks/bench_escape.py
+
+"""
+
+from __future__ import print_function
+
+import html
+import timeit
+
+from haml import runtime
+
+
+values = [
+    ('path', '/products/123'),
+    ('words', 'Product 123'),
+    ('quotes', 'A "quoted" <title> & it\'s'),
+    ('long', 'lorem ipsum dolor sit amet ' * 20),
+    ('number', 123),
+]
+
+
+def old_escape(value):
+    return html.escape("%s" % value).replace('"', '&quot;')
+
+
+def main():
+    escapers = [('old', old_escape), ('pure', lambda v: runtime._escape_text_html("%s" % v))]
+    if runtime._markupsafe_escape is not None:
+        escapers.append(('markupsafe', lambda v: runtime._escape_text_markupsafe("%s" % v)))
+    escapers.append(('escape_attribute', runtime.escape_attribute))
+    for name, value in values:
+        print('%-8s' % name, end='')
+        for escaper_name, escaper in escapers:
+            assert escaper(value) == old_escape(value)
+            time = min(timeit.repeat(lambda: escaper(value), number=100000, repeat=3)) / 100000
+            print('  %s %.3fus' % (escaper_name, time * 1e6), end='')
+        print()
+
+
+if __name__ == '__main__':
+    main()
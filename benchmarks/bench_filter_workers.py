@@ -0,0 +1,43 @@
+"""Compare a process per compile with a pool of persistent workers.
+
+    python benchmarks/bench_filter_workers.py
+
+Uses the stub compiler from the tests, so this measures process overhead only.
+
+"""
+
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+import time
+
+from haml import filters
+
+
+stub = [sys.executable, os.path.join(os.path.dirname(__file__), '..', 'tests', 'stub_compiler.py')]
+sources = ['body { margin: %dpx }' % i for i in range(50)]
+
+
+def main():
+
+    start = time.time()
+    for source in sources:
+        proc = subprocess.Popen(stub, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        proc.communicate(('{"source": "%s"}\n' % source).encode('utf8'))
+    spawn = time.time() - start
+
+    pool = filters.WorkerPool(stub, size=1)
+    start = time.time()
+    for source in sources:
+        pool.compile(source)
+    pooled = time.time() - start
+    pool.close()
+
+    print('%d compiles: process each %.2fs, pooled %.2fs (%.1fx)' % (
+        len(sources), spawn, pooled, spawn / pooled))
+
+
+if __name__ == '__main__':
+    main()
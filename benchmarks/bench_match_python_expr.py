@@ -0,0 +1,47 @@
+"""Compare the tokenize-based and scanning Python expression matchers.
+
+    python benchmarks/bench_match_python_expr.py
+
+"""
+
+from __future__ import print_function
+
+import collections
+import timeit
+
+from haml.parse import Parser, parse_string
+
+
+cases = [
+    ('short attributes', ['(href=url, title="Home") Home']),
+    ('long attributes', ['(%s) content' % ', '.join('attr%d="value %d"' % (i, i) for i in range(20))]),
+    ('nested brackets', ['(data={"a": [1, 2, (3, 4)]}, class_=["x", "y"]) content']),
+    ('multiline', ['(a=1,', '  b="two",', '  c=three)']),
+]
+
+
+def bench_matcher(method, lines, number):
+    def run():
+        parser = Parser()
+        parser._source = iter(lines[1:])
+        parser._buffer = collections.deque(lines[:1])
+        getattr(parser, method)(first=set('('), last=set(')'))
+    return min(timeit.repeat(run, number=number, repeat=5)) / number
+
+
+def main():
+
+    number = 5000
+    for name, lines in cases:
+        old = bench_matcher('_match_python_expr_tokenize', lines, number)
+        new = bench_matcher('_match_python_expr', lines, number)
+        print('%-20s tokenize %7.2fus   scanner %7.2fus   %5.1fx' % (
+            name, old * 1e6, new * 1e6, old / new))
+
+    source = '\n'.join('%%a(href="/item/%d", title=item.title, class_=["a", "b"]) Item %d' % (i, i) for i in range(1000))
+    parse_time = min(timeit.repeat(lambda: parse_string(source), number=5, repeat=3)) / 5
+    print('parse of 1000 attribute-heavy lines: %.1fms' % (parse_time * 1e3))
+
+
+if __name__ == '__main__':
+    main()
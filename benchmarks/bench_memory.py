@@ -0,0 +1,64 @@
+"""Measure the memory held by parsed node trees, in bytes per node.
+
+    python benchmarks/bench_memory.py
+
+"""
+
+from __future__ import print_function
+
+import gc
+import tracemalloc
+
+import haml
+
+
+block = '''\
+-# Section %(i)d.
+%div.section(id='section-%(i)d')
+  %h2= titles[%(i)d]
+  - if items:
+    %ul
+      - for item in items:
+        %li(class_=item.kind)= item.name
+  - else:
+    %p.empty Nothing here.
+  Some plain text,
+  and some more.
+  :javascript
+    setup(%(i)d);
+    run(%(i)d);
+'''
+
+
+def count(node):
+    total = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        total += 1
+        stack.extend(node.iter_all_children())
+    return total
+
+
+def main():
+    source = ''.join(block.replace('%(i)d', str(i)) for i in range(1000))
+    lines = source.count('\n')
+    haml.parse_string(source) # Warm up any caches.
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    root = haml.parse_string(source)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    nodes = count(root)
+    print('%d lines, %d nodes' % (lines, nodes))
+    print('  tree:     %8.1fKB' % (size / 1024.0))
+    print('  per node: %8.1f bytes' % (size / float(nodes)))
+    print('  per line: %8.1f bytes' % (size / float(lines)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Compare the memory of forked workers which each compile the same templates
+against workers forked from a master which warmed them first.
+
+    python benchmarks/bench_prefork.py
+
+Linux only; memory is read from /proc.
+
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+
+from haml.lookup import HamlTemplateLookup
+from haml.prefork import memory_usage, warm
+
+
+template = '''
+%html
+  %body
+    - for i in range(n):
+      %div.row(id='row-%d' % i)
+        %span.name= names[i % len(names)]
+'''
+
+workers = 4
+
+
+def run(directory, warm_first):
+    lookup = HamlTemplateLookup([directory])
+    if warm_first:
+        report = warm(lookup, ['*.haml'])
+        print('  master warmed %d templates in %.2fs, RSS %.1fMB -> %.1fMB' % (
+            len(report['templates']), report['seconds'],
+            report['memory_before']['rss'] / 1e6, report['memory_after']['rss'] / 1e6,
+        ))
+    pids = []
+    reads = []
+    for i in range(workers):
+        read, write = os.pipe()
+        pid = os.fork()
+        if not pid:
+            os.close(read)
+            before = memory_usage()
+            for name in sorted(os.listdir(directory)):
+                lookup.get_template('/' + name).render_unicode(n=2, names=['a'])
+            after = memory_usage()
+            os.write(write, repr((before, after)).encode())
+            os._exit(0)
+        os.close(write)
+        pids.append(pid)
+        reads.append(read)
+    for pid, read in zip(pids, reads):
+        with os.fdopen(read) as fh:
+            before, after = eval(fh.read())
+        os.waitpid(pid, 0)
+        print('  worker: PSS %.1fMB -> %.1fMB, private %.1fMB -> %.1fMB' % (
+            before['pss'] / 1e6, after['pss'] / 1e6,
+            before['private'] / 1e6, after['private'] / 1e6,
+        ))
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        for i in range(300):
+            with open(os.path.join(directory, 'page%d.haml' % i), 'w') as fh:
+                fh.write(template)
+        print('cold workers:')
+        run(directory, False)
+        print('warmed master:')
+        run(directory, True)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
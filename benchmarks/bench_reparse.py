@@ -0,0 +1,67 @@
+"""Compare a full parse against an incremental reparse after editing a
+10,000 line template.
+
+    python benchmarks/bench_reparse.py
+
+"""
+
+from __future__ import print_function
+
+import timeit
+
+import haml
+from haml.parse import Parser, reparse
+
+
+block = '''\
+%div.section(id='section-%d' % i)
+  %h2= titles[i]
+  - if items:
+    %ul
+      - for item in items:
+        %li(class_=item.kind)= item.name
+  - else:
+    %p.empty Nothing here.
+  :javascript
+    setup(%(i)d);
+'''
+
+
+def main():
+    lines = []
+    while len(lines) < 10000:
+        lines.extend(block.replace('%(i)d', str(len(lines))).splitlines())
+    middle = len(lines) // 2 + 1
+    original = lines[middle]
+    edited = original + ' Edited.'
+    print('%d lines; editing line %d: %r' % (len(lines), middle + 1, original))
+
+    root = Parser().parse(lines)
+    number = 5
+    full = min(timeit.repeat(lambda: Parser().parse(lines), number=1, repeat=number))
+    print('  full parse:            %8.2fms' % (full * 1000))
+
+    state = dict(root=root, lines=lines, text=original)
+
+    def change_line():
+        # Alternate between the two versions of the line.
+        text = edited if state['text'] == original else original
+        state['lines'][middle] = state['text'] = text
+        state['root'] = reparse(state['root'], state['lines'], middle, middle + 1, middle + 1)
+
+    def insert_line():
+        state['lines'].insert(middle, '  %p Inserted.')
+        state['root'] = reparse(state['root'], state['lines'], middle, middle, middle + 1)
+        del state['lines'][middle]
+        state['root'] = reparse(state['root'], state['lines'], middle, middle + 1, middle)
+
+    change = min(timeit.repeat(change_line, number=1, repeat=number * 10))
+    print('  reparse, line changed: %8.2fms (%.0fx)' % (change * 1000, full / change))
+    insert = min(timeit.repeat(insert_line, number=1, repeat=number * 10)) / 2
+    print('  reparse, line added:   %8.2fms (%.0fx)' % (insert * 1000, full / insert))
+
+    assert haml.generate_mako(state['root']) == haml.generate_mako(Parser().parse(state['lines']))
+
+
+if __name__ == '__main__':
+    main()
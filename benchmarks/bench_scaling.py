@@ -0,0 +1,48 @@
+"""Time parsing and generating very deep and very large documents.
+
+    python benchmarks/bench_scaling.py
+
+Each stage must finish within its stated budget (in seconds); the budgets are
+roughly 5x what a modern laptop needs.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from mako.template import Template
+
+import haml
+from haml.codegen import Generator
+
+
+def timed(label, budget, func, *args):
+    start = time.time()
+    result = func(*args)
+    elapsed = time.time() - start
+    print('  %-10s %7.2fs (budget %ds)' % (label, elapsed, budget))
+    assert elapsed < budget, '%s took %.2fs' % (label, elapsed)
+    return result
+
+
+def main():
+
+    print('10,000 deep (recursion limit %d):' % sys.getrecursionlimit())
+    source = '%b ' * 10000 + 'x'
+    node = timed('parse', 5, haml.parse_string, source)
+    mako = timed('generate', 5, Generator(indent_str='').generate, node)
+    template = timed('compile', 30, Template, mako)
+    html = timed('render', 5, template.render_unicode)
+    assert html.count('<b>') == 10000
+
+    print('1,000,000 nodes:')
+    source = '%ul\n' + '  %li.item\n    %a(href=url) item\n' * 333333
+    node = timed('parse', 120, haml.parse_string, source)
+    mako = timed('generate', 180, Generator().generate, node)
+    assert mako.count('<li') == 333333
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Compare loading serialised node trees against parsing their source, and
+against pickle, over the templates in the conformance tests.
+
+    python benchmarks/bench_serialize.py
+
+"""
+
+from __future__ import print_function
+
+import ast
+import os
+import pickle
+import timeit
+
+import haml
+from haml.serialize import dumps, loads
+
+
+def corpus():
+    """Yield the HAML sources passed to the assertions in the conformance tests."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'test_conformance.py')
+    with open(path) as fh:
+        tree = ast.parse(fh.read())
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Call) and
+            getattr(node.func, 'attr', '') in ('assertMako', 'assertHTML') and
+            node.args
+        ):
+            try:
+                source = ast.literal_eval(node.args[0])
+            except ValueError:
+                continue
+            try:
+                haml.parse_string(source)
+            except Exception:
+                continue
+            yield source
+
+
+def main():
+    sources = list(corpus())
+    # A larger template, from the conformance sources end to end.
+    sources.append('\n'.join(sources * 20))
+    trees = [haml.parse_string(source) for source in sources]
+    dumped = [dumps(tree) for tree in trees]
+    pickled = [pickle.dumps(tree, pickle.HIGHEST_PROTOCOL) for tree in trees]
+    print('%d templates; %d bytes of source, %d serialised, %d pickled' % (
+        len(sources), sum(map(len, sources)), sum(map(len, dumped)), sum(map(len, pickled)),
+    ))
+
+    for label, indices in (('corpus', range(len(sources) - 1)), ('large', [len(sources) - 1])):
+        number = 20
+        def time(func, items):
+            return min(timeit.repeat(lambda: [func(items[i]) for i in indices], number=number, repeat=5)) / number
+        parse = time(haml.parse_string, sources)
+        load = time(loads, dumped)
+        unpickle = time(pickle.loads, pickled)
+        dump = time(dumps, trees)
+        print('%s:' % label)
+        print('  parse_string: %8.3fms' % (parse * 1000))
+        print('  loads:        %8.3fms (%.1fx)' % (load * 1000, parse / load))
+        print('  pickle.loads: %8.3fms (%.1fx)' % (unpickle * 1000, parse / unpickle))
+        print('  dumps:        %8.3fms' % (dump * 1000))
+
+
+if __name__ == '__main__':
+    main()
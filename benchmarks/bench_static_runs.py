@@ -0,0 +1,68 @@
+"""Count Mako writer calls with and without static run coalescing.
+
+    python benchmarks/bench_static_runs.py [FILENAME]
+
+"""
+
+from __future__ import print_function
+
+import ast
+import sys
+import timeit
+
+from mako.template import Template
+
+import haml
+
+
+source = '''
+!!! 5
+-!
+    def title_case(x):
+        return x.title()
+%html
+  %head
+    %meta(charset="utf-8")
+    -# Scripts are loaded at the end.
+    %title= title_case(title)
+    -! SECTIONS = ['one', 'two', 'three']
+    %link(rel="stylesheet", href="/site.css")
+  %body
+    #header
+      / The header
+      %h1 Static header
+      -! FOOTER = 'footer'
+      %ul.nav
+        %li
+          %a(href="/") Home
+        %li
+          %a(href="/about") About
+    - for section in SECTIONS:
+      .section= section
+    #footer= FOOTER
+'''
+
+
+def count_writes(code):
+    """Count the calls to Mako's writer in the compiled template module."""
+    return sum(
+        1 for node in ast.walk(ast.parse(code))
+        if isinstance(node, ast.Call) and getattr(node.func, 'id', None) == '__M_writer'
+    )
+
+
+def main(argv=None):
+
+    argv = sys.argv if argv is None else argv
+    text = open(argv[1]).read() if len(argv) > 1 else source
+
+    for coalesce in (False, True):
+        mako = haml.generate_mako(haml.parse_string(text), coalesce_static=coalesce)
+        template = Template(mako)
+        render_time = min(timeit.repeat(lambda: template.render_unicode(title='home'), number=2000, repeat=3)) / 2000
+        print('coalesce_static=%-5s  %3d writer calls   render %6.1fus' % (
+            coalesce, count_writes(template.code), render_time * 1e6))
+
+
+if __name__ == '__main__':
+    main()
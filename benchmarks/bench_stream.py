@@ -0,0 +1,65 @@
+"""Compare time to first byte and peak memory of rendering versus streaming.
+
+    python benchmarks/bench_stream.py
+
+"""
+
+from __future__ import print_function
+
+import time
+import tracemalloc
+
+import haml
+from haml.stream import iter_render
+
+
+source = '''
+!!! 5
+%html
+  %head
+    %title Report
+  !flush
+  %body
+    %table
+      - for chunk in chunks:
+        - for row in chunk:
+          %tr
+            %td= row[0]
+            %td= row[1]
+            %td= row[2]
+        !flush
+'''
+
+rows = [(i, 'name %d' % i, 'value ' * 10) for i in range(100000)]
+chunks = [rows[i:i + 1000] for i in range(0, len(rows), 1000)]
+
+
+def main():
+    for backend in ('mako', 'python'):
+        template = haml.compile_template(source, backend=backend)
+
+        tracemalloc.start()
+        start = time.time()
+        html = template.render_unicode(chunks=chunks)
+        total = time.time() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('%-6s render: %.2fs, %.1fMB output, peak %.1fMB' % (backend, total, len(html) / 1e6, peak / 1e6))
+        del html
+
+        tracemalloc.start()
+        start = time.time()
+        first = None
+        size = 0
+        for chunk in iter_render(template, dict(chunks=chunks), encoding='utf-8'):
+            if first is None:
+                first = time.time() - start
+            size += len(chunk)
+        total = time.time() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('%-6s stream: first chunk %.4fs, all %.2fs, peak %.1fMB' % (backend, first, total, peak / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Time whitespace removal as the number of strip operations grows.
+
+    python benchmarks/bench_strip.py
+
+The time per strip should stay flat as the count doubles.
+
+"""
+
+from __future__ import print_function
+
+import time
+
+import haml
+from haml import nodes
+from haml.codegen import Generator
+
+
+class Tokens(nodes.Base):
+
+    """A node which renders a given list of tokens."""
+
+    def __init__(self, tokens):
+        super(Tokens, self).__init__()
+        self.tokens = tokens
+
+    def render(self, engine):
+        return iter(self.tokens)
+
+
+def timed(label, func, arg, count):
+    start = time.time()
+    func(arg)
+    elapsed = time.time() - start
+    print('  %-40s %7.3fs %7.2fus/strip' % (label, elapsed, elapsed * 1e6 / count))
+
+
+def main():
+    generator = Generator()
+    for count in (10000, 20000, 40000, 80000):
+        print('%d strips:' % count)
+
+        # Output which writes nothing (e.g. code), then whitespace to strip;
+        # every strip looks back past everything since the last content.
+        tokens = ['<p>'] + [Generator.no_strip('<% x %>'), '\n  ', Generator.lstrip] * count
+        timed('tokens: no_strip, whitespace, lstrip', generator.generate, Tokens(tokens), count)
+
+        # Tags stripping the whitespace around themselves and within.
+        source = '%div\n' + '  %b<> x\n  !flush\n' * (count // 2)
+        timed('template: %b<> and !flush', generator.generate, haml.parse_string(source), count)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,23 @@
+__version__ = '1.2.1'
 
-from .parse import parse_string
+from .parse import parse_string, parse_file, parse_iter, reparse
 from .codegen import generate_mako
 
 def preprocessor(source):
     return generate_mako(parse_string(source))
+
+def compile_template(source, backend='mako', **kwargs):
+    """Compile HAML source into a template object with the chosen backend.
+
+    The "mako" backend returns a :class:`mako.template.Template`, and the
+    "python" backend a :class:`haml.pycodegen.Template`; both have the same
+    `render` and `render_unicode` methods.
+
+    """
+    if backend == 'mako':
+        from mako.template import Template
+        return Template(source, preprocessor=preprocessor, **kwargs)
+    elif backend == 'python':
+        from .pycodegen import Template
+        return Template(source, **kwargs)
+    raise ValueError('unknown backend %r' % backend)
@@ -0,0 +1,131 @@
+"""Compile and render templates from asyncio code.
+
+Compiling a template can take long enough to stall every other task on the
+event loop, so :func:`compile_async` does it on a bounded pool of threads.
+Concurrent requests for the same template share one compilation, but the
+result isn't kept once they have it; hold on to templates (or use a
+:class:`haml.lookup.HamlTemplateLookup`) to avoid compiling them again::
+
+    template = await haml.aio.compile_async('templates/index.haml')
+    async for chunk in haml.aio.render_async(template, dict(user=user)):
+        await send(chunk)
+
+Rendering (including any filter work, e.g. compiling sass) runs on a second
+pool, with output arriving at each ``!flush`` point (see :mod:`haml.stream`).
+A render waiting for a slow consumer holds one of its threads, so it has
+its own pool, and can't hold up compilation.
+
+This module requires Python 3.7+, so isn't imported by :mod:`haml`.
+
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import threading
+import weakref
+
+from . import compile_template
+from .stream import _Closed, render_to
+
+
+_max_workers = 4
+_max_render_workers = 16
+_executors = {}
+_executor_lock = threading.Lock()
+
+# Compilations in progress, per event loop.
+_inflight = weakref.WeakKeyDictionary()
+
+
+def configure(max_workers=_max_workers, max_render_workers=_max_render_workers):
+    """Set the number of threads which compile, and which render."""
+    with _executor_lock:
+        old = list(_executors.values())
+        _executors['compile'] = concurrent.futures.ThreadPoolExecutor(max_workers)
+        _executors['render'] = concurrent.futures.ThreadPoolExecutor(max_render_workers)
+    for executor in old:
+        executor.shutdown(wait=False)
+
+
+def _get_executor(name):
+    executor = _executors.get(name)
+    if executor is None:
+        with _executor_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                max_workers = _max_render_workers if name == 'render' else _max_workers
+                executor = _executors[name] = concurrent.futures.ThreadPoolExecutor(max_workers)
+    return executor
+
+
+def _compile_file(path, backend, options):
+    # Decoded as Mako's lookups do, rather than by the locale.
+    with open(path, 'rb') as fh:
+        source = fh.read().decode(options.get('input_encoding') or 'utf-8')
+    return compile_template(source, backend, **options)
+
+
+async def compile_async(path, backend='mako', **options):
+    """Compile the template at the path without blocking the event loop.
+
+    Any options are passed to :func:`haml.compile_template`. Calls which
+    overlap share one compilation; later calls compile again.
+
+    """
+    loop = asyncio.get_running_loop()
+    key = (os.path.abspath(path), backend, repr(sorted(options.items())))
+    inflight = _inflight.setdefault(loop, {})
+    future = inflight.get(key)
+    if future is None:
+        future = inflight[key] = loop.run_in_executor(_get_executor('compile'), _compile_file, path, backend, options)
+        future.add_done_callback(lambda f: inflight.pop(key, None))
+    # One caller being cancelled mustn't cancel the others.
+    return await asyncio.shield(future)
+
+
+async def render_async(template, data=None, encoding=None, max_pending=4):
+    """Render a template on the render pool, yielding its output in chunks.
+
+    Chunks are text, or bytes if an `encoding` is given. At most
+    `max_pending` chunks are buffered; beyond that the render waits (on its
+    thread) for them to be consumed.
+
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(max_pending)
+    closed = threading.Event()
+
+    def put(item):
+        if closed.is_set():
+            raise _Closed()
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def run():
+        try:
+            try:
+                render_to(template, dict(data or {}), lambda chunk: put(('chunk', chunk)))
+            except _Closed:
+                raise
+            except Exception as e:
+                put(('error', e))
+            else:
+                put(('end', None))
+        except _Closed:
+            pass
+
+    loop.run_in_executor(_get_executor('render'), run)
+    try:
+        while True:
+            kind, value = await queue.get()
+            if kind == 'chunk':
+                yield value.encode(encoding) if encoding else value
+            elif kind == 'error':
+                raise value
+            else:
+                return
+    finally:
+        closed.set()
+        # Unblock the renderer, so that it sees we've gone.
+        while not queue.empty():
+            queue.get_nowait()
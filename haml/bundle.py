@@ -0,0 +1,236 @@
+"""Pack a tree of compiled HAML templates into a single bundle file.
+
+A bundle holds an index of template uris followed by the compiled (and
+marshalled) code object of each template's Mako module. It is opened with one
+``open()`` and mapped into memory, and each template is unmarshalled only when
+it is first used, so a freshly started (or forked) worker can serve any
+template without scanning directories or compiling anything::
+
+    haml-compile --bundle templates.bundle templates/
+
+    lookup = BundleTemplateLookup('templates.bundle')
+    lookup.get_template('/page.haml').render(...)
+
+Code objects are specific to the version of Python which made them; a bundle
+from another version raises :class:`BundleError` when opened. The bundle also
+records the Mako arguments its templates were compiled with (see
+:func:`haml.precompile.compile_args`), and a lookup given other arguments
+raises :class:`BundleError` too.
+
+"""
+
+import linecache
+import marshal
+import mmap
+import struct
+import time
+import traceback
+import types
+
+import mako
+from mako.template import ModuleTemplate
+
+from .cache import atomic_write
+from .lookup import HamlTemplateLookup
+from .precompile import compile_args, compile_module_source, find_templates, run_jobs
+
+try:
+    from importlib.util import MAGIC_NUMBER as _python_magic
+except ImportError: # Python 2
+    from imp import get_magic
+    _python_magic = get_magic()
+
+
+_magic = b'PyHAML bundle 2\n'
+_length = struct.Struct('<I')
+
+
+class BundleError(ValueError):
+    """A bundle is malformed, or was made by another Python or Mako version."""
+
+
+def _bundle_job(args):
+    path, uri, template_args = args
+    start = time.time()
+    try:
+        with open(path, 'rb') as fh:
+            source = fh.read()
+        code = compile_module_source(source, path, uri, template_args)
+        # Both sources are kept for tracebacks, which Mako maps back to the
+        # template through the module's source.
+        data = marshal.dumps((
+            code, source.decode(template_args['input_encoding'] or 'utf8'),
+            compile(code, '<bundled %s>' % uri, 'exec'),
+        ))
+    except Exception:
+        return uri, 'failed', time.time() - start, 0, traceback.format_exc(), None
+    return uri, 'compiled', time.time() - start, len(source), None, data
+
+
+def write_bundle(path, roots, jobs=None, suffix='.haml', callback=None, template_args=None):
+    """Compile every template within the roots into a bundle at `path`.
+
+    Templates are compiled with the given `template_args`, over a pool of
+    processes, as by :func:`haml.precompile.compile_tree`, and the bundle is
+    replaced atomically. Returns a list of (uri, status, seconds, size, error)
+    for each template, also passing each to `callback` as it completes;
+    templates which fail to compile are left out of the bundle.
+
+    """
+    args = compile_args(template_args)
+    work = []
+    for root in roots:
+        for template_path, uri in find_templates(root, suffix):
+            work.append((template_path, uri, args))
+
+    results = []
+    blobs = {}
+    for result in run_jobs(_bundle_job, work, jobs):
+        if result[5] is not None:
+            blobs[result[0]] = result[5]
+        result = result[:5]
+        results.append(result)
+        if callback:
+            callback(result)
+
+    templates = {}
+    offset = 0
+    for uri in sorted(blobs):
+        templates[uri] = (offset, len(blobs[uri]))
+        offset += len(blobs[uri])
+    index = marshal.dumps(dict(
+        python=_python_magic, mako=mako.__version__, compile_args=args, templates=templates,
+    ))
+
+    data = [_magic, _length.pack(len(index)), index]
+    data.extend(blobs[uri] for uri in sorted(blobs))
+    atomic_write(path, b''.join(data))
+    return results
+
+
+class Bundle(object):
+
+    """A bundle file, mapped into memory.
+
+    Only the index is read when opening; the code of each template is read by
+    :meth:`code` when asked for.
+
+    """
+
+    def __init__(self, path):
+        start = time.time()
+        self.path = path
+        with open(path, 'rb') as fh:
+            self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._templates, self.compile_args, self._data_start = self._read_index()
+        except Exception:
+            self._map.close()
+            raise
+        self.open_time = time.time() - start
+
+    def _read_index(self):
+        header = len(_magic) + _length.size
+        if self._map[:len(_magic)] != _magic:
+            raise BundleError('%r is not a PyHAML bundle' % self.path)
+        length, = _length.unpack(self._map[len(_magic):header])
+        try:
+            index = marshal.loads(self._map[header:header + length])
+        except (EOFError, ValueError, TypeError):
+            raise BundleError('%r has a corrupt index' % self.path)
+        if index['python'] != _python_magic or index['mako'] != mako.__version__:
+            raise BundleError('%r was made by another version of Python or Mako; rebuild it' % self.path)
+        return index['templates'], index['compile_args'], header + length
+
+    def __contains__(self, uri):
+        return uri in self._templates
+
+    def __len__(self):
+        return len(self._templates)
+
+    def uris(self):
+        return sorted(self._templates)
+
+    def read(self, uri):
+        """Return the module source, template source and module code object of
+        the given template."""
+        offset, length = self._templates[uri]
+        start = self._data_start + offset
+        return marshal.loads(self._map[start:start + length])
+
+    def code(self, uri):
+        """Return the code object of the given template's module."""
+        return self.read(uri)[2]
+
+    def close(self):
+        self._map.close()
+
+
+class BundleTemplateLookup(HamlTemplateLookup):
+
+    """A template lookup which serves templates from a bundle.
+
+    `bundle` is a :class:`Bundle` or the path to one. Templates not in the
+    bundle are looked up (and compiled) within `directories`, if any, as by
+    :class:`haml.lookup.HamlTemplateLookup`. Templates from the bundle are
+    never checked for changes. The lookup's compile arguments (e.g.
+    `default_filters` and `imports`) must be those the bundle was written with.
+
+    The time taken to load each template from the bundle is kept in
+    `load_times`, by uri.
+
+    """
+
+    def __init__(self, bundle, directories=None, **kwargs):
+        super(BundleTemplateLookup, self).__init__(directories, **kwargs)
+        if not isinstance(bundle, Bundle):
+            bundle = Bundle(bundle)
+        args = compile_args(dict((name, self.template_args[name]) for name in self.compile_args))
+        differ = sorted(name for name in args if args[name] != bundle.compile_args.get(name))
+        if differ:
+            raise BundleError('%r was compiled with other %s than the lookup' % (bundle.path, ', '.join(differ)))
+        self.bundle = bundle
+        self.load_times = {}
+
+    def stats(self):
+        stats = super(BundleTemplateLookup, self).stats()
+        stats['bundle'] = dict(
+            templates=len(self.bundle),
+            loaded=len(self.load_times),
+            open_time=self.bundle.open_time,
+            load_time=sum(self.load_times.values()),
+        )
+        return stats
+
+    def get_template(self, uri):
+        key = '/' + uri.lstrip('/')
+        if key in self.bundle:
+            try:
+                return self._collection[key]
+            except KeyError:
+                return self._load_bundled(key)
+        return super(BundleTemplateLookup, self).get_template(uri)
+
+    def _load_bundled(self, uri):
+        with self._mutex:
+            try:
+                return self._collection[uri]
+            except KeyError:
+                pass
+            start = time.time()
+            module = types.ModuleType(uri)
+            source, template_source, code = self.bundle.read(uri)
+            linecache.cache[code.co_filename] = (len(source), None, source.splitlines(True), code.co_filename)
+            exec(code, module.__dict__)
+            template = ModuleTemplate(
+                module,
+                template_filename=module._template_filename,
+                module_filename=code.co_filename,
+                module_source=source,
+                template_source=template_source,
+                lookup=self,
+                **dict((name, self.template_args[name]) for name in self.module_template_args)
+            )
+            self._collection[uri] = template
+            self.load_times[uri] = time.time() - start
+            return template
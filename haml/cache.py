@@ -0,0 +1,329 @@
+"""Caches for the HAML to Mako compilation step.
+
+Mako calls its preprocessor every time it compiles a template, and for HAML
+that means re-parsing and re-generating source which rarely changes. A
+:class:`CachedPreprocessor` is a drop-in replacement for
+:func:`haml.preprocessor` which remembers the generated Mako by a hash of the
+HAML source, the package version, and the generator options::
+
+    from haml.cache import CachedPreprocessor, MemoryCache
+    lookup = TemplateLookup(['.'], preprocessor=CachedPreprocessor(MemoryCache(1024)))
+
+"""
+
+import collections
+import errno
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+
+import six
+from six import text_type
+
+from . import __version__, nodes
+from .codegen import generate_mako
+from .parse import parse_string
+
+
+def cache_key(source, **options):
+    """Return a hex digest identifying the compiled form of the given source.
+
+    The digest covers the PyHAML version and any generator options, so that
+    upgrading or reconfiguring never serves stale output.
+
+    """
+    hash_ = hashlib.sha1()
+    hash_.update(('PyHAML %s\n' % __version__).encode('utf8'))
+    for name in sorted(options):
+        hash_.update(('%s=%r\n' % (name, options[name])).encode('utf8'))
+    hash_.update(b'\n')
+    if isinstance(source, text_type):
+        source = source.encode('utf8')
+    hash_.update(source)
+    return hash_.hexdigest()
+
+
+class _Marker(str):
+    pass
+
+_end_node = _Marker(')')
+_start_list = _Marker('[')
+_end_list = _Marker(']')
+# Nodes which render nothing still count towards whether their parent has
+# children (e.g. `%pre>` and `%pre>` with a `-#` comment within differ).
+_hidden = _Marker('-')
+
+
+def fingerprint(node):
+    """Return a hex digest of what the node tree renders.
+
+    Only the attributes named by each node's `_fields` are covered, so trees
+    parsed from sources which differ only in ``-#`` comments (among other
+    content), blank lines or the style of indentation have the same
+    fingerprint.
+
+    """
+    hash_ = hashlib.sha1()
+    stack = [node]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, nodes.Base):
+            if item._fields is None:
+                continue
+            hash_.update(('(%s' % type(item).__name__).encode('utf8'))
+            stack.append(_end_node)
+            for name in reversed(item._fields):
+                value = getattr(item, name)
+                if isinstance(value, nodes.Base) and value._fields is None:
+                    value = _hidden
+                stack.append(value)
+                stack.append(_Marker(' %s=' % name))
+        elif isinstance(item, (list, tuple)):
+            hash_.update(_start_list.encode('utf8'))
+            stack.append(_end_list)
+            visible = [x for x in item if not (isinstance(x, nodes.Base) and x._fields is None)]
+            if item and not visible:
+                visible.append(_hidden)
+            stack.extend(reversed(visible))
+        elif isinstance(item, _Marker):
+            hash_.update(item.encode('utf8'))
+        else:
+            hash_.update(repr(item).encode('utf8'))
+    return hash_.hexdigest()
+
+
+def semantic_key(source, **options):
+    """Return a key as by :func:`cache_key`, but of the parsed HAML.
+
+    Sources whose trees have the same :func:`fingerprint` share a key, so
+    e.g. editing a comment doesn't invalidate the compiled template. Falls
+    back to the source itself if it doesn't parse.
+
+    """
+    try:
+        text = source.decode('utf8') if isinstance(source, bytes) else source
+        tree = fingerprint(parse_string(text))
+    except Exception:
+        return cache_key(source, **options)
+    return cache_key(tree, fingerprint=True, **options)
+
+
+class BaseCache(object):
+
+    """Common interface and hit/miss/eviction counters for caches."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value, or None if it isn't present."""
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        raise NotImplementedError()
+
+    def _get(self, key):
+        raise NotImplementedError()
+
+    def stats(self):
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+        )
+
+
+class MemoryCache(BaseCache):
+
+    """An in-memory LRU cache holding at most `maxsize` entries."""
+
+    def __init__(self, maxsize=512):
+        super(MemoryCache, self).__init__()
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _get(self, key):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.evictions += len(self._data)
+            self._data.clear()
+
+
+def _replace(src, dst):
+    # os.replace is atomic on every platform, but only exists on Python 3.
+    # On POSIX a rename will also atomically replace the destination.
+    getattr(os, 'replace', os.rename)(src, dst)
+
+
+def atomic_write(path, data):
+    """Write bytes to the given path such that readers never see a partial file."""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        _replace(tmp_path, path)
+    except:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class FileSystemCache(BaseCache):
+
+    """A cache storing each entry as a file within a directory.
+
+    Writes are atomic, so many processes may safely share one directory.
+
+    """
+
+    def __init__(self, directory, suffix='.mako'):
+        super(FileSystemCache, self).__init__()
+        self.directory = directory
+        self.suffix = suffix
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _get(self, key):
+        try:
+            with open(self._path(key), 'rb') as fh:
+                return fh.read().decode('utf8')
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def set(self, key, value):
+        atomic_write(self._path(key), value.encode('utf8'))
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                os.unlink(os.path.join(self.directory, name))
+                self.evictions += 1
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+
+    """Runs at most one call at a time for each key.
+
+    Callers which ask for a key while a call for it is running wait for that
+    call, and get its result (or exception), rather than repeating the work::
+
+        flights = SingleFlight()
+        template = flights.do(uri, compile_template, uri)
+
+    `calls` counts the calls made, and `shared` the callers which waited on
+    another's instead.
+
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            waiting = call is not None
+            if waiting:
+                self.shared += 1
+            else:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+        if waiting:
+            call.done.wait()
+            if call.exc_info is not None:
+                six.reraise(*call.exc_info)
+            return call.result
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        return dict(calls=self.calls, shared=self.shared)
+
+
+class CachedPreprocessor(object):
+
+    """A caching replacement for :func:`haml.preprocessor`.
+
+    Any keyword arguments are passed to the :class:`~haml.codegen.Generator`,
+    and are part of the cache key. Threads which miss on the same source at
+    once share one generation.
+
+    """
+
+    def __init__(self, cache=None, **options):
+        self.cache = MemoryCache() if cache is None else cache
+        self.options = options
+        self.flights = SingleFlight()
+
+    def __call__(self, source):
+        key = cache_key(source, **self.options)
+        mako = self.cache.get(key)
+        if mako is None:
+            mako = self.flights.do(key, self._generate, source, key)
+        return mako
+
+    def _generate(self, source, key):
+        # Another flight may have finished since we missed (uncounted, as
+        # the miss already was).
+        mako = self.cache._get(key)
+        if mako is None:
+            mako = generate_mako(parse_string(source), **self.options)
+            self.cache.set(key, mako)
+        return mako
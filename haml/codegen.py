@@ -1,11 +1,13 @@
 from itertools import chain
+import ast
 import cgi
 import collections
 import re
 
-from six import string_types
+from six import string_types, text_type
 from six.moves import xrange
 
+from . import filters
 from . import runtime
 
 
@@ -20,13 +22,74 @@ class GeneratorSentinal(object):
         return '<Sentinal at 0x%x>' % id(self)
 
 
+# The kinds of token, for whitespace removal: text, which may be stripped;
+# no_strip strings, which are passed over; and sentinels.
+_TEXT, _NO_STRIP, _SENTINEL = range(3)
+
+
+_identifier_re = re.compile(r'[A-Za-z_]\w*')
+
+
+def _code_identifiers(root):
+    """Return every identifier-like word within the Python code of a tree.
+
+    This is deliberately loose (e.g. words within strings count) as it is
+    used to rule out names which the template might define or pass in.
+
+    """
+    names = set()
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        for code in node.iter_code():
+            names.update(_identifier_re.findall(code))
+        stack.extend(node.iter_all_children())
+    return names
+
+
+def _keyword_names(kwargs_expr):
+    """Return the names if the expression is only plain keyword arguments."""
+    try:
+        call = ast.parse('func(%s)' % kwargs_expr, mode='eval').body
+    except SyntaxError:
+        return
+    if call.args or getattr(call, 'starargs', None) or getattr(call, 'kwargs', None):
+        return
+    names = tuple(x.arg for x in call.keywords)
+    if None not in names:
+        return names
+
+
 class Generator(object):
     
     class no_strip(str):
         """A string class that will not have space removed."""
         def __repr__(self):
             return 'no_strip(%s)' % str.__repr__(self)
-    
+
+    class opaque(text_type):
+        """A string which is passed through untouched.
+
+        It is never stripped (so it halts whitespace removal like any other
+        content), and never merged with neighbouring text. If `hoist` is set
+        it is moved to the end of the document, so that it doesn't split the
+        static text around it.
+
+        """
+
+        def __new__(cls, value, hoist=False):
+            self = text_type.__new__(cls, value)
+            self.hoist = hoist
+            return self
+
+        def __repr__(self):
+            return '%s(%s)' % (self.__class__.__name__, text_type.__repr__(self))
+
+        def strip(self, chars=None):
+            return self
+
+        lstrip = rstrip = strip
+
     indent_str = '\t'
     endl = '\n'
     endl_no_break = '\\\n'
@@ -39,57 +102,158 @@ class Generator(object):
     lstrip = GeneratorSentinal(name='lstrip')
     rstrip = GeneratorSentinal(name='rstrip')
 
+    # Merge runs of static text into single strings (and so single writes).
+    coalesce_static = True
+
+    # Run pure filters over blocks without expressions at compile time,
+    # except for those named here.
+    evaluate_filters = True
+    runtime_filters = ()
+
+    # Filters which are bound once per module, rather than looked up each
+    # time they run (unless the template might define its own).
+    filter_registry = filters.names
+
+    def __init__(self, **options):
+        # Options simply override the class attributes above (e.g. indent_str).
+        for name, value in options.items():
+            if not hasattr(self, name):
+                raise TypeError('unknown generator option %r' % name)
+            setattr(self, name, value)
+
     def generate(self, node):
         return ''.join(self.generate_iter(node))
 
     def generate_iter(self, node):
-        buffer = []
-        r_stripping = False
+        tokens = self.iter_stripped(node)
+        if self.coalesce_static:
+            tokens = self.coalesce(tokens)
+        return tokens
+
+    def coalesce(self, tokens):
+        """Merge each run of plain text, and move hoisted tokens to the end."""
+        run = []
+        hoisted = []
+        for token in tokens:
+            if isinstance(token, self.opaque):
+                if token.hoist:
+                    hoisted.append(token)
+                    continue
+                if run:
+                    yield ''.join(run)
+                    run = []
+                yield token
+            else:
+                run.append(token)
+        if run:
+            yield ''.join(run)
+        for token in hoisted:
+            yield token
+
+    def _token_kind(self, cls):
+        """Return how whitespace removal treats tokens of the given type."""
+        if issubclass(cls, GeneratorSentinal):
+            return _SENTINEL
+        if issubclass(cls, self.no_strip):
+            return _NO_STRIP
+        if issubclass(cls, string_types):
+            return _TEXT
+
+    def iter_stripped(self, node):
+        """Render the node, and apply whitespace removal to the tokens."""
+        # State for this document. Generators may be reused, but are only
+        # good for one document (and thread) at a time.
+        self.module_code = []
+        self._attr_formatters = {}
+        self._root = node
+        self._identifiers = None
+        self._bound_filters = set()
         self.depth = 0
         self.node_data = {}
+
+        # Tokens are dispatched on their kind, found once per type.
+        kinds = {}
+
+        # Tokens are held back while an lstrip may yet remove whitespace
+        # from them, i.e. since the last with non-white content. The first
+        # `done` of them have already been through an lstrip, which leaves
+        # that content (rstripped, if `has_head`) followed by no_strip
+        # strings, which are ignored. So each lstrip only looks at the
+        # tokens since the last, and the work is linear overall.
+        buffer = []
+        done = 0
+        has_head = False
+        r_stripping = False
+
         for token in node.render(self):
-            if isinstance(token, GeneratorSentinal):
-                if token in self._increment_tokens:
-                    self.depth += token.delta
-                elif token is self.lstrip:
-                    # Work backwards through the buffer rstripping until
+            cls = type(token)
+            kind = kinds.get(cls)
+            if kind is None:
+                kind = kinds[cls] = self._token_kind(cls)
+
+            if kind == _TEXT:
+                # If we have encountered an rstrip token in the past, then
+                # we are removing all leading whitespace on incoming tokens.
+                if r_stripping:
+                    token = token.lstrip()
+                    if token:
+                        r_stripping = False
+                if not token:
+                    continue
+                # Flush the buffer if we have non-white content as no
+                # lstrip command will get past this new token anyways.
+                if token.strip():
+                    for x in buffer:
+                        yield x
+                    buffer = [token]
+                    done = 0
+                    has_head = False
+                else:
+                    buffer.append(token)
+
+            elif kind == _NO_STRIP:
+                if token:
+                    buffer.append(token)
+
+            elif kind == _SENTINEL:
+                if token is self.lstrip:
+                    # Work backwards through the new tokens, rstripping until
                     # we hit some non-white content. Then flush everything
-                    # in the buffer upto that point. We need to leave the
-                    # last one incase we get a "line_continuation" command.
-                    # Remember that no_strip strings are simply ignored.
-                    for i in xrange(len(buffer) - 1, -1, -1):
-                        if isinstance(buffer[i], self.no_strip):
+                    # in the buffer up to that point. We need to leave the
+                    # last one in case we get a "line_continuation" command.
+                    kept = []
+                    for i in xrange(len(buffer) - 1, done - 1, -1):
+                        x = buffer[i]
+                        if kinds[type(x)] == _NO_STRIP:
+                            kept.append(x)
                             continue
-                        buffer[i] = buffer[i].rstrip()
-                        if buffer[i]:
-                            for x in buffer[:i]:
-                                yield x
-                            buffer = buffer[i:]
+                        x = x.rstrip()
+                        if x:
+                            for y in buffer[:i]:
+                                yield y
+                            kept.append(x)
+                            kept.reverse()
+                            buffer = kept
+                            has_head = True
                             break
+                    else:
+                        # The new tokens were only whitespace (now removed)
+                        # and no_strip strings; continue to the content.
+                        del buffer[done:]
+                        if has_head:
+                            buffer[0] = buffer[0].rstrip()
+                        buffer.extend(reversed(kept))
+                    done = len(buffer)
                 elif token is self.rstrip:
                     r_stripping = True
+                elif token in self._increment_tokens:
+                    self.depth += token.delta
                 else:
                     raise ValueError('unexpected %r' % token)
-            elif isinstance(token, string_types):
-                # If we have encountered an rstrip token in the past, then
-                # we are removing all leading whitespace on incoming tokens.
-                # We must completely ignore no_strip strings as they go by.
-                if r_stripping:
-                    if not isinstance(token, self.no_strip):
-                        token = token.lstrip()
-                        if token:
-                            r_stripping = False
-                if token:
-                    # Flush the buffer if we have non-white content as no
-                    # lstrip command will get past this new token anyways.
-                    if buffer and token.strip() and not isinstance(token, self.no_strip):
-                        for x in buffer:
-                            yield x
-                        buffer = [token]
-                    else:
-                        buffer.append(token)
+
             else:
                 raise ValueError('unknown token %r' % token)
+
         for x in buffer:
             yield x
 
@@ -102,14 +266,152 @@ class Generator(object):
             self.endl_no_break
         )
 
+    def end_document(self):
+        if self.module_code:
+            yield self.opaque(
+                '<%! ' + self.endl +
+                ''.join(line + self.endl for line in self.module_code) +
+                '%>' + self.endl_no_break,
+                hoist=True
+            )
 
+    def attribute_str(self, const_attrs, kwargs_expr=None):
+        if not kwargs_expr:
+            return runtime.attribute_str(const_attrs)
+        return '${%s|n}' % self.attribute_call(const_attrs, kwargs_expr)
 
+    def attribute_call(self, const_attrs, kwargs_expr):
+        """Return a Python expression which formats a tag's attributes.
 
+        Where all of the dynamic attributes are keyword arguments, this calls
+        a formatter specialised for the tag, which is built once per module
+        (see :func:`runtime.attribute_formatter`).
 
+        """
+        names = _keyword_names(kwargs_expr)
+        if names is not None and runtime.attribute_formatter(const_attrs, names):
+            names = tuple(sorted(names))
+            key = (tuple(sorted(const_attrs.items())), names)
+            name = self._attr_formatters.get(key)
+            if name is None:
+                name = self._attr_formatters[key] = '__HAML_attrs_%d' % (len(self._attr_formatters) + 1)
+                self.module_code.append('%s = __HAML.attribute_formatter(%r, %r)' % (name, const_attrs, names))
+            return '%s(%s)' % (name, kwargs_expr)
+        elif const_attrs:
+            return '__HAML.attribute_str(%r, %s)' % (const_attrs, kwargs_expr)
+        else:
+            return '__HAML.attribute_str(%s)' % kwargs_expr
 
+    def start_tag(self, node, attr_str, self_closing=False):
+        return '<%s%s%s>' % (node.name, attr_str, ' /' if self_closing else '')
 
-    
+    def end_tag(self, node):
+        return '</%s>' % node.name
+
+    def expression(self, content, filters=''):
+        return '${%s%s}' % (content, ('|' + filters if filters else ''))
+
+    def start_control(self, node):
+        yield self.line_continuation
+        yield self.indent(-1)
+        if node.test is not None:
+            yield '%% %s %s: ' % (node.type, node.test)
+        else:
+            yield '%% %s: ' % (node.type)
+        yield self.no_strip(self.endl)
+
+    def end_control(self, node):
+        yield self.line_continuation
+        yield self.indent(-1)
+        yield '%% end%s' % node.type
+        yield self.no_strip(self.endl)
+
+    def flush(self):
+        # As it outputs nothing, it shouldn't affect whitespace removal.
+        yield self.no_strip('<% __HAML.flush(context) %>')
+
+    def python_block(self, node):
+        if node.module:
+            # Mako hoists these to the top of the module anyways, so we can
+            # move them out of the way of static text.
+            yield self.opaque(
+                '<%! ' + self.endl +
+                ''.join(line + self.endl for line in node.iter_dedented()) +
+                '%>' + self.endl_no_break,
+                hoist=True
+            )
+            return
+        yield '<% '
+        yield self.endl
+        for line in node.iter_dedented():
+            yield line
+            yield self.endl
+        yield '%>'
+        yield self.endl_no_break
+
+    def literal(self, text):
+        """Return a token which outputs the text as-is, or None if it can't."""
+        if not text:
+            # Mako can't lex an empty <%text></%text>.
+            return text
+        if '</%text>' not in text:
+            return '<%%text>%s</%%text>' % text
+
+    def _template_identifiers(self):
+        if self._identifiers is None:
+            self._identifiers = _code_identifiers(self._root)
+        return self._identifiers
+
+    def filter_call(self, node):
+        """Return an expression for the callable of a filter block."""
+        name = node.filter
+        if name in self.filter_registry and name not in self._template_identifiers():
+            bound = '__HAML_filter_%s' % name
+            if bound not in self._bound_filters:
+                self._bound_filters.add(bound)
+                self.module_code.append('%s = __HAML.filters.%s' % (bound, name))
+            return bound
+        # Hopefully this chain respects proper scope resolution.
+        return 'locals().get(%r) or globals().get(%r) or getattr(__HAML.filters, %r, UNDEFINED)' % (name, name, name)
+
+    def evaluate_filter(self, node, source):
+        """Return the output of a static block with a pure filter, or None.
+
+        The filter must be one of :mod:`haml.filters`, and the template must
+        not mention its name anywhere in its code, as that could shadow it.
+        Failures (i.e. uncached output, such as a sass error) are left to the
+        filter at render time, rather than kept in the compiled template.
+
+        """
+        if not self.evaluate_filters or node.filter in self.runtime_filters:
+            return
+        func = getattr(filters, node.filter, None)
+        if not getattr(func, 'pure', False) or len(node.split_expressions(source)) > 1:
+            return
+        if node.filter in self._template_identifiers():
+            return
+        try:
+            output = func(source)
+        except Exception:
+            # Leave it to fail when rendered, as it always has.
+            return
+        if isinstance(output, text_type) and not isinstance(output, filters._Uncached):
+            return output
+
+    def filter_block(self, node):
+        source = self.endl.join(node.iter_dedented()).strip()
+        output = self.evaluate_filter(node, source)
+        literal = None if output is None else self.literal(output)
+        if literal is not None:
+            yield literal
+            yield self.endl
+            return
+        yield '<%%block filter="%s">' % self.filter_call(node)
+        yield self.endl_no_break
+        yield node._escape_expressions(source)
+        yield '</%block>'
+        yield self.endl
 
 
-def generate_mako(node):
-    return Generator().generate(node)
+def generate_mako(node, **options):
+    return Generator(**options).generate(node)
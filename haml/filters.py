@@ -1,16 +1,270 @@
+import functools
+import json
 import subprocess
-import cgi
+import threading
 
-from six import StringIO
+from six import StringIO, text_type
+from six.moves import queue
 
+try:
+    from html import escape as _html_escape
+except ImportError: # Python 2
+    from cgi import escape as _escape
+else:
+    _escape = functools.partial(_html_escape, quote=False)
+
+
+# The compiled output of the filters which run external compilers, keyed by
+# the filter, the compiler's version, and the source. Set up lazily (with the
+# defaults) by the first cached filter call; see configure_cache.
+memory_cache = None
+disk_cache = None
+_cache_configured = False
+
+_versions = {}
+
+
+def configure_cache(maxsize=256, directory=None):
+    """Configure the cache of compiled sass, scss, less and coffeescript.
+
+    Output is held in an in-memory LRU of `maxsize` entries (or not, if it is
+    0), and optionally in files within `directory`, which may be shared by
+    many processes so that each stylesheet is compiled once per deployment.
+
+    """
+    global memory_cache, disk_cache, _cache_configured
+    from .cache import FileSystemCache, MemoryCache
+    memory_cache = MemoryCache(maxsize) if maxsize else None
+    disk_cache = FileSystemCache(directory, suffix='.filter') if directory else None
+    _cache_configured = True
+
+
+def _command_version(*args):
+    """Return the output of the given version command, or None if it fails."""
+    try:
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        return
+    out, err = proc.communicate()
+    return out.strip().decode('utf-8', 'replace')
+
+
+class _Uncached(text_type):
+    """Filter output which isn't to be cached, as it is from a failure."""
+
+
+def _text(out):
+    if not isinstance(out, text_type):
+        return out.decode('utf-8')
+    return out
+
+
+def cached(name, version):
+    """Cache a filter's output; `version` returns the version of its compiler.
+
+    Output is cached as text. The filter returns an :class:`_Uncached` string
+    (such as an error message) to have it returned, as it is, but not cached.
+
+    """
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def cached_filter(src, *args, **kwargs):
+
+            if not _cache_configured:
+                configure_cache()
+            if memory_cache is None and disk_cache is None:
+                return _text(func(src, *args, **kwargs))
+
+            if name not in _versions:
+                _versions[name] = version()
+            from .cache import cache_key
+            key = cache_key(src, filter=name, version=_versions[name], args=args, **kwargs)
+
+            if memory_cache is not None:
+                out = memory_cache.get(key)
+                if out is not None:
+                    return out
+            if disk_cache is not None:
+                out = disk_cache.get(key)
+                if out is not None:
+                    if memory_cache is not None:
+                        memory_cache.set(key, out)
+                    return out
+
+            out = func(src, *args, **kwargs)
+            out = _text(out)
+            if isinstance(out, _Uncached):
+                return out
+            for cache in (memory_cache, disk_cache):
+                if cache is not None:
+                    cache.set(key, out)
+            return out
+
+        return cached_filter
+
+    return decorator
+
+
+def pure(func):
+    """Mark a filter as pure; its output depends only on its input.
+
+    Blocks using a pure filter and containing no ``${}`` expressions are
+    filtered once when the template is compiled, instead of on every render.
+    Set the `pure` attribute of a filter to False to opt it out.
+
+    The output then becomes part of the compiled template, and caches of
+    compiled templates are keyed by the template source alone, not by the
+    compiler's version as filter output is, so clear them (or rebuild
+    precompiled modules and bundles) after upgrading sass or coffeescript.
+
+    """
+    func.pure = True
+    return func
+
+
+class WorkerError(RuntimeError):
+    """A filter worker timed out, crashed, or couldn't be started."""
+
+
+class _Worker(object):
+
+    def __init__(self, args):
+        self.proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.responses = queue.Queue()
+        thread = threading.Thread(target=self._read)
+        thread.daemon = True
+        thread.start()
+
+    def _read(self):
+        # Reading on a thread lets requests time out.
+        for line in iter(self.proc.stdout.readline, b''):
+            self.responses.put(line)
+        self.responses.put(None)
+
+    def request(self, line, timeout):
+        try:
+            self.proc.stdin.write(line)
+            self.proc.stdin.flush()
+        except (IOError, OSError):
+            return
+        try:
+            return self.responses.get(timeout=timeout)
+        except queue.Empty:
+            self.kill()
+            raise WorkerError('worker timed out after %ss' % timeout)
+
+    def kill(self):
+        try:
+            self.proc.kill()
+        except OSError:
+            pass
+        self.proc.wait()
+
+
+class WorkerPool(object):
+
+    """A pool of long-lived compiler processes.
+
+    Workers are started from `args` as needed, up to `size` of them. PyHAML
+    doesn't ship any; a worker is a long-running program (typically a small
+    wrapper around a compiler's library) which speaks this protocol, in
+    UTF-8, on its stdin and stdout:
+
+    - Each request is one line holding a JSON object, with the "source" to
+      compile and any options: the sass filter sends ``{"source": ...,
+      "scss": true|false}``, and the coffeescript filter just the source.
+    - For each request, in order, the worker writes one line holding a JSON
+      object, with the compiled "output" and/or an "error" message, and
+      flushes. Nothing else may be written to stdout.
+
+    A worker which crashes is restarted, and the request retried once; one
+    which takes longer than `timeout` seconds, or replies with anything but a
+    JSON object, is killed and replaced, raising :class:`WorkerError`.
+
+    Assign pools to :data:`workers` to have the sass, scss and coffeescript
+    filters use them instead of starting a new process every time::
+
+        filters.workers['sass'] = WorkerPool(['node', 'sass-worker.js'], size=4)
+
+    """
+
+    def __init__(self, args, size=2, timeout=30):
+        self.args = args
+        self.size = size
+        self.timeout = timeout
+        self.restarts = 0
+        # Last in, first out, so that warm workers are preferred.
+        self._slots = queue.LifoQueue()
+        for i in range(size):
+            self._slots.put(None)
+
+    def compile(self, source, **options):
+        """Return the (output, error) of compiling the source."""
+        request = dict(options, source=source)
+        line = (json.dumps(request) + '\n').encode('utf-8')
+        worker = self._slots.get()
+        try:
+            for attempt in range(2):
+                if worker is None:
+                    try:
+                        worker = _Worker(self.args)
+                    except OSError as e:
+                        raise WorkerError('could not start %r: %s' % (self.args, e))
+                try:
+                    response = worker.request(line, self.timeout)
+                except WorkerError:
+                    worker = None
+                    raise
+                if response is not None:
+                    try:
+                        response = json.loads(response.decode('utf-8'))
+                        if not isinstance(response, dict):
+                            raise ValueError('not an object')
+                    except ValueError as e:
+                        # It can't be trusted to be in step with requests.
+                        worker.kill()
+                        worker = None
+                        raise WorkerError('malformed reply from %r: %s' % (self.args, e))
+                    return response.get('output') or '', response.get('error') or ''
+                worker.kill()
+                worker = None
+                self.restarts += 1
+            raise WorkerError('worker for %r keeps crashing' % self.args)
+        finally:
+            self._slots.put(worker)
+
+    def close(self):
+        """Stop all of the idle workers."""
+        for i in range(self.size):
+            worker = self._slots.get()
+            if worker is not None:
+                worker.proc.stdin.close()
+                worker.kill()
+        for i in range(self.size):
+            self._slots.put(None)
+
+
+# The filters which templates may use, by name.
+names = ('plain', 'escaped', 'cdata', 'javascript', 'css', 'sass', 'scss', 'less', 'coffeescript')
+
+
+# Maps filter names ("sass", "coffeescript") to the WorkerPool to compile with.
+workers = {}
+
+
+@pure
 def plain(src):
     return src
 
 
+@pure
 def escaped(src):
-    return cgi.escape(src)
+    return _escape(src)
 
 
+@pure
 def cdata(src, comment=False):
     # This should only apply if the runtime is in XML mode.
     block_open  = ('/*' if comment else '') + '<![CDATA[' + ('*/' if comment else '')
@@ -19,15 +273,26 @@ def cdata(src, comment=False):
     return block_open + (src.replace(']]>', ']]]]><![CDATA[>')) + block_close
 
 
+@pure
 def javascript(src):
     return '<script>%s</script>' % cdata(src, True)
 
 
+@pure
 def css(src):
     return '<style>%s</style>' % cdata(src, True)
 
 
+@pure
+@cached('sass', lambda: _command_version('sass', '--version'))
 def sass(src, scss=False):
+    pool = workers.get('sass')
+    if pool is not None:
+        out, err = pool.compile(src, scss=scss)
+        out = css(out.rstrip()) if out else ''
+        if err:
+            out = _Uncached(out + '<div class="sass-error">%s</div>' % _escape(err))
+        return out
     args = ['sass', '--style', 'compressed']
     if scss:
         args.append('--scss')
@@ -37,21 +302,43 @@ def sass(src, scss=False):
         stdout=subprocess.PIPE,
     )
     out, err = proc.communicate(src.encode('utf-8'))
+    out = out.decode('utf-8')
     if out:
-        out = css(out.rstrip().decode('utf-8'))
+        out = css(out.rstrip())
     if err:
-        out += '<div class="sass-error">%s</div>' % cgi.escape(err.decode('utf-8'))
+        out += '<div class="sass-error">%s</div>' % _escape(err.decode('utf-8'))
+    if err or proc.returncode:
+        out = _Uncached(out)
     return out
 
 
+@pure
 def scss(src):
     return sass(src, scss=True)
 
+def _lesscpy_version():
+    try:
+        import lesscpy
+    except ImportError:
+        return
+    return getattr(lesscpy, '__version__', None)
+
+@pure
+@cached('less', _lesscpy_version)
 def less(src):
     import lesscpy
     return css(lesscpy.compile(StringIO(src), minify=True))
 
+@pure
+@cached('coffeescript', lambda: _command_version('coffee', '--version'))
 def coffeescript(src):
+    pool = workers.get('coffeescript')
+    if pool is not None:
+        out, err = pool.compile(src)
+        out = javascript(out) if out else ''
+        if err:
+            out = _Uncached(out + '<div class="coffeescript-error">%s</div>' % _escape(err))
+        return out
     args = ['coffee', '--compile', '--stdio']
     proc = subprocess.Popen(
         args,
@@ -59,10 +346,13 @@ def coffeescript(src):
         stdout=subprocess.PIPE,
     )
     out, err = proc.communicate(src.encode('utf-8'))
+    out = out.decode('utf-8')
     if out:
         out = javascript(out)
     if err:
-        out += '<div class="coffeescript-error">%s</div>' % cgi.escape(err)
-    return out.decode('utf-8')
+        out += '<div class="coffeescript-error">%s</div>' % _escape(err.decode('utf-8'))
+    if err or proc.returncode:
+        out = _Uncached(out)
+    return out
 
 
@@ -0,0 +1,218 @@
+"""A Mako template lookup for HAML templates.
+
+:class:`HamlTemplateLookup` is a drop-in replacement for Mako's
+``TemplateLookup([...], preprocessor=haml.preprocessor)`` which is cheaper to
+run in production:
+
+- The compiled Mako module of every template is cached by a hash of its
+  source, so a template which is reloaded (e.g. because a deploy touched it)
+  but hasn't actually changed is not compiled again. Given a directory, the
+  modules persist across processes and restarts::
+
+      lookup = HamlTemplateLookup(['templates'], cache='/var/cache/haml')
+
+- With `semantic_keys`, modules are instead cached by a
+  :func:`~haml.cache.fingerprint` of the parsed template, so that edits
+  which don't change what it renders (e.g. to ``-#`` comments) don't
+  compile it again either. Line numbers in tracebacks may then be those of
+  an earlier version of the template.
+
+- Rather than checking the modification time of a template every time it is
+  used, all loaded templates are checked together, at most once every
+  `check_interval` seconds.
+
+- Concurrent first requests for a template compile it once, with the other
+  threads waiting for the result, while different templates compile in
+  parallel.
+
+"""
+
+import os
+import threading
+import time
+import types
+
+import mako
+from mako.lookup import TemplateLookup
+from mako.template import ModuleTemplate, Template
+
+from . import preprocessor as haml_preprocessor
+from .cache import BaseCache, CachedPreprocessor, FileSystemCache, MemoryCache, SingleFlight, cache_key, semantic_key
+
+
+class HamlTemplateLookup(TemplateLookup):
+
+    """A TemplateLookup with a compiled module cache and batched checks.
+
+    `cache` is a :class:`haml.cache.BaseCache` to store the Python source of
+    compiled modules in, or a directory to store them as files within; it
+    defaults to an in-memory cache. If `semantic_keys`, HAML templates are
+    cached by :func:`haml.cache.semantic_key` rather than their source.
+
+    Other arguments are as for Mako's ``TemplateLookup``, and the
+    preprocessor defaults to HAML's; `module_directory` and `module_writer`
+    raise TypeError, as `cache` takes their place.
+
+    """
+
+    # Template arguments which affect the compiled module.
+    compile_args = (
+        'buffer_filters',
+        'default_filters',
+        'enable_loop',
+        'future_imports',
+        'imports',
+        'input_encoding',
+        'strict_undefined',
+    )
+
+    # Template arguments which ModuleTemplate accepts.
+    module_template_args = (
+        'cache_args',
+        'cache_enabled',
+        'cache_impl',
+        'encoding_errors',
+        'error_handler',
+        'format_exceptions',
+        'include_error_handler',
+        'output_encoding',
+    )
+
+    def __init__(self, directories=None, cache=None, check_interval=1.0, semantic_keys=False, **kwargs):
+        for name in ('module_directory', 'module_writer'):
+            if kwargs.get(name) is not None:
+                raise TypeError('%s is not supported; pass a cache instead' % name)
+        if kwargs.get('preprocessor') is None:
+            kwargs['preprocessor'] = haml_preprocessor
+        super(HamlTemplateLookup, self).__init__(directories, **kwargs)
+        if cache is None:
+            cache = MemoryCache()
+        elif not isinstance(cache, BaseCache):
+            cache = FileSystemCache(cache, suffix='.py')
+        self.module_cache = cache
+        self.check_interval = check_interval
+        self.semantic_keys = semantic_keys
+        self._mtimes = {}
+        self._last_check = time.time()
+        self._check_lock = threading.Lock()
+        self.flights = SingleFlight()
+        self.compiles = 0
+        self.loads = 0
+        self.checks = 0
+        self.stat_calls = 0
+        self.reloads = 0
+
+    def stats(self):
+        return dict(
+            templates=len(self._collection),
+            compiles=self.compiles,
+            loads=self.loads,
+            checks=self.checks,
+            stat_calls=self.stat_calls,
+            reloads=self.reloads,
+            flights=self.flights.stats(),
+            module_cache=self.module_cache.stats(),
+        )
+
+    def get_template(self, uri):
+        if self.filesystem_checks and time.time() - self._last_check >= self.check_interval:
+            self.check()
+        return super(HamlTemplateLookup, self).get_template(uri)
+
+    def _check(self, uri, template):
+        # Called by get_template for every use; we check in batches instead.
+        return template
+
+    def check(self):
+        """Check all loaded templates for changes now.
+
+        Those which have changed (or gone) are dropped, to be loaded again
+        when next requested. If another thread is already checking, this
+        returns immediately.
+
+        """
+        if not self._check_lock.acquire(False):
+            return
+        try:
+            self._last_check = time.time()
+            self.checks += 1
+            for uri, mtime in list(self._mtimes.items()):
+                self.stat_calls += 1
+                try:
+                    current = os.stat(self._collection[uri].filename).st_mtime
+                except (KeyError, OSError):
+                    current = None
+                if current != mtime:
+                    self._collection.pop(uri, None)
+                    self._mtimes.pop(uri, None)
+                    self.reloads += 1
+        finally:
+            self._check_lock.release()
+
+    def module_key(self, source, uri):
+        """Return the cache key of the compiled module for the given source."""
+        preprocessor = self.template_args['preprocessor']
+        # Only HAML's own preprocessors are known to depend on just the tree.
+        semantic = self.semantic_keys and (
+            preprocessor is haml_preprocessor or isinstance(preprocessor, CachedPreprocessor)
+        )
+        return (semantic_key if semantic else cache_key)(
+            source,
+            uri=uri,
+            mako=mako.__version__,
+            preprocessor='%s.%s' % (getattr(preprocessor, '__module__', None), getattr(preprocessor, '__name__', type(preprocessor).__name__)),
+            preprocessor_options=getattr(preprocessor, 'options', None),
+            **dict((name, self.template_args.get(name)) for name in self.compile_args)
+        )
+
+    def _load(self, filename, uri):
+        try:
+            return self._collection[uri]
+        except KeyError:
+            pass
+        # Only one thread loads a given template; others asking for it
+        # meanwhile wait for the result, and other templates load in parallel.
+        return self.flights.do(uri, self._load_uncached, filename, uri)
+
+    def _load_uncached(self, filename, uri):
+        try:
+            return self._collection[uri]
+        except KeyError:
+            pass
+        filename = os.path.normpath(filename)
+        with open(filename, 'rb') as fh:
+            mtime = os.fstat(fh.fileno()).st_mtime
+            source = fh.read()
+        key = self.module_key(source, uri)
+        code = self.module_cache.get(key)
+        if code is None:
+            template = self._compile(source, filename, uri)
+            self.module_cache.set(key, template.code)
+        else:
+            template = self._load_module(code, filename, uri)
+        with self._mutex:
+            if code is None:
+                self.compiles += 1
+            else:
+                self.loads += 1
+            self._collection[uri] = template
+            self._mtimes[uri] = mtime
+        return template
+
+    def _compile(self, source, filename, uri):
+        # There is no module_directory or module_writer (see __init__), so
+        # Mako only compiles; the module cache keeps the result.
+        args = self.template_args
+        text = source.decode(args.get('input_encoding') or 'utf-8')
+        return Template(text, filename=filename, uri=uri, lookup=self, **args)
+
+    def _load_module(self, code, filename, uri):
+        module = types.ModuleType(uri)
+        exec(compile(code, filename, 'exec'), module.__dict__)
+        return ModuleTemplate(
+            module,
+            template_filename=filename,
+            module_source=code,
+            lookup=self,
+            **dict((name, self.template_args[name]) for name in self.module_template_args)
+        )
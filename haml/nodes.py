@@ -6,18 +6,34 @@ import cgi
 import re
 import sys
 
+from six.moves import intern
+
 from . import codegen
-from . import runtime
 
 
 PY35 = sys.version_info >= (3, 5, 0)
 
+# Shared by every node without children, until one is added; most nodes are
+# leaves.
+_no_children = ()
+
 
 class Base(object):
 
+    # Nodes use __slots__ rather than a __dict__, as whole trees are often
+    # held in memory. `lineno` and `end_lineno` are the range of source lines
+    # the node was parsed from; see Parser.
+    __slots__ = ('inline_child', 'children', 'lineno', 'end_lineno')
+
+    # The attributes which determine what the node renders, including child
+    # nodes, for haml.cache.fingerprint; None if it renders nothing at all.
+    _fields = ('inline_child', 'children')
+
     def __init__(self):
         self.inline_child = None
-        self.children = []
+        self.children = _no_children
+        self.lineno = None
+        self.end_lineno = None
 
     def iter_all_children(self):
         '''Return an iterator that yields every node which is a child of this one.
@@ -33,29 +49,60 @@ class Base(object):
     def add_child(self, node, inline=False):
         if inline:
             self.inline_child = node
+        elif self.children is _no_children:
+            self.children = [node]
         else:
             self.children.append(node)
     
     def consume_sibling(self, node):
         return False
 
+    def iter_code(self):
+        """Yield any Python source held by this node itself (not its children).
+
+        Content with ``${}`` is included from the first expression onwards.
+
+        """
+        return []
+
     def render(self, engine):
-        return chain(
-            self.render_start(engine),
-            self.render_content(engine),
-            self.render_end(engine),
-        )
+        """Yield the tokens for this node and all of its descendants.
+
+        The tree is walked with an explicit stack rather than by recursion,
+        so the Python stack depth doesn't grow with the depth of the tree.
+
+        """
+        stack = [iter(self.render_node(engine))]
+        while stack:
+            for item in stack[-1]:
+                if isinstance(item, Base):
+                    stack.append(iter(item.render_node(engine)))
+                    break
+                yield item
+            else:
+                stack.pop()
+
+    def render_node(self, engine):
+        """Yield this node's own tokens, and its children as nodes.
+
+        Children are rendered in place by :meth:`render`.
+
+        """
+        for token in self.render_start(engine):
+            yield token
+        for item in self.render_content(engine):
+            yield item
+        for token in self.render_end(engine):
+            yield token
 
     def render_start(self, engine):
         return []
 
     def render_content(self, engine):
-        to_chain = []
         if self.inline_child:
-            to_chain.append(self.inline_child.render(engine))
+            yield self.inline_child
         for child in self.children:
-            to_chain.append(child.render(engine))
-        return chain(*to_chain)
+            yield child
 
     def render_end(self, engine):
         return []
@@ -79,26 +126,39 @@ class Base(object):
 
 class FilterBase(Base):
 
+    # Lines are dedented as they are added, by the indent of the first which
+    # isn't empty (until which `_indent` is None), and kept as plain strings.
+    __slots__ = ('_lines', '_indent')
+
     def __init__(self, *args, **kwargs):
         super(FilterBase, self).__init__(*args, **kwargs)
-        self._content = []
+        self._lines = []
+        self._indent = None
+
+    _fields = Base._fields + ('body', )
 
     def add_line(self, indent, content):
-        self._content.append((indent, content))
+        if self._indent is None:
+            if content:
+                self._indent = len(indent)
+            self._lines.append(content)
+        else:
+            self._lines.append((indent + content)[self._indent:])
+
+    @property
+    def body(self):
+        return tuple(self._lines)
 
     def iter_dedented(self):
-        indent_to_remove = None
-        for indent, content in self._content:
-            if indent_to_remove is None:
-                yield content
-                if content:
-                    indent_to_remove = len(indent)
-            else:
-                yield (indent + content)[indent_to_remove:]
+        return iter(self._lines)
 
 
 class GreedyBase(Base):
-    
+
+    # Subclasses need a `_greedy_root` slot; it can't be here as well as in
+    # the other bases of e.g. Expression.
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super(GreedyBase, self).__init__(*args, **kwargs)
         self._greedy_root = self
@@ -110,16 +170,35 @@ class GreedyBase(Base):
 
 class Document(Base):
 
+    # `_reach` is how far the source had been read by the end of each child,
+    # as set by the parser for Parser.reparse.
+    __slots__ = ('_reach', )
+
+    def __init__(self):
+        super(Document, self).__init__()
+        self._reach = None
+
     def render_start(self, engine):
         yield engine.start_document()
 
+    def render_end(self, engine):
+        return engine.end_document()
+
 
 class Content(Base):
 
+    __slots__ = ('content', )
+
+    _fields = Base._fields + ('content', )
+
     def __init__(self, content):
         super(Content, self).__init__()
         self.content = content
 
+    def iter_code(self):
+        if '${' in self.content:
+            yield self.content[self.content.index('${'):]
+
     def render_start(self, engine):
         yield engine.indent()
         yield self.content
@@ -135,15 +214,26 @@ class Content(Base):
 
 class Expression(Content, GreedyBase):
 
+    __slots__ = ('filters', '_greedy_root')
+
+    @property
+    def _fields(self):
+        if not (self.content.strip() or self.children or self.inline_child):
+            # A blank line within the expression.
+            return None
+        return Content._fields + ('filters', )
+
     def __init__(self, content, filters=''):
         super(Expression, self).__init__(content)
         self.filters = filters
 
+    def iter_code(self):
+        yield self.content
+
     def render_start(self, engine):
         if self.content.strip():
             yield engine.indent()
-            filters = self._greedy_root.filters
-            yield '${%s%s}' % (self.content.strip(), ('|' + filters if filters else ''))
+            yield engine.expression(self.content.strip(), self._greedy_root.filters)
             yield engine.endl
         yield engine.inc_depth # This is countered by the Content.render_end
 
@@ -163,6 +253,16 @@ class Tag(Base):
         meta
     '''.strip().split())
 
+    __slots__ = (
+        'name', 'id', 'class_', 'kwargs_expr', 'object_reference',
+        'object_reference_prefix', 'self_closing', 'strip_inner', 'strip_outer',
+    )
+
+    _fields = Base._fields + (
+        'name', 'id', 'class_', 'kwargs_expr', 'object_reference',
+        'object_reference_prefix', 'self_closing', 'strip_inner', 'strip_outer',
+    )
+
     def __init__(self, name, id, class_,
             kwargs_expr=None,
             object_reference=None,
@@ -174,7 +274,8 @@ class Tag(Base):
 
         super(Tag, self).__init__()
 
-        self.name = (name or 'div').lower()
+        # Interned, as there are few names but many tags.
+        self.name = intern((name or 'div').lower())
         self.id = id
         self.class_ = (class_ or '').replace('.', ' ').strip()
         self.kwargs_expr = kwargs_expr
@@ -184,7 +285,18 @@ class Tag(Base):
         self.strip_inner = strip_inner
         self.strip_outer = strip_outer
 
-    def render_start(self, engine):
+    def iter_code(self):
+        for x in (self.kwargs_expr, self.object_reference, self.object_reference_prefix):
+            if x:
+                yield x
+
+    def attribute_parts(self):
+        """Return the constant attributes, and the remaining dynamic expression.
+
+        Any attributes which are all literals are moved into the constant
+        dict, in which case the expression will be None.
+
+        """
 
         const_attrs = {}
         if self.id:
@@ -289,25 +401,24 @@ class Tag(Base):
                 const_attrs.update(literal_attrs)
                 kwargs_expr = None
 
-        if not kwargs_expr:
-            attr_str = runtime.attribute_str(const_attrs)
-        elif not const_attrs:
-            attr_str = '<%% __M_writer(__HAML.attribute_str(%s)) %%>' % kwargs_expr
-        else:
-            attr_str = '<%% __M_writer(__HAML.attribute_str(%r, %s)) %%>' % (const_attrs, kwargs_expr)
+        return const_attrs, kwargs_expr or None
+
+    def render_start(self, engine):
+
+        attr_str = engine.attribute_str(*self.attribute_parts())
 
         if self.strip_outer:
             yield engine.lstrip
         yield engine.indent()
 
         if self.self_closing or self.name in self.self_closing_names:
-            yield '<%s%s />' % (self.name, attr_str)
+            yield engine.start_tag(self, attr_str, self_closing=True)
             if self.strip_outer:
                 yield engine.rstrip
             else:
                 yield engine.endl
         else:
-            yield '<%s%s>' % (self.name, attr_str)
+            yield engine.start_tag(self, attr_str)
             if self.children:
                 if self.strip_inner or self.inline_child:
                     yield engine.rstrip
@@ -332,7 +443,7 @@ class Tag(Base):
             if self.children:
                 yield engine.dec_depth
                 yield engine.indent()
-            yield '</%s>' % self.name
+            yield engine.end_tag(self)
             if self.strip_outer:
                 yield engine.rstrip
             yield engine.endl
@@ -349,6 +460,10 @@ class Tag(Base):
 
 class MixinDef(Tag):
 
+    __slots__ = ('mixin_name', 'argspec')
+
+    _fields = Tag._fields + ('mixin_name', 'argspec')
+
     def __init__(self, name, argspec):
         super(MixinDef, self).__init__(
             '%def', # tag name
@@ -357,10 +472,16 @@ class MixinDef(Tag):
             'name=%r' % ('%s(%s)' % (name, argspec or '')), # kwargs expr
             strip_inner=True,
         )
+        self.mixin_name = name
+        self.argspec = argspec
 
 
 class MixinCall(Tag):
 
+    __slots__ = ('mixin_name', 'argspec')
+
+    _fields = Tag._fields + ('mixin_name', 'argspec')
+
     def __init__(self, name, argspec):
         super(MixinCall, self).__init__(
             '%call', # tag name
@@ -368,15 +489,25 @@ class MixinCall(Tag):
             None, # class
             'expr=%r' % ('%s(%s)' % (name, argspec or '')), # kwargs expr
         )
+        self.mixin_name = name
+        self.argspec = argspec
 
 
 class HTMLComment(Base):
 
+    __slots__ = ('inline_content', 'IE_condition')
+
+    _fields = Base._fields + ('inline_content', 'IE_condition')
+
     def __init__(self, inline_content, IE_condition=''):
         super(HTMLComment, self).__init__()
         self.inline_content = inline_content
         self.IE_condition = IE_condition
 
+    def iter_code(self):
+        if self.inline_content and '${' in self.inline_content:
+            yield self.inline_content[self.inline_content.index('${'):]
+
     def render_start(self, engine):
         yield engine.indent()
         yield '<!--'
@@ -406,11 +537,15 @@ class HTMLComment(Base):
 
 class Control(Base):
 
+    __slots__ = ('type', 'test', 'elifs', 'else_')
+
+    _fields = Base._fields + ('type', 'test', 'elifs', 'else_')
+
     def __init__(self, type, test):
         super(Control, self).__init__()
-        self.type = type
+        self.type = intern(type)
         self.test = test
-        self.elifs = []
+        self.elifs = _no_children
         self.else_ = None
 
     def iter_all_children(self):
@@ -419,13 +554,20 @@ class Control(Base):
         for x in self.elifs:
             yield x
         if self.else_:
-            yield x
+            yield self.else_
+
+    def iter_code(self):
+        if self.test is not None:
+            yield self.test
 
     def consume_sibling(self, node):
         if not isinstance(node, Control):
             return False
         if node.type == 'elif':
-            self.elifs.append(node)
+            if self.elifs is _no_children:
+                self.elifs = [node]
+            else:
+                self.elifs.append(node)
             return True
         if node.type == 'else' and self.else_ is None:
             self.else_ = node
@@ -438,31 +580,22 @@ class Control(Base):
         if self.else_ is not None:
             self.else_.print_tree(depth)
             
-    def render(self, engine):
-        to_chain = [self.render_start(engine), self.render_content(engine)]
-        for node in self.elifs:
-            to_chain.append(node.render(engine))
-        if self.else_:
-            to_chain.append(self.else_.render(engine))
-        to_chain.append(self.render_end(engine))
-        return chain(*to_chain)
+    def render_node(self, engine):
+        return chain(
+            self.render_start(engine),
+            self.render_content(engine),
+            self.elifs,
+            [self.else_] if self.else_ else [],
+            self.render_end(engine),
+        )
         
     def render_start(self, engine):
-        yield engine.line_continuation
-        yield engine.indent(-1)
-        if self.test is not None:
-            yield '%% %s %s: ' % (self.type, self.test)
-        else:
-            yield '%% %s: ' % (self.type)
-        yield engine.no_strip(engine.endl)
+        return engine.start_control(self)
 
     def render_end(self, engine):
         if self.type in ('else', 'elif'):
-            return
-        yield engine.line_continuation
-        yield engine.indent(-1)
-        yield '%% end%s' % self.type
-        yield engine.no_strip(engine.endl)
+            return []
+        return engine.end_control(self)
 
     def __repr__(self):
         if self.test is not None:
@@ -477,34 +610,36 @@ class Control(Base):
 
 class Python(FilterBase):
 
+    __slots__ = ('module', )
+
+    _fields = FilterBase._fields + ('module', )
+
     def __init__(self, content, module=False):
         super(Python, self).__init__()
         if content.strip():
             self.add_line('', content)
         self.module = module
 
-    def render(self, engine):
-        if self.module:
-            yield '<%! '
-        else:
-            yield '<% '
-        yield engine.endl
-        for line in self.iter_dedented():
-            yield line
-            yield engine.endl
-        yield '%>'
-        yield engine.endl_no_break
+    def iter_code(self):
+        yield '\n'.join(self.iter_dedented())
+
+    def render_node(self, engine):
+        return engine.python_block(self)
     
     def __repr__(self):
         return '%s(%r%s)' % (
             self.__class__.__name__,
-            self._content,
+            self._lines,
             ', module=True' if self.module else ''
         )
 
 
 class Filter(FilterBase):
 
+    __slots__ = ('filter', )
+
+    _fields = FilterBase._fields + ('filter', )
+
     def __init__(self, content, filter):
         super(Filter, self).__init__()
         if content and content.strip():
@@ -512,26 +647,39 @@ class Filter(FilterBase):
         self.filter = filter
 
     def _escape_expressions(self, source):
-        parts = re.split(r'(\${.*?})', source)
+        parts = self.split_expressions(source)
         for i in range(0, len(parts), 2):
             parts[i] = parts[i] and ('<%%text>%s</%%text>' % parts[i])
         return ''.join(parts)
 
-    def render(self, engine):
-        # Hopefully this chain respects proper scope resolution.
-        yield '<%%block filter="locals().get(%r) or globals().get(%r) or getattr(__HAML.filters, %r, UNDEFINED)">' % (self.filter, self.filter, self.filter)
-        yield engine.endl_no_break
-        yield self._escape_expressions(engine.endl.join(self.iter_dedented()).strip())
-        yield '</%block>'
-        yield engine.endl
+    @property
+    def body(self):
+        # As filtered by the generator.
+        return '\n'.join(self._lines).strip()
+
+    def split_expressions(self, source):
+        """Split source into alternating static text and ${} expressions."""
+        return re.split(r'(\${.*?})', source)
+
+    def iter_code(self):
+        parts = self.split_expressions('\n'.join(self.iter_dedented()))
+        for part in parts[1::2]:
+            yield part
+
+    def render_node(self, engine):
+        return engine.filter_block(self)
 
     def __repr__(self):
-        return '%s(%r, %r)' % (self.__class__.__name__, self._content,
+        return '%s(%r, %r)' % (self.__class__.__name__, self._lines,
                 self.filter)
 
 
 class HAMLComment(Base):
 
+    __slots__ = ('comment', )
+
+    _fields = None
+
     def __init__(self, comment):
         super(HAMLComment, self).__init__()
         self.comment = comment
@@ -542,11 +690,24 @@ class HAMLComment(Base):
             self.comment
         )
 
-    def render(self, engine):
+    def render_node(self, engine):
         return []
 
 
+class Flush(Base):
+
+    """A point at which output may be handed on when streaming."""
+
+    __slots__ = ()
+
+    def render_start(self, engine):
+        return engine.flush()
+
+
 class Doctype(Base):
+
+    __slots__ = ('name', 'charset')
+
     doctypes = {
         'xml': {
             None: """<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">""",
@@ -564,6 +725,8 @@ class Doctype(Base):
             "5": """<!DOCTYPE html>""",
     }}
 
+    _fields = Base._fields + ('name', 'charset')
+
     def __init__(self, name=None, charset=None):
         super(Doctype, self).__init__()
         self.name = name.lower() if name else None
@@ -1,3 +1,5 @@
+import bisect
+import collections
 import itertools
 import re
 import tokenize
@@ -19,16 +21,67 @@ def split_balanced_parens(line, depth=0):
         return line[:pos+1], line[pos+1:]
     else:           
         return '', line
-    
-    
+
+
+class _AmbiguousExpression(Exception):
+    """Raised when only tokenize can decide where an expression ends."""
+
+
+_openers = frozenset('({[')
+_closers = frozenset(')}]')
+_close_to_open = {')': '(', '}': '{', ']': '['}
+_plain_re = re.compile(r'[^()\[\]{}:#\\\'"]+')
+
+
 class Parser(object):
 
+    """Parses HAML into a tree of nodes, at :attr:`root`.
+
+    Each parse starts a new tree, so a parser may be reused (or pooled) for
+    any number of documents, but only by one thread at a time.
+
+    Every node records the (1-based, inclusive) range of source lines it was
+    parsed from as `lineno` and `end_lineno`. A node's range includes those of
+    its children, any trailing blank lines, and any siblings it consumed
+    (e.g. the ``- else`` of an ``- if``).
+
+    """
+
     def __init__(self):
+        self.reset()
+
+    def reset(self):
         self.root = nodes.Document()
         self._stack = [((-1, 0), self.root)]
+        self._source = None
+        self._buffer = None
+        # The number of the line at the front of the buffer.
+        self._lineno = 1
+        # Called with the number of each top-level line; parsing stops
+        # before the first for which it returns true.
+        self._stop = None
+        # The lines read so far when each top-level block began.
+        self._top_level = {}
 
     def parse_string(self, source):
-        self.parse(source.splitlines())
+        return self.parse(source.splitlines())
+
+    def parse_file(self, fileobj):
+        """Parse lines lazily from a file-like object."""
+        return self.parse_iter(fileobj)
+
+    def parse_iter(self, lines):
+        """Parse lines lazily from any iterable; line endings are removed.
+
+        Only the lines needed for lookahead are held in memory at once.
+
+        """
+        return self.parse(line.rstrip('\r\n') for line in lines)
+
+    @property
+    def _pulled(self):
+        """The number of lines read from the source so far."""
+        return self._lineno - 1 + len(self._buffer)
 
     @property
     def _topmost_node(self):
@@ -43,7 +96,8 @@ class Parser(object):
     def _consume_buffer(self):
         """Get the next line."""
         if self._buffer:
-            return self._buffer.pop(0)
+            self._lineno += 1
+            return self._buffer.popleft()
 
     def _replace_buffer(self, line):
         """Replace the contents of the first line in the buffer with the given."""
@@ -67,22 +121,137 @@ class Parser(object):
         """
         return tokenize.generate_tokens(self._make_readline_peeker())
 
-    def _consume_python_token(self, token):
-        """Consume the buffer up to the given token (from _peek_python_tokens).
+    def _consume_buffer_to(self, line, col):
+        """Consume the buffer up to the given (1-based) line and column.
 
         Returns a single string that was consumed.
 
         """
-        ret = []
-        line, col = token[3]
-        if line > 1:
-            ret = self._buffer[:line-1]
-            self._buffer[:line-1] = []
+        popleft = self._buffer.popleft
+        ret = [popleft() for _ in range(line - 1)]
+        self._lineno += line - 1
         ret.append(self._buffer[0][:col])
         self._buffer[0] = self._buffer[0][col:]
         return ''.join(ret)
 
+    def _consume_python_token(self, token):
+        """Consume the buffer up to the given token (from _peek_python_tokens).
+
+        Returns a single string that was consumed.
+
+        """
+        return self._consume_buffer_to(*token[3])
+
     def _match_python_expr(self, first=None, last=None):
+        """Consume and return a bracket-balanced Python expression.
+
+        The expression must start with one of `first` (if given), and ends on
+        the first of `last` which is not nested within brackets. Returns None
+        if there is no such expression (e.g. the brackets are mismatched).
+
+        """
+        try:
+            end = self._scan_python_expr(first, last)
+        except _AmbiguousExpression:
+            return self._match_python_expr_tokenize(first, last)
+        if end is not None:
+            return self._consume_buffer_to(*end)
+
+    def _scan_python_expr(self, first, last):
+        """Find the end of a Python expression without using tokenize.
+
+        This understands brackets, string literals (of any prefix, including
+        triple-quoted and escapes) and comments, which is all we need to find
+        where an expression ends. Like tokenize (with our newline-free lines),
+        expressions continue onto following lines until they end.
+
+        Returns the (1-based) line and column just past the expression, or
+        None. Raises _AmbiguousExpression for anything odd enough that only
+        tokenize should decide (e.g. unterminated strings, or running out of
+        source).
+
+        """
+
+        if last is None:
+            raise _AmbiguousExpression()
+
+        line_i = 0
+        line = self._peek_buffer()
+        if first is not None and not (line and line[0] in first):
+            return
+
+        stack = []
+        pos = 0
+        while True:
+
+            m = _plain_re.match(line, pos)
+            if m:
+                pos = m.end()
+
+            if pos >= len(line):
+                line_i, line, pos = self._scan_next_line(line_i)
+                continue
+
+            char = line[pos]
+            pos += 1
+
+            if char in _openers:
+                stack.append(char)
+
+            elif char in _closers:
+                if not stack:
+                    # Tokenize fails with this.
+                    raise _AmbiguousExpression()
+                if stack.pop() != _close_to_open[char]:
+                    # Mismatched brackets!
+                    return
+                if not stack and char in last:
+                    return line_i + 1, pos
+
+            elif char == ':':
+                if line.startswith('=', pos):
+                    pos += 1 # Walrus.
+                elif not stack and char in last:
+                    return line_i + 1, pos
+
+            elif char == '#':
+                pos = len(line)
+
+            elif char in '\'"':
+                quote = line[pos - 1:pos + 2]
+                if quote != char * 3:
+                    quote = char
+                pos += len(quote) - 1
+                line_i, line, pos = self._scan_string(line_i, line, pos, quote)
+
+            # Anything else (e.g. a stray backslash) passes through, just as
+            # tokenize will keep going past an error token.
+
+    def _scan_next_line(self, line_i):
+        try:
+            return line_i + 1, self._peek_buffer(line_i + 1), 0
+        except StopIteration:
+            raise _AmbiguousExpression()
+
+    def _scan_string(self, line_i, line, pos, quote):
+        """Scan to the end of a string literal; returns the position after it."""
+        while True:
+            end = line.find(quote, pos)
+            escape = line.find('\\', pos, None if end < 0 else end)
+            if escape >= 0:
+                pos = escape + 2
+                if pos > len(line):
+                    # Escaped line ending.
+                    line_i, line, pos = self._scan_next_line(line_i)
+                continue
+            if end >= 0:
+                return line_i, line, end + len(quote)
+            if len(quote) == 1:
+                # Unterminated string.
+                raise _AmbiguousExpression()
+            line_i, line, pos = self._scan_next_line(line_i)
+
+    def _match_python_expr_tokenize(self, first=None, last=None):
         openers = set('({[')
         closers = set(')}]')
         close_to_open = {')': '(', '}': '{', ']': '['}
@@ -111,10 +280,34 @@ class Parser(object):
             return
 
     def parse(self, source):
+        """Parse an iterable of lines, returning the new root node."""
+        self.reset()
+        self._run(source)
+        self.root.lineno = 1
+        self.root.end_lineno = self._lineno - 1
+        return self.root
+
+    def _run(self, source, lineno=1, stop=None):
         self._source = iter(source)
-        self._buffer = []
-        self._parse_buffer()
-        self._parse_context(self.root)
+        self._buffer = collections.deque()
+        self._lineno = lineno
+        self._stop = stop
+        try:
+            self._parse_buffer()
+            self._parse_context(self.root)
+            # How far the source had been read by the end of each top-level
+            # block; an edit to any of those lines may change it (see reparse).
+            children = self.root.children
+            pulled = self._pulled
+            if not self._buffer:
+                # Finding the end of the source counts as reading past it.
+                pulled += 1
+            self.root._reach = [self._top_level.get(child.lineno, pulled) for child in children[1:]]
+            if children:
+                self.root._reach.append(pulled)
+        finally:
+            # Don't hold on to the source between parses.
+            self._source = self._buffer = self._stop = None
     
     def _parse_buffer(self):
         indent_str = ''
@@ -129,6 +322,11 @@ class Parser(object):
             except StopIteration:
                 break
 
+            lineno = self._lineno
+            pulled = self._pulled
+            if self._stop is not None and raw_line[:1].strip() and self._stop(lineno):
+                break
+
             # Handle multiline statements.
             try:
                 while raw_line.endswith('|'):
@@ -153,7 +351,9 @@ class Parser(object):
                 
                 # Cleanup the stack. We should only need to do this here as the
                 # depth only goes up until it is calculated from the next line.
-                self._prep_stack_for_depth((inter_depth, intra_depth))
+                self._prep_stack_for_depth((inter_depth, intra_depth), lineno - 1)
+                if len(self._stack) == 1:
+                    self._top_level[lineno] = pulled
                 
             else:
                 
@@ -170,7 +370,8 @@ class Parser(object):
             if isinstance(self._topmost_node, nodes.GreedyBase):
                 self._add_node(
                     self._topmost_node.__class__(line),
-                    (inter_depth, intra_depth)
+                    (inter_depth, intra_depth),
+                    lineno
                 )
                 continue
             
@@ -184,10 +385,13 @@ class Parser(object):
             while line:
                 self._replace_buffer(line)
                 node, line = self._parse_statement()
-                self._add_node(node, (inter_depth, intra_depth))
+                self._add_node(node, (inter_depth, intra_depth), lineno)
+                lineno = self._lineno
                 line = line.lstrip()
                 intra_depth += 1
 
+        # Close everything still open.
+        self._prep_stack_for_depth((-1, 1))
 
     def _parse_statement(self):
 
@@ -279,6 +483,13 @@ class Parser(object):
                 ''
             )
 
+        # Flush points for streaming.
+        if line.rstrip() == '!flush':
+            return (
+                nodes.Flush(),
+                ''
+            )
+
         # Tags.
         m = re.match(r'''
             (?:%(%?(?:\w+:)?[\w-]*))? # tag name. the extra % is for mako
@@ -378,29 +589,135 @@ class Parser(object):
             ''
         )
 
-    def _prep_stack_for_depth(self, depth):  
+    def _prep_stack_for_depth(self, depth, end_lineno=None):
         """Pop everything off the stack that is not shorter than the given depth."""
+        if end_lineno is None:
+            end_lineno = self._lineno - 1
         while depth <= self._stack[-1][0]:
-            self._stack.pop()
+            self._stack.pop()[1].end_lineno = end_lineno
 
-    def _add_node(self, node, depth):
+    def _add_node(self, node, depth, lineno=None):
         """Add a node to the graph, and the stack."""
+        node.lineno = self._lineno if lineno is None else lineno
         self._topmost_node.add_child(node, bool(depth[1]))
         self._stack.append((depth, node))
     
     def _parse_context(self, node):
-        for child in node.iter_all_children():
-            self._parse_context(child)
+        # Depth first, children before parents, with an explicit stack so
+        # that deep trees don't hit the recursion limit.
+        stack = [(node, node.iter_all_children())]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                stack.append((child, child.iter_all_children()))
+                break
+            else:
+                stack.pop()
+                self._consume_siblings(node)
+
+    def _consume_siblings(self, node):
         i = 0
         while i < len(node.children) - 1:
             if node.children[i].consume_sibling(node.children[i + 1]):
+                node.children[i].end_lineno = node.children[i + 1].end_lineno
                 del node.children[i + 1]
             else:
                 i += 1
 
+    def reparse(self, root, lines, start, old_end, new_end):
+        """Update a tree for an edit to its source, returning the new root.
+
+        `lines` are the source lines after the edit, in which
+        ``lines[start:new_end]`` replaced what were ``lines[start:old_end]``
+        of the source `root` was parsed from.
+
+        Only the top-level blocks which the edit may affect (those it touches,
+        and any earlier ones which read ahead into it) are parsed again, and
+        the rest of the tree is reused. The root is modified in place, unless
+        the edit changes how the reused blocks attach to the new ones, in
+        which case the whole source is parsed again.
+
+        """
+        children = root.children
+        reach = root._reach
+        if not children or reach is None:
+            return self.parse(lines)
+        starts = [child.lineno - 1 for child in children]
+        delta = new_end - old_end
+
+        # Blocks before `first` never read as far as the edit, and those
+        # from an old block starting after it (which we stop at) onwards are
+        # parsed just as they were before.
+        first = bisect.bisect_right(reach, start)
+        later = bisect.bisect_left(starts, old_end)
+        blocks = dict((starts[i] + 1, i) for i in range(later, len(children)))
+        stops = []
+        def stop(lineno):
+            if lineno - delta in blocks:
+                stops.append(blocks[lineno - delta])
+                return True
+
+        self.reset()
+        begin = starts[first] if first else 0
+        self._run(itertools.islice(lines, begin, None), begin + 1, stop)
+        last = stops[0] if stops else len(children)
+        new = self.root.children
+
+        # The block we stopped at may now belong to a new one (e.g. an
+        # "- else" to a new "- if"), which changes how it would have consumed
+        # its own siblings; that needs a full parse.
+        if new and last < len(children) and new[-1].consume_sibling(children[last]):
+            return self.parse(lines)
+
+        for child in children[last:]:
+            _shift_lines(child, delta)
+        children[first:last] = new
+        reach[first:last] = self.root._reach
+        # Reaches are cumulative (a block is affected by an edit if it, or
+        # anything before it, read that far), so include the earlier blocks.
+        furthest = reach[first - 1] if first else 0
+        for i in range(first, len(reach)):
+            if i >= first + len(new):
+                reach[i] += delta
+            furthest = reach[i] = max(reach[i], furthest)
+        root.lineno = 1
+        root.end_lineno = len(lines)
+        self.root = root
+        return root
+
+
+def _shift_lines(node, delta):
+    if not delta:
+        return
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        node.lineno += delta
+        node.end_lineno += delta
+        stack.extend(node.iter_all_children())
+
 
 def parse_string(source):
     """Parse a string into a HAML node to be compiled."""
     parser = Parser()
     parser.parse_string(source)
     return parser.root
+
+
+def parse_file(fileobj):
+    """Parse a file-like object into a HAML node, reading it lazily."""
+    parser = Parser()
+    parser.parse_file(fileobj)
+    return parser.root
+
+
+def parse_iter(lines):
+    """Parse an iterable of lines into a HAML node, reading it lazily."""
+    parser = Parser()
+    parser.parse_iter(lines)
+    return parser.root
+
+
+def reparse(root, lines, start, old_end, new_end):
+    """Update a tree for an edit to its source; see :meth:`Parser.reparse`."""
+    return Parser().reparse(root, lines, start, old_end, new_end)
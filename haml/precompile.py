@@ -0,0 +1,262 @@
+"""Compile a tree of HAML templates into Mako modules ahead of time.
+
+The modules are written where Mako's ``TemplateLookup`` (given the same
+`module_directory`, and ``preprocessor=haml.preprocessor``) looks for them, so
+processes start with warm templates instead of each compiling them on first
+use::
+
+    haml-compile --module-dir /var/cache/mako templates/
+
+Or, with ``--bundle``, into a single file for :mod:`haml.bundle`.
+
+Each module records a hash of its source and the Mako arguments it was
+compiled with (see :func:`read_compile_args`), and templates which haven't
+changed since they were last compiled with the same arguments are skipped. A
+lookup using the modules must be given the same arguments (e.g.
+``default_filters`` and ``imports``), as Mako doesn't check them itself.
+
+"""
+
+from __future__ import print_function
+
+import ast
+import multiprocessing
+import os
+import posixpath
+import sys
+import time
+import traceback
+
+import mako
+from mako.lookup import TemplateLookup
+from mako.template import Template
+
+from . import preprocessor
+from .cache import atomic_write, cache_key
+from .lookup import HamlTemplateLookup
+
+
+_header_prefix = '# PyHAML source: '
+_args_prefix = '# PyHAML compile args: '
+
+_default_args = TemplateLookup().template_args
+
+
+def compile_args(template_args=None):
+    """Return the Mako arguments a compiled module depends on, as a dict.
+
+    Every name in :attr:`haml.lookup.HamlTemplateLookup.compile_args` is
+    included, with Mako's default where `template_args` doesn't give it, and
+    sequences as lists, so two results compare equal whenever the modules
+    would. Any other name in `template_args` raises TypeError.
+
+    """
+    template_args = dict(template_args or {})
+    unknown = set(template_args).difference(HamlTemplateLookup.compile_args)
+    if unknown:
+        raise TypeError('not a compile argument: %s' % ', '.join(sorted(unknown)))
+    args = {}
+    for name in HamlTemplateLookup.compile_args:
+        value = template_args.get(name, _default_args.get(name))
+        if isinstance(value, (list, tuple)):
+            value = list(value)
+        args[name] = value
+    return args
+
+
+def find_templates(root, suffix='.haml'):
+    """Yield the (path, uri) of every template within the directory."""
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        for name in sorted(file_names):
+            if name.endswith(suffix):
+                path = os.path.join(dir_path, name)
+                yield path, '/' + os.path.relpath(path, root).replace(os.path.sep, '/')
+
+
+def module_path(module_directory, uri):
+    """Return where Mako looks for the module of the given uri."""
+    uri = posixpath.normpath(uri.replace('\\', '/').lstrip('/'))
+    return os.path.abspath(os.path.join(os.path.normpath(module_directory), uri + '.py'))
+
+
+def _read_header(path, lines=1):
+    try:
+        with open(path, 'rb') as fh:
+            return '\n'.join(fh.readline().decode('utf8').rstrip('\n') for i in range(lines))
+    except (IOError, OSError):
+        return
+
+
+def read_compile_args(path):
+    """Return the compile args recorded in a compiled module, or None."""
+    header = _read_header(path, 2)
+    line = header.split('\n')[-1] if header else ''
+    if not line.startswith(_args_prefix):
+        return
+    return dict(ast.literal_eval(line[len(_args_prefix):]))
+
+
+def compile_module_source(source, path, uri, template_args=None):
+    """Return the source of the Mako module for the given template source.
+
+    `template_args` are passed to the ``Template``, and may be any of
+    :attr:`haml.lookup.HamlTemplateLookup.compile_args`.
+
+    """
+    args = compile_args(template_args)
+    template = Template(
+        source.decode(args['input_encoding'] or 'utf8'),
+        uri=uri,
+        filename=os.path.abspath(path),
+        preprocessor=preprocessor,
+        **args
+    )
+    return template.code
+
+
+def compile_template_file(path, uri, module_directory, force=False, template_args=None):
+    """Compile one template into its module, unless it is up to date.
+
+    `template_args` are as for :func:`compile_module_source`, and are
+    recorded in the module (see :func:`read_compile_args`).
+
+    Returns the status ("compiled" or "skipped") and the source size.
+
+    """
+    with open(path, 'rb') as fh:
+        source = fh.read()
+    args = compile_args(template_args)
+    header = '%s%s\n%s%r' % (
+        _header_prefix, cache_key(source, uri=uri, mako=mako.__version__, **args),
+        _args_prefix, sorted(args.items()),
+    )
+    output = module_path(module_directory, uri)
+
+    if not force and _read_header(output, 2) == header:
+        # Mako recompiles modules older than their template.
+        os.utime(output, None)
+        return 'skipped', len(source)
+
+    code = compile_module_source(source, path, uri, args)
+    directory = os.path.dirname(output)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    atomic_write(output, (header + '\n' + code).encode('utf8'))
+    return 'compiled', len(source)
+
+
+def _compile_job(args):
+    path, uri, module_directory, force, template_args = args
+    start = time.time()
+    try:
+        status, size = compile_template_file(path, uri, module_directory, force, template_args)
+    except Exception:
+        return uri, 'failed', time.time() - start, 0, traceback.format_exc()
+    return uri, status, time.time() - start, size, None
+
+
+def compile_tree(
+    roots, module_directory, jobs=None, force=False, suffix='.haml', callback=None, template_args=None,
+):
+    """Compile every template within the roots, over a pool of processes.
+
+    `template_args` are as for :func:`compile_module_source`.
+
+    Returns a list of (uri, status, seconds, size, error) for each template,
+    also passing each to `callback` as it completes.
+
+    """
+    compile_args(template_args) # Fail early on unknown args.
+    work = []
+    for root in roots:
+        for path, uri in find_templates(root, suffix):
+            work.append((path, uri, module_directory, force, template_args))
+
+    results = []
+    for result in run_jobs(_compile_job, work, jobs):
+        results.append(result)
+        if callback:
+            callback(result)
+    return results
+
+
+def run_jobs(func, work, jobs=None):
+    """Yield the results of `func` over the work, in a pool of `jobs` processes."""
+    if jobs == 1 or len(work) < 2:
+        for result in map(func, work):
+            yield result
+        return
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap_unordered(func, work):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(argv=None):
+
+    from optparse import OptionParser
+
+    if argv is None:
+        argv = sys.argv
+
+    parser = OptionParser("usage: %prog (--module-dir DIR | --bundle FILE) TEMPLATE_DIR [...]")
+    parser.add_option('-m', '--module-dir', help="where to write the compiled modules")
+    parser.add_option('-b', '--bundle', help="write the compiled templates into one bundle file instead")
+    parser.add_option('-j', '--jobs', type='int', help="number of processes (default: one per CPU)")
+    parser.add_option('-s', '--suffix', default='.haml', help="suffix of templates (default: %default)")
+    parser.add_option('-f', '--force', action='store_true', help="compile even unchanged templates")
+    parser.add_option('-q', '--quiet', action='store_true', help="only print the summary")
+    parser.add_option('-F', '--default-filter', action='append', dest='default_filters',
+        help="a default filter, as given to the lookup (repeatable)")
+    parser.add_option('-I', '--import', action='append', dest='imports',
+        help="an import for every module, as given to the lookup (repeatable)")
+    parser.add_option('--strict-undefined', action='store_true', help="compile with strict_undefined, as given to the lookup")
+
+    opts, args = parser.parse_args(argv[1:])
+    if not args:
+        parser.error("no template directories given") # Will exit
+    if not (opts.module_dir or opts.bundle):
+        parser.error("--module-dir or --bundle is required")
+
+    template_args = {}
+    for name in ('default_filters', 'imports', 'strict_undefined'):
+        if getattr(opts, name):
+            template_args[name] = getattr(opts, name)
+
+    def report(result):
+        uri, status, seconds, size, error = result
+        if error:
+            print('%8.1fms  %-8s  %s\n%s' % (seconds * 1000, status, uri, error), file=sys.stderr)
+        elif not opts.quiet:
+            print('%8.1fms  %-8s  %s' % (seconds * 1000, status, uri))
+
+    start = time.time()
+    if opts.bundle:
+        from .bundle import write_bundle
+        results = write_bundle(opts.bundle, args, opts.jobs, opts.suffix, report, template_args)
+    else:
+        results = compile_tree(args, opts.module_dir, opts.jobs, opts.force, opts.suffix, report, template_args)
+    elapsed = time.time() - start
+
+    counts = dict(compiled=0, skipped=0, failed=0)
+    size = 0
+    for uri, status, seconds, size_, error in results:
+        counts[status] += 1
+        size += size_
+    print('%d templates (%d compiled, %d skipped, %d failed) in %.2fs: %.1f templates/s, %.1fKB/s' % (
+        len(results), counts['compiled'], counts['skipped'], counts['failed'], elapsed,
+        len(results) / elapsed if elapsed else 0, size / 1024.0 / elapsed if elapsed else 0,
+    ))
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
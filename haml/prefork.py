@@ -0,0 +1,128 @@
+"""Warm templates in the master process of a pre-forking server.
+
+Workers forked from a master which has already compiled its templates share
+the compiled modules (copy-on-write) instead of each compiling, and holding,
+their own copies. With gunicorn, for example::
+
+    # gunicorn.conf.py
+    from haml.prefork import memory_usage, warm
+    from myapp import lookup
+
+    def on_starting(server):
+        report = warm(lookup, ['*.haml'])
+        server.log.info('warmed %d templates in %.2fs', len(report['templates']), report['seconds'])
+
+    def post_fork(server, worker):
+        server.log.info('worker %d memory: %r', worker.pid, memory_usage())
+
+Memory figures are read from ``/proc``, and so are only available on Linux.
+
+"""
+
+import fnmatch
+import gc
+import os
+import re
+import time
+import traceback
+
+
+_has_glob = re.compile(r'[*?[]').search
+
+
+def find_uris(lookup, patterns):
+    """Return the uris of templates within the lookup's directories, or its
+    bundle (see :class:`haml.bundle.BundleTemplateLookup`), which match any of
+    the patterns.
+
+    Patterns are matched (as by :mod:`fnmatch`, so ``*`` also matches ``/``)
+    against uris relative to a lookup directory, without the leading slash.
+
+    """
+    patterns = [pattern.lstrip('/') for pattern in patterns]
+    def matches(uri):
+        return any(fnmatch.fnmatchcase(uri, pattern) for pattern in patterns)
+    uris = set()
+    for root in lookup.directories:
+        for dir_path, dir_names, file_names in os.walk(root):
+            for name in file_names:
+                uri = os.path.relpath(os.path.join(dir_path, name), root).replace(os.path.sep, '/')
+                if matches(uri):
+                    uris.add('/' + uri)
+    bundle = getattr(lookup, 'bundle', None)
+    if bundle is not None:
+        uris.update(uri for uri in bundle.uris() if matches(uri.lstrip('/')))
+    return sorted(uris)
+
+
+def _read_proc(pid, name):
+    try:
+        with open('/proc/%s/%s' % (pid, name)) as fh:
+            return fh.read()
+    except (IOError, OSError):
+        return
+
+
+def memory_usage(pid='self'):
+    """Return the memory of a process, in bytes.
+
+    Has "rss", and, where the kernel provides them, "pss" (resident memory
+    with shared pages divided among the processes sharing them), "shared" and
+    "private". Empty if ``/proc`` isn't available.
+
+    """
+    usage = {}
+    data = _read_proc(pid, 'smaps_rollup')
+    if data:
+        fields = dict(
+            Rss='rss',
+            Pss='pss',
+            Shared_Clean='shared',
+            Shared_Dirty='shared',
+            Private_Clean='private',
+            Private_Dirty='private',
+        )
+        for line in data.splitlines()[1:]:
+            parts = line.split()
+            if len(parts) == 3 and parts[0].rstrip(':') in fields:
+                key = fields[parts[0].rstrip(':')]
+                usage[key] = usage.get(key, 0) + int(parts[1]) * 1024
+        return usage
+    data = _read_proc(pid, 'statm')
+    if data:
+        usage['rss'] = int(data.split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    return usage
+
+
+def warm(lookup, patterns=('*',), freeze=True):
+    """Load every template matching the patterns into the lookup.
+
+    `patterns` are uris, or globs as for :func:`find_uris`; uris are loaded
+    even if they aren't found there (e.g. from a custom lookup). Templates
+    which fail to load are reported rather than raised. If `freeze`, objects
+    which exist afterwards are moved out of the garbage collector's reach
+    (``gc.freeze``, on Python 3.7+) so that collections in the workers don't
+    write to, and so unshare, the pages holding them.
+
+    Returns a dict with the "templates" loaded, those "failed" (mapped to
+    their tracebacks), the "seconds" taken, and the process' "memory_before"
+    and "memory_after" (see :func:`memory_usage`).
+
+    """
+    report = dict(templates=[], failed={}, memory_before=memory_usage())
+    start = time.time()
+    uris = set(find_uris(lookup, patterns))
+    uris.update('/' + pattern.lstrip('/') for pattern in patterns if not _has_glob(pattern))
+    for uri in sorted(uris):
+        try:
+            lookup.get_template(uri)
+        except Exception:
+            report['failed'][uri] = traceback.format_exc()
+        else:
+            report['templates'].append(uri)
+    report['seconds'] = time.time() - start
+    if freeze and hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+    report['memory_after'] = memory_usage()
+    return report
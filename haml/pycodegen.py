@@ -0,0 +1,431 @@
+"""Compile HAML straight to Python, bypassing Mako's lexer and parser.
+
+The Mako backend generates Mako source, which Mako must then lex, parse and
+compile into a Python module. This backend generates that Python module
+directly from the node tree::
+
+    template = haml.pycodegen.Template('%p Hello ${name}!')
+    template.render(name='World')
+
+Templates may use the subset of Mako which PyHAML itself produces: ``${}``
+expressions (with filters), control structures, Python blocks, HAML filters
+and mixins. Other Mako syntax (e.g. ``<%include>``, ``<%inherit>``, Mako tags
+via ``%%`` and ``##`` comments) is not supported.
+
+"""
+
+import ast
+import functools
+import itertools
+import re
+import tokenize
+
+import six
+from mako.filters import DEFAULT_ESCAPES
+
+from . import nodes
+from . import runtime
+from .codegen import Generator
+from .parse import parse_string
+
+
+class Caller(object):
+
+    """The `caller` within a mixin; `caller.body()` renders the call's content."""
+
+    def __init__(self, body):
+        self.body = body
+
+
+class code(Generator.opaque):
+
+    """Python source to be emitted as-is, instead of written to the output.
+
+    When assembled, `before` and `after` adjust the indent level around
+    `lines`, and `then` follows at the adjusted level. Module-level code is
+    hoisted out of the render function.
+
+    """
+
+    def __new__(cls, *lines, **kwargs):
+        module = kwargs.pop('module', False)
+        self = Generator.opaque.__new__(cls, '\n'.join(lines) or '#', hoist=module)
+        self.lines = lines
+        self.before = kwargs.pop('before', 0)
+        self.after = kwargs.pop('after', 0)
+        self.then = kwargs.pop('then', ())
+        self.module = module
+        if kwargs:
+            raise TypeError('unexpected arguments %r' % sorted(kwargs))
+        return self
+
+
+class silent_code(code, Generator.no_strip):
+    """Code which writes nothing, so is ignored by whitespace removal."""
+
+
+class verbatim(six.text_type):
+    """A line of code which must not be re-indented (e.g. within a string)."""
+
+
+def _mark_verbatim(lines):
+    """Mark lines which continue a multi-line string as verbatim."""
+    readline = functools.partial(next, iter([line + '\n' for line in lines]), '')
+    inside = set()
+    for token in tokenize.generate_tokens(readline):
+        if token[0] == tokenize.STRING:
+            inside.update(range(token[2][0], token[3][0]))
+    return [verbatim(line) if i in inside else line for i, line in enumerate(lines)]
+
+
+def _load_names(source, mode='exec'):
+    """Return the set of names which are read by the given Python source."""
+    return set(
+        node.id for node in ast.walk(ast.parse(source.strip(), mode=mode))
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)
+    )
+
+
+def _declared_names(source):
+    """Return the set of names which are defined at the top of a module."""
+    names = set()
+    for stmt in ast.parse(source).body:
+        if isinstance(stmt, (ast.FunctionDef, ast.ClassDef)):
+            names.add(stmt.name)
+        elif isinstance(stmt, (ast.Import, ast.ImportFrom)):
+            for alias in stmt.names:
+                names.add((alias.asname or alias.name).split('.')[0])
+        else:
+            for node in ast.walk(stmt):
+                if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+                    names.add(node.id)
+    return names
+
+
+def _split_interpolations(text):
+    """Split text into alternating literal text and the inside of ${}."""
+    parts = []
+    pos = 0
+    while True:
+        start = text.find('${', pos)
+        if start < 0:
+            break
+        depth = 0
+        quote = None
+        i = start + 1
+        while i < len(text):
+            char = text[i]
+            if quote:
+                if char == '\\':
+                    i += 1
+                elif char == quote:
+                    quote = None
+            elif char in '\'"':
+                quote = char
+            elif char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+                if not depth:
+                    break
+            i += 1
+        else:
+            # Unterminated; Mako would fail on this too.
+            raise SyntaxError('unterminated ${} in %r' % text[start:start + 40])
+        parts.append(text[pos:start])
+        parts.append(text[start + 2:i])
+        pos = i + 1
+    parts.append(text[pos:])
+    return parts
+
+
+_expression_filters_re = re.compile(r'^(.*?)\|\s*(\w+(?:\s*,\s*\w+)*)\s*$', re.S)
+
+
+class PythonGenerator(Generator):
+
+    """A generator which emits a Python module with a `render(context)` function."""
+
+    code = code
+    code_indent = '    '
+
+    # Lines which start every function that renders output.
+    scope_prologue = (
+        '__buf = []',
+        '__write = __buf.append',
+        '__stack = []',
+    )
+
+    def generate(self, node):
+        self._names = set()
+        self._declared = set()
+        self._callers = []
+        self._caller_ids = itertools.count(1)
+        self._function_depth = 0
+
+        module = []
+        body = []
+        level = 1
+        opened = [True]
+        static = []
+
+        def emit(lines, level):
+            indent = self.code_indent * level
+            body.extend(line if isinstance(line, verbatim) else indent + line for line in lines)
+            opened[-1] = opened[-1] or any(line.strip() for line in lines)
+
+        def move(delta, level):
+            while delta < 0:
+                if not opened.pop():
+                    emit(['pass'], level)
+                level -= 1
+                delta += 1
+            while delta > 0:
+                opened.append(False)
+                level += 1
+                delta -= 1
+            return level
+
+        for token in self.generate_iter(node):
+            if not isinstance(token, self.code):
+                static.append(token)
+                continue
+            if static:
+                emit(self._write_static(''.join(static)), level)
+                static = []
+            if token.module:
+                module.extend(token.lines)
+                continue
+            level = move(token.before, level)
+            emit(token.lines, level)
+            level = move(token.after, level)
+            emit(token.then, level)
+        if static:
+            emit(self._write_static(''.join(static)), level)
+
+        bindings = []
+        for name in sorted(self._names - self._declared):
+            if name == 'context' or name.startswith('__'):
+                continue
+            if hasattr(six.moves.builtins, name):
+                bindings.append('%s = context.get(%r, __builtins.%s)' % (name, name, name))
+            else:
+                bindings.append('%s = context.get(%r, UNDEFINED)' % (name, name))
+
+        out = [
+            '# -*- coding: utf-8 -*-',
+            'import six.moves.builtins as __builtins',
+            'from mako import filters as __M_filters',
+            'from mako.runtime import UNDEFINED',
+            'from %s import runtime as __HAML' % __package__,
+            'from %s.pycodegen import Caller as __HAML_Caller' % __package__,
+            '__str = %s' % ('str' if six.PY3 else 'unicode'),
+        ]
+        out.extend(module)
+        out.append('def render(context, __flush=None):')
+        for line in self.scope_prologue + ('__callers = []', ) + tuple(bindings):
+            out.append(self.code_indent + line)
+        out.extend(body)
+        out.append(self.code_indent + "return ''.join(__buf)")
+        out.append('')
+        return '\n'.join(out)
+
+    def _write_static(self, text):
+        # Mako discards escaped newlines in text.
+        text = text.replace('\\\n', '')
+        parts = _split_interpolations(text)
+        lines = []
+        for i, part in enumerate(parts):
+            if not i % 2:
+                if part:
+                    lines.append('__write(%r)' % part)
+                continue
+            m = _expression_filters_re.match(part)
+            if m:
+                lines.append(self._write_expression(m.group(1).strip(), m.group(2)))
+            else:
+                lines.append(self._write_expression(part.strip()))
+        return lines
+
+    def _write_expression(self, expr, filters=''):
+        self._names.update(_load_names(expr, 'eval'))
+        names = [x.strip() for x in filters.split(',') if x.strip()]
+        if 'n' not in names:
+            names.insert(0, 'str')
+        for name in names:
+            escape = DEFAULT_ESCAPES.get(name, name)
+            if escape == 'n':
+                continue
+            elif escape == 'str':
+                expr = '__str(%s)' % expr
+            elif escape.startswith('filters.'):
+                expr = '__M_%s(%s)' % (escape, expr)
+            else:
+                self._names.add(name)
+                expr = '%s(%s)' % (name, expr)
+        return '__write(%s)' % expr
+
+    def start_document(self):
+        return ''
+
+    def end_document(self):
+        if self.module_code:
+            yield self.code(*self.module_code, module=True)
+
+    def attribute_str(self, const_attrs, kwargs_expr=None):
+        if not kwargs_expr:
+            return runtime.attribute_str(const_attrs)
+        self._names.update(_load_names('f(%s)' % kwargs_expr, 'eval'))
+        return self.code('__write(%s)' % self.attribute_call(const_attrs, kwargs_expr))
+
+    def start_tag(self, node, attr_str, self_closing=False):
+        if isinstance(node, (nodes.MixinDef, nodes.MixinCall)):
+            self._function_depth += 1
+        if isinstance(node, nodes.MixinDef):
+            self._names.update(_load_names('def f(%s): pass' % (node.argspec or '')))
+            return self.code(
+                'def %s(%s):' % (node.mixin_name, node.argspec or ''),
+                after=1,
+                then=self.scope_prologue + ('caller = __callers[-1] if __callers else UNDEFINED', ),
+            )
+        if isinstance(node, nodes.MixinCall):
+            name = '__haml_caller_%d' % next(self._caller_ids)
+            self._callers.append(name)
+            return self.code('def %s():' % name, after=1, then=self.scope_prologue)
+        if node.name.startswith('%'):
+            raise ValueError('Mako tag %r is not supported by the Python backend' % node.name)
+        if not isinstance(attr_str, self.code):
+            return super(PythonGenerator, self).start_tag(node, attr_str, self_closing)
+        return self.code(
+            '__write(%r)' % ('<' + node.name),
+            attr_str,
+            '__write(%r)' % (' />' if self_closing else '>'),
+        )
+
+    def end_tag(self, node):
+        if isinstance(node, (nodes.MixinDef, nodes.MixinCall)):
+            self._function_depth -= 1
+        if isinstance(node, nodes.MixinDef):
+            return self.code("return ''.join(__buf)", after=-1)
+        if isinstance(node, nodes.MixinCall):
+            call = '%s(%s)' % (node.mixin_name, node.argspec or '')
+            self._names.update(_load_names(call, 'eval'))
+            return self.code("return ''.join(__buf)", after=-1, then=(
+                '__callers.append(__HAML_Caller(%s))' % self._callers.pop(),
+                'try:',
+                self.code_indent + '__write(__str(%s))' % call,
+                'finally:',
+                self.code_indent + '__callers.pop()',
+            ))
+        return super(PythonGenerator, self).end_tag(node)
+
+    def expression(self, content, filters=''):
+        return self.code(self._write_expression(content, filters))
+
+    def start_control(self, node):
+        if node.type == 'for':
+            self._names.update(_load_names('for %s: pass' % node.test))
+        elif node.test is not None:
+            self._names.update(_load_names(node.test, 'eval'))
+        if node.test is None:
+            source = '%s:' % node.type
+        else:
+            source = '%s %s:' % (node.type, node.test)
+        if node.type in ('elif', 'else'):
+            yield self.code(source, before=-1, after=1)
+        else:
+            yield self.code(source, after=1)
+
+    def end_control(self, node):
+        yield self.code(before=-1)
+
+    def flush(self):
+        # Mixins return their output, so can only flush at the top level.
+        if not self._function_depth:
+            yield silent_code(
+                'if __flush is not None:',
+                self.code_indent + "__flush(''.join(__buf))",
+                self.code_indent + 'del __buf[:]',
+            )
+
+    def python_block(self, node):
+        lines = list(node.iter_dedented())
+        source = '\n'.join(lines)
+        lines = _mark_verbatim(lines)
+        if node.module:
+            self._declared.update(_declared_names(source))
+        else:
+            self._names.update(_load_names(source))
+        yield self.code(*lines, module=node.module)
+
+    def literal(self, text):
+        return self.code('__write(%r)' % text)
+
+    def filter_block(self, node):
+        source = self.endl.join(node.iter_dedented()).strip()
+        output = self.evaluate_filter(node, source)
+        if output is not None:
+            yield self.literal(output)
+            yield self.endl
+            return
+        yield self.code(
+            '__stack.append(__buf)',
+            '__buf = []',
+            '__write = __buf.append',
+        )
+        parts = node.split_expressions(source)
+        lines = []
+        for i, part in enumerate(parts):
+            if i % 2:
+                lines.extend(self._write_static(part))
+            elif part:
+                lines.append('__write(%r)' % part)
+        yield self.code(*lines)
+        yield self.code(
+            "__filtered = ''.join(__buf)",
+            '__buf = __stack.pop()',
+            '__write = __buf.append',
+            '__write((%s)(__filtered))' % self.filter_call(node),
+        )
+        yield self.endl
+
+
+def generate_python(node, **options):
+    """Generate the source of a Python module which renders the given node."""
+    return PythonGenerator(**options).generate(node)
+
+
+class Template(object):
+
+    """A HAML template compiled by the Python backend.
+
+    Mirrors the rendering API of :class:`mako.template.Template`. A template
+    read from `filename` is decoded with `input_encoding`, or UTF-8, as Mako
+    does, whatever the locale.
+
+    """
+
+    def __init__(self, text=None, filename=None, node=None, input_encoding=None, **options):
+        if node is None:
+            if text is None:
+                with open(filename, 'rb') as fh:
+                    text = fh.read().decode(input_encoding or 'utf-8')
+            node = parse_string(text)
+        self.filename = filename or '<haml>'
+        self.code = generate_python(node, **options)
+        self.module = {'__name__': 'haml_template'}
+        six.exec_(compile(self.code, self.filename, 'exec'), self.module)
+        self.callable_ = self.module['render']
+
+    def render(self, **data):
+        return self.callable_(data)
+
+    def render_stream(self, data, flush):
+        """Render, passing output to `flush` at each flush point.
+
+        Returns the output after the last flush point.
+
+        """
+        return self.callable_(data, flush)
+
+    render_unicode = render
@@ -1,10 +1,25 @@
 import re
 import html
 
-from six import string_types, iteritems
+from six import string_types, iteritems, text_type
 
 from . import filters
 
+try:
+    import markupsafe
+except ImportError:
+    markupsafe = None
+
+def _markupsafe_escape_public(value):
+    return text_type(markupsafe.escape(value))
+
+# markupsafe 3's C escape returns text, without wrapping it in Markup; it is
+# private, so any other version of markupsafe uses its public escape.
+try:
+    from markupsafe._speedups import _escape_inner as _markupsafe_escape
+except ImportError:
+    _markupsafe_escape = None if markupsafe is None else _markupsafe_escape_public
+
 _attr_sort_order = {
     'id': -3,
     'class': -2,
@@ -14,15 +29,69 @@ _attr_sort_order = {
 }
 
 
+class _BoundedMemo(dict):
+
+    """A dict which computes missing values, and empties itself when full."""
+
+    def __init__(self, func, maxsize=1024):
+        super(_BoundedMemo, self).__init__()
+        self.func = func
+        self.maxsize = maxsize
+
+    def __missing__(self, key):
+        if len(self) >= self.maxsize:
+            self.clear()
+        value = self[key] = self.func(key)
+        return value
+
+
 _camelcase_re = re.compile(r'(?<!^)([A-Z])([A-Z]*)')
-def adapt_camelcase(name, seperator):
+def _adapt_camelcase(args):
+    name, seperator = args
     return _camelcase_re.sub(lambda m: seperator + m.group(0), name).lower()
 
+_adapt_camelcase_memo = _BoundedMemo(_adapt_camelcase)
+def adapt_camelcase(name, seperator):
+    return _adapt_camelcase_memo[name, seperator]
+
+# Keys which are already in their final form (i.e. have no camelCase).
+_is_normal_key = _BoundedMemo(lambda key: adapt_camelcase(key, '-') == key)
+
+_attr_sort_key = _BoundedMemo(lambda key: (_attr_sort_order.get(key, 0), key))
+
+
+def _escape_text_html(value):
+    # This already turns quotes into &quot; and &#x27;.
+    return html.escape(value)
+
+def _escape_text_markupsafe(value):
+    # markupsafe spells quotes as numeric references; match html.escape.
+    value = _markupsafe_escape(value)
+    if '&#3' in value:
+        value = value.replace('&#34;', '&quot;').replace('&#39;', '&#x27;')
+    return value
+
+_escape_text = _escape_text_html if _markupsafe_escape is None else _escape_text_markupsafe
+
+
+def escape_attribute(value):
+    """Escape a value for use within a double-quoted HTML attribute.
+
+    Values with an ``__html__`` method (e.g. ``markupsafe.Markup``) are
+    already safe, and are used as they are.
+
+    """
+    if type(value) is not text_type:
+        if hasattr(value, '__html__'):
+            return value.__html__()
+        value = "%s" % value
+    return _escape_text(value)
+
 
 def _format_mako_attr_pair(k, v):
     if v is True:
         v = k
-    return ' %s="%s"' % (k, html.escape("%s" % v).replace('"', '&quot;'))
+    return ' %s="%s"' % (k, escape_attribute(v))
 
 
 def flatten_attr_list(input):
@@ -55,6 +124,41 @@ def attribute_str(*args, **kwargs):
     for arg in args:
         x.update(arg)
     x.update(kwargs)
+    if '__obj_ref' not in x and '__obj_ref_pre' not in x:
+        fast = _fast_attribute_str(x)
+        if fast is not None:
+            return fast
+    return _attribute_str(x)
+
+
+def _fast_attribute_str(x):
+    # The common case: no object reference, no nested dicts, and every key
+    # already normalised. Returns None if the general treatment is needed.
+    if x.get('__adapt_camelcase', True):
+        for k, v in iteritems(x):
+            if isinstance(v, dict) or not _is_normal_key[k]:
+                return
+    else:
+        for v in x.values():
+            if isinstance(v, dict):
+                return
+    x.pop('__adapt_camelcase', None)
+    id_ = x.pop('id', None)
+    class_ = x.pop('class', None), x.pop('class_', None)
+    pairs = [(k, v) for k, v in iteritems(x) if v]
+    if id_:
+        id_ = '_'.join(map(str, flatten_attr_list(id_)))
+        if id_:
+            pairs.append(('id', id_))
+    if class_ != (None, None):
+        class_ = ' '.join(map(str, flatten_attr_list(class_)))
+        if class_:
+            pairs.append(('class', class_))
+    pairs.sort(key=lambda pair: _attr_sort_key[pair[0]])
+    return ''.join(_format_mako_attr_pair(k, v) for k, v in pairs)
+
+
+def _attribute_str(x):
     obj_ref = x.pop('__obj_ref', None)
     obj_ref_prefix = x.pop('__obj_ref_pre', None)
     if x.pop('__adapt_camelcase', True):
@@ -74,7 +178,91 @@ def attribute_str(*args, **kwargs):
     pairs = []
     for k, v in iteritems(x):
         pairs.extend(flatten_attr_dict(k, v))
-    pairs.sort(key=lambda pair: (_attr_sort_order.get(pair[0], 0), pair[0]))
+    pairs.sort(key=lambda pair: _attr_sort_key[pair[0]])
     return ''.join(_format_mako_attr_pair(k, v) for k, v in pairs if v)
 
 
+def flush(context):
+    """Hand on the output so far, if streaming (see :mod:`haml.stream`).
+
+    Only output written straight to the stream is flushed; not while it is
+    being captured (e.g. by a filter).
+
+    """
+    flush = getattr(context._buffer_stack[-1], 'flush_stream', None)
+    if flush is not None:
+        flush()
+
+
+def attribute_formatter(const_attrs, names):
+    """Build a specialised :func:`attribute_str` for a tag.
+
+    This is for tags whose dynamic attributes are all plain keyword arguments,
+    so their names are known at compile time. The constant attributes are
+    rendered and everything is sorted up front, and only the dynamic values
+    are escaped when called. Values which need the general treatment (i.e.
+    nested dicts) fall back to :func:`attribute_str`.
+
+    Returns None if the names can't be specialised.
+
+    """
+
+    const_attrs = dict(const_attrs)
+    adapt = const_attrs.get('__adapt_camelcase', True)
+
+    attrs = {} # Maps final attribute names to keyword names.
+    for name in names:
+        if name.startswith('__'):
+            return
+        attr = adapt_camelcase(name, '-') if adapt else name
+        if name == 'class_':
+            attr = 'class'
+        elif attr in ('class', 'class_') or (attr == 'id' and name != 'id'):
+            return
+        if attr in attrs:
+            return
+        attrs[attr] = name
+
+    for attr in ('id', 'class'):
+        if const_attrs.get(attr):
+            attrs.setdefault(attr, None)
+
+    steps = []
+    for attr in sorted(attrs, key=_attr_sort_key.__getitem__):
+        name = attrs[attr]
+        if name is None:
+            steps.append(_format_mako_attr_pair(attr, const_attrs[attr]))
+        elif attr == 'id':
+            steps.append((attr, name, '_', ()))
+        elif attr == 'class':
+            steps.append((attr, name, ' ', (const_attrs['class'], ) if const_attrs.get('class') else ()))
+        else:
+            steps.append((attr, name, None, None))
+
+    # Merge neighbouring constants.
+    merged = []
+    for step in steps:
+        if merged and not isinstance(step, tuple) and not isinstance(merged[-1], tuple):
+            merged[-1] += step
+        else:
+            merged.append(step)
+    steps = tuple(merged)
+
+    def format_attributes(**kwargs):
+        out = []
+        for step in steps:
+            if not isinstance(step, tuple):
+                out.append(step)
+                continue
+            attr, name, sep, prefix = step
+            value = kwargs[name]
+            if sep is not None:
+                value = sep.join(map(str, flatten_attr_list(prefix + (value, ))))
+            elif isinstance(value, dict):
+                return attribute_str(const_attrs, **kwargs)
+            if value:
+                out.append(_format_mako_attr_pair(attr, value))
+        return ''.join(out)
+
+    return format_attributes
+
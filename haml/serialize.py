@@ -0,0 +1,263 @@
+"""Serialise parsed node trees to a compact form, and load them again.
+
+A tree is stored as a table of the strings within it, a table of the node
+classes, and flat arrays of integers: the class of every node in order
+(parents first), each node's parent and how it is attached to it, and, for
+each class, a column of every attribute of its nodes, with strings as
+indices into the table. The whole is marshalled, and loading it sets each
+column of attributes in one pass, so is much faster than parsing the source
+again, e.g. to cache parsed trees on disk or hand them between processes::
+
+    data = dumps(parse_string(source))
+    root = loads(data)
+
+Trees are loaded as they were dumped, with line numbers and the state needed
+by :func:`haml.parse.reparse`. Data from an incompatible version of PyHAML
+raises :class:`TreeFormatError`.
+
+"""
+
+from array import array
+import itertools
+import marshal
+import sys
+
+import six
+from six import string_types
+from six.moves import map, zip
+
+from . import nodes
+
+
+_magic = 'PyHAML tree 1'
+
+# Attributes holding other nodes, and the value of each without any; a
+# node's index here is how it is attached to its parent.
+_links = (
+    ('inline_child', None),
+    ('children', nodes._no_children),
+    ('elifs', nodes._no_children),
+    ('else_', None),
+)
+_link_names = frozenset(name for name, default in _links)
+
+# Attributes which are rebuilt as nodes are attached.
+_derived = frozenset(['_greedy_root'])
+
+# How the values in a column are stored: as indices into the string table
+# (where 0 is None), as non-negative integers, as lists of indices, or as
+# they are. The first two are packed, for each class, into one array.
+_STRING, _INTEGER, _STRINGS, _RAW = range(4)
+
+_typecodes = [code for code in 'BHIL' if code in getattr(array, 'typecodes', 'BHIL')]
+
+
+class TreeFormatError(ValueError):
+    """Data is not a serialised tree, or is from an incompatible version."""
+
+
+_attrs_by_class = {}
+
+def _attrs(cls):
+    """Return the names of the attributes stored for nodes of the class."""
+    try:
+        return _attrs_by_class[cls]
+    except KeyError:
+        pass
+    names = []
+    for klass in reversed(cls.__mro__):
+        for name in klass.__dict__.get('__slots__', ()):
+            if name not in _link_names and name not in _derived:
+                names.append(name)
+    names = _attrs_by_class[cls] = tuple(names)
+    return names
+
+
+def _pack(values):
+    """Pack non-negative integers into (typecode, bytes), as small as they fit."""
+    top = max(values) if values else 0
+    for code in _typecodes:
+        packed = array(str(code))
+        if top < 1 << (8 * packed.itemsize):
+            packed.extend(values)
+            return code, packed.tostring() if six.PY2 else packed.tobytes()
+    raise ValueError('integer too large: %d' % top)
+
+
+def _unpack(packed, byteorder):
+    code, data = packed
+    values = array(str(code))
+    if six.PY2:
+        values.fromstring(data)
+    else:
+        values.frombytes(data)
+    if byteorder != sys.byteorder:
+        values.byteswap()
+    return values
+
+
+def _is_index(value):
+    return isinstance(value, six.integer_types) and not isinstance(value, bool) and value >= 0
+
+
+def dumps(node):
+    """Return the node tree serialised as bytes."""
+    string_ids = {None: 0}
+    strings = []
+    def string_id(value):
+        id_ = string_ids.get(value)
+        if id_ is None:
+            id_ = string_ids[value] = len(string_ids)
+            strings.append(value)
+        return id_
+
+    class_ids = {}
+    by_class = []
+    order = []
+    parents = []
+    links = []
+
+    # Parents first, and with their children in order.
+    stack = [(node, None, None)]
+    while stack:
+        node, parent, link = stack.pop()
+        index = len(order)
+        cls = type(node)
+        class_id = class_ids.get(cls)
+        if class_id is None:
+            class_id = class_ids[cls] = len(by_class)
+            by_class.append((cls, []))
+        by_class[class_id][1].append(node)
+        order.append(class_id)
+        if parent is not None:
+            parents.append(parent)
+            links.append(link)
+        linked = []
+        for link, (name, default) in enumerate(_links):
+            value = getattr(node, name, None)
+            if isinstance(value, nodes.Base):
+                linked.append((value, index, link))
+            elif value:
+                linked.extend((child, index, link) for child in value)
+        stack.extend(reversed(linked))
+
+    classes = []
+    columns = []
+    for cls, instances in by_class:
+        attrs = _attrs(cls)
+        kinds = []
+        packed = []
+        others = []
+        for name in attrs:
+            values = [getattr(node, name) for node in instances]
+            if all(value is None or isinstance(value, string_types) for value in values):
+                kinds.append(_STRING)
+                packed.extend(string_id(value) for value in values)
+            elif all(_is_index(value) for value in values):
+                kinds.append(_INTEGER)
+                packed.extend(values)
+            elif all(
+                isinstance(value, list) and all(isinstance(x, string_types) for x in value)
+                for value in values
+            ):
+                kinds.append(_STRINGS)
+                others.append([[string_id(x) for x in value] for value in values])
+            else:
+                kinds.append(_RAW)
+                others.append(values)
+        classes.append((cls.__name__, attrs, tuple(kinds), len(instances)))
+        columns.append((_pack(packed), others))
+
+    return marshal.dumps((
+        _magic, sys.byteorder, tuple(strings), tuple(classes),
+        _pack(order + parents + links), columns,
+    ))
+
+
+_loaders = {}
+
+def _loader(name, attrs):
+    """Return a node class, and the setters of its links and attributes."""
+    try:
+        return _loaders[name, attrs]
+    except KeyError:
+        pass
+    cls = getattr(nodes, name, None)
+    if not (isinstance(cls, type) and issubclass(cls, nodes.Base)) or _attrs(cls) != attrs:
+        raise TreeFormatError('node class %s has changed' % name)
+    links = tuple((getattr(cls, name).__set__, default) for name, default in _links if hasattr(cls, name))
+    greedy = cls._greedy_root.__set__ if issubclass(cls, nodes.GreedyBase) else None
+    setters = tuple(getattr(cls, name).__set__ for name in attrs)
+    loader = _loaders[name, attrs] = cls, links, greedy, setters
+    return loader
+
+
+def loads(data):
+    """Return the node tree serialised in the given bytes."""
+    try:
+        magic, byteorder, strings, classes, structure, columns = marshal.loads(data)
+    except Exception:
+        raise TreeFormatError('not a serialised tree')
+    if magic != _magic:
+        raise TreeFormatError('not a serialised tree, or from another version of PyHAML')
+    if not classes:
+        raise TreeFormatError('no nodes')
+
+    get_string = ((None, ) + strings).__getitem__
+    by_class = []
+    for (name, attrs, kinds, count), (packed, others) in zip(classes, columns):
+        cls, link_setters, greedy, setters = _loader(name, tuple(attrs))
+
+        # Nodes are made without calling __init__, and their attributes set
+        # a column at a time through the slots' descriptors (whose __set__
+        # returns None, so any() runs them all).
+        instances = list(map(cls.__new__, itertools.repeat(cls, count)))
+        for setter, default in link_setters:
+            any(map(setter, instances, itertools.repeat(default, count)))
+        if greedy is not None:
+            any(map(greedy, instances, instances))
+        packed = _unpack(packed, byteorder)
+        others = iter(others)
+        start = 0
+        for setter, kind in zip(setters, kinds):
+            if kind == _STRING:
+                values = map(get_string, packed[start:start + count])
+                start += count
+            elif kind == _INTEGER:
+                values = packed[start:start + count]
+                start += count
+            elif kind == _STRINGS:
+                values = [list(map(get_string, ids)) for ids in next(others)]
+            else:
+                values = next(others)
+            any(map(setter, instances, values))
+        by_class.append(iter(instances))
+
+    structure = _unpack(structure, byteorder)
+    # The class of each node, then the parent and link of all but the root.
+    size = (len(structure) + 2) // 3
+    tree = list(map(next, map(by_class.__getitem__, structure[:size])))
+    for node, parent, link in zip(
+        itertools.islice(tree, 1, None), structure[size:2 * size - 1], structure[2 * size - 1:]
+    ):
+        parent = tree[parent]
+        if link < 2:
+            parent.add_child(node, not link)
+        elif link == 2:
+            if parent.elifs is nodes._no_children:
+                parent.elifs = [node]
+            else:
+                parent.elifs.append(node)
+        else:
+            parent.else_ = node
+    return tree[0]
+
+
+def dump(node, fileobj):
+    """Write the node tree, serialised, to a binary file object."""
+    fileobj.write(dumps(node))
+
+
+def load(fileobj):
+    """Return the node tree serialised in a binary file object."""
+    return loads(fileobj.read())
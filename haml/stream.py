@@ -0,0 +1,126 @@
+"""Render templates as a stream of chunks.
+
+Rendering normally builds the whole page before returning any of it. With
+:func:`iter_render` each chunk is handed on as soon as rendering passes a
+``!flush`` line in the template, so that large pages start to arrive sooner,
+and don't have to be held in memory all at once::
+
+    %html
+      %head
+        %title Report
+      !flush
+      %body
+        - for row in rows:
+          ...
+
+The iterator may be returned directly as a WSGI response::
+
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/html; charset=utf-8')])
+        return iter_render(template, dict(rows=rows), encoding='utf-8')
+
+Rendering runs on a separate thread, which is kept at most `max_pending`
+chunks ahead of the consumer. Works with Mako templates (with the HAML
+preprocessor) and :class:`haml.pycodegen.Template`. Flush points within
+mixins have no effect with the Python backend.
+
+"""
+
+import sys
+import threading
+
+import six
+from six.moves import queue
+from mako.runtime import Context, _kwargs_for_callable
+
+from . import pycodegen
+
+
+class _Closed(Exception):
+    """Raised within the rendering thread once the consumer has gone."""
+
+
+class _StreamBuffer(object):
+
+    """A Mako output buffer which can pass what it holds on to the stream."""
+
+    def __init__(self, put):
+        self.put = put
+        self.data = []
+        self.write = self.data.append
+
+    def flush_stream(self):
+        if self.data:
+            self.put(u''.join(self.data))
+            del self.data[:]
+
+    def getvalue(self):
+        return u''.join(self.data)
+
+
+def render_to(template, data, put):
+    """Render, passing each chunk of output to `put` as it is flushed."""
+    if isinstance(template, pycodegen.Template):
+        rest = template.render_stream(data, put)
+        if rest:
+            put(rest)
+    else:
+        buffer = _StreamBuffer(put)
+        # Bind the template's page args, as Template.render does.
+        template.render_context(Context(buffer, **data), **_kwargs_for_callable(template.callable_, data))
+        buffer.flush_stream()
+
+
+class _Stream(object):
+
+    def __init__(self, template, data, encoding, max_pending):
+        self.template = template
+        self.data = data
+        self.encoding = encoding
+        self.queue = queue.Queue(max_pending)
+        self.closed = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def put(self, chunk):
+        while True:
+            if self.closed:
+                raise _Closed()
+            try:
+                self.queue.put(('chunk', chunk), timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def run(self):
+        try:
+            render_to(self.template, self.data, self.put)
+        except _Closed:
+            return
+        except Exception:
+            self.queue.put(('error', sys.exc_info()))
+            return
+        self.queue.put(('end', None))
+
+    def __iter__(self):
+        self.thread.start()
+        try:
+            while True:
+                kind, value = self.queue.get()
+                if kind == 'chunk':
+                    yield value.encode(self.encoding) if self.encoding else value
+                elif kind == 'error':
+                    six.reraise(*value)
+                else:
+                    return
+        finally:
+            self.closed = True
+
+
+def iter_render(template, data=None, encoding=None, max_pending=4):
+    """Render a template, yielding its output in chunks at each flush point.
+
+    Chunks are text, or bytes if an `encoding` is given.
+
+    """
+    return iter(_Stream(template, dict(data or {}), encoding, max_pending))
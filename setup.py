@@ -19,6 +19,7 @@ setup(
       'lesscpy',
     ],
     scripts=[
+        'scripts/haml-compile',
         'scripts/haml-preprocess',
         'scripts/haml-render',
     ],
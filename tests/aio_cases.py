@@ -0,0 +1,131 @@
+"""The tests for haml.aio, which are only importable on Python 3.7+."""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+import haml
+from haml import aio
+
+from base import Base
+
+
+class TestCompileAsync(Base):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'page.haml')
+        with open(self.path, 'w') as fh:
+            fh.write('%p= x\n!flush\n%p done')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_compile(self):
+        for backend in ('mako', 'python'):
+            template = asyncio.run(aio.compile_async(self.path, backend))
+            self.assertEqual(template.render_unicode(x=1), '<p>1</p>\n<p>done</p>\n')
+
+    def test_encoding(self):
+        with open(self.path, 'wb') as fh:
+            fh.write(u'%p caf\xe9'.encode('latin-1'))
+        for backend in ('mako', 'python'):
+            template = asyncio.run(aio.compile_async(self.path, backend, input_encoding='latin-1'))
+            self.assertEqual(template.render_unicode(), u'<p>caf\xe9</p>\n')
+
+    def test_single_flight(self):
+        calls = []
+        original = aio._compile_file
+        def compile_file(*args):
+            calls.append(args)
+            time.sleep(0.1)
+            return original(*args)
+
+        async def compile_many():
+            return await asyncio.gather(*[aio.compile_async(self.path) for i in range(10)])
+
+        aio._compile_file = compile_file
+        try:
+            templates = asyncio.run(compile_many())
+        finally:
+            aio._compile_file = original
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(map(id, templates))), 1)
+
+    def test_loop_not_blocked(self):
+        times = {}
+        original = aio._compile_file
+        def compile_file(*args):
+            time.sleep(0.2)
+            times['compiled'] = time.time()
+            return original(*args)
+
+        async def tick():
+            for i in range(5):
+                await asyncio.sleep(0.01)
+            times['ticked'] = time.time()
+
+        async def both():
+            await asyncio.gather(aio.compile_async(self.path), tick())
+
+        aio._compile_file = compile_file
+        try:
+            asyncio.run(both())
+        finally:
+            aio._compile_file = original
+        self.assertLess(times['ticked'], times['compiled'])
+
+
+class TestRenderAsync(Base):
+
+    def render(self, template, data=None, **kwargs):
+        async def collect():
+            return [chunk async for chunk in aio.render_async(template, data, **kwargs)]
+        return asyncio.run(collect())
+
+    def test_chunks(self):
+        for backend in ('mako', 'python'):
+            template = haml.compile_template('%p= x\n!flush\n%p done', backend)
+            self.assertEqual(self.render(template, dict(x=1)), ['<p>1</p>\n', '<p>done</p>\n'])
+            self.assertEqual(self.render(template, dict(x=1), encoding='utf-8'), [b'<p>1</p>\n', b'<p>done</p>\n'])
+
+    def test_error(self):
+        template = haml.compile_template('%p a\n!flush\n= 1 / 0', 'python')
+        self.assertRaises(ZeroDivisionError, self.render, template)
+
+    def test_close(self):
+        template = haml.compile_template('- for i in range(100):\n  %p= i\n  !flush', 'python')
+        async def first():
+            chunks = aio.render_async(template, max_pending=1)
+            chunk = await chunks.__anext__()
+            await chunks.aclose()
+            return chunk
+        self.assertEqual(asyncio.run(first()), '<p>0</p>\n')
+
+    def test_slow_consumers_dont_block_compiles(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'page.haml')
+        with open(path, 'w') as fh:
+            fh.write('%p compiled')
+        template = haml.compile_template('- for i in range(100):\n  %p= i\n  !flush', 'python')
+
+        async def stalled():
+            # Every render thread is left waiting on a consumer.
+            chunks = [aio.render_async(template, max_pending=1) for i in range(2)]
+            for x in chunks:
+                await x.__anext__()
+            try:
+                compiled = await asyncio.wait_for(aio.compile_async(path), 5)
+            finally:
+                for x in chunks:
+                    await x.aclose()
+            return compiled.render_unicode()
+
+        aio.configure(max_workers=1, max_render_workers=2)
+        try:
+            self.assertEqual(asyncio.run(stalled()), '<p>compiled</p>\n')
+        finally:
+            aio.configure()
+            shutil.rmtree(directory)
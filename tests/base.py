@@ -1,5 +1,7 @@
 from unittest import TestCase, main, SkipTest
 import os
+import shutil
+import tempfile
 
 from mako.template import Template
 
@@ -21,6 +23,31 @@ def skip_on_travis(func):
         return func
 
 
+class TempDirMixin(object):
+
+    """Gives each test a temporary `directory`, with `templates` within it."""
+
+    def setUp(self):
+        super(TempDirMixin, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.templates = os.path.join(self.directory, 'templates')
+        os.makedirs(self.templates)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TempDirMixin, self).tearDown()
+
+    def write(self, name, source, mtime=None):
+        """Write a template, and any directories it is within."""
+        path = os.path.join(self.templates, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fh:
+            fh.write(source)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+
 class Base(TestCase):
     
     def assertMako(self, source, expected, *args):
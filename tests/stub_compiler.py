@@ -0,0 +1,36 @@
+"""A stand-in for a compiler speaking the filter worker protocol.
+
+Compiles sources by upper-casing them; special sources simulate failures.
+
+"""
+
+import json
+import os
+import sys
+import time
+
+
+def main():
+    for line in iter(sys.stdin.readline, ''):
+        request = json.loads(line)
+        source = request['source']
+        if source == 'crash':
+            sys.exit(1)
+        if source == 'hang':
+            time.sleep(60)
+        if source == 'garbage':
+            sys.stdout.write('not json\n')
+            sys.stdout.flush()
+            continue
+        if source == 'pid':
+            response = dict(output=str(os.getpid()))
+        elif source.startswith('error'):
+            response = dict(error=source)
+        else:
+            response = dict(output=source.upper() + ('!' if request.get('scss') else ''))
+        sys.stdout.write(json.dumps(response) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+import sys
+from unittest import SkipTest, main
+
+if sys.version_info < (3, 7):
+    raise SkipTest('haml.aio requires Python 3.7+')
+
+from aio_cases import TestCompileAsync, TestRenderAsync
+
+
+if __name__ == "__main__":
+    main()
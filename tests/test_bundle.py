@@ -0,0 +1,98 @@
+import os
+import shutil
+import sys
+from unittest import main
+
+from mako import exceptions
+from six import StringIO
+
+from haml import precompile
+from haml.bundle import Bundle, BundleError, BundleTemplateLookup, write_bundle
+
+from base import Base, TempDirMixin
+
+
+class TestBundle(TempDirMixin, Base):
+
+    def setUp(self):
+        super(TestBundle, self).setUp()
+        self.bundle = os.path.join(self.directory, 'templates.bundle')
+        self.write('page.haml', '%p= x\n<%include file="sub/part.haml"/>')
+        self.write('sub/part.haml', '%b= y')
+
+    def test_render(self):
+        results = write_bundle(self.bundle, [self.templates], jobs=2)
+        self.assertEqual(sorted(r[:2] for r in results), [('/page.haml', 'compiled'), ('/sub/part.haml', 'compiled')])
+        # Without the sources.
+        shutil.rmtree(self.templates)
+        lookup = BundleTemplateLookup(self.bundle)
+        self.assertEqual(lookup.bundle.uris(), ['/page.haml', '/sub/part.haml'])
+        self.assertEqual(lookup.get_template('page.haml').render_unicode(x=1, y=2), '<p>1</p>\n<b>2</b>\n\n')
+        self.assertTrue(lookup.get_template('/page.haml') is lookup.get_template('page.haml'))
+        self.assertEqual(sorted(lookup.load_times), ['/page.haml', '/sub/part.haml'])
+        stats = lookup.stats()
+        self.assertEqual(stats['bundle']['loaded'], 2)
+        self.assertEqual(stats['compiles'], 0)
+
+    def test_lazy(self):
+        write_bundle(self.bundle, [self.templates], jobs=1)
+        lookup = BundleTemplateLookup(self.bundle)
+        lookup.get_template('/sub/part.haml')
+        self.assertEqual(list(lookup.load_times), ['/sub/part.haml'])
+
+    def test_fallback(self):
+        write_bundle(self.bundle, [self.templates], jobs=1)
+        self.write('new.haml', '%i new')
+        lookup = BundleTemplateLookup(self.bundle, [self.templates])
+        self.assertEqual(lookup.get_template('/new.haml').render_unicode(), '<i>new</i>\n')
+        self.assertEqual(lookup.stats()['compiles'], 1)
+        self.assertFalse(lookup.has_template('/missing.haml'))
+
+    def test_failures_left_out(self):
+        self.write('bad.haml', '%p(')
+        results = write_bundle(self.bundle, [self.templates], jobs=1)
+        self.assertEqual(sorted(r[:2] for r in results), [('/bad.haml', 'failed'), ('/page.haml', 'compiled'), ('/sub/part.haml', 'compiled')])
+        self.assertFalse('/bad.haml' in Bundle(self.bundle))
+
+    def test_compile_args(self):
+        self.write('page.haml', '%p= x')
+        write_bundle(self.bundle, [self.templates], jobs=1, template_args=dict(default_filters=['h']))
+        self.assertEqual(Bundle(self.bundle).compile_args['default_filters'], ['h'])
+        lookup = BundleTemplateLookup(self.bundle, default_filters=('h', ))
+        self.assertEqual(lookup.get_template('/page.haml').render_unicode(x='<'), '<p>&lt;</p>\n')
+        self.assertRaises(BundleError, BundleTemplateLookup, self.bundle)
+        self.assertRaises(BundleError, BundleTemplateLookup, self.bundle, default_filters=['h'], imports=['import os'])
+
+    def test_traceback_source(self):
+        self.write('page.haml', '%p\n  = 1 / x')
+        write_bundle(self.bundle, [self.templates], jobs=1)
+        shutil.rmtree(self.templates)
+        template = BundleTemplateLookup(self.bundle).get_template('/page.haml')
+        self.assertTrue('1 / x' in template.code)
+        try:
+            template.render_unicode(x=0)
+        except ZeroDivisionError:
+            records = exceptions.RichTraceback().records
+        filename, lineno, function, line, template_filename, template_ln, template_line, template_source = records[-1]
+        self.assertTrue('1 / x' in line, line)
+        self.assertTrue('1 / x' in template_source, template_source)
+
+    def test_not_a_bundle(self):
+        with open(self.bundle, 'wb') as fh:
+            fh.write(b'something else entirely')
+        self.assertRaises(BundleError, Bundle, self.bundle)
+
+    def test_command(self):
+        stdout = sys.stdout
+        sys.stdout = out = StringIO()
+        try:
+            code = precompile.main(['haml-compile', '-j', '1', '-b', self.bundle, self.templates])
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(code, 0)
+        self.assertTrue('2 templates (2 compiled' in out.getvalue(), out.getvalue())
+        self.assertEqual(len(Bundle(self.bundle)), 2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import main
+
+from mako.template import Template
+
+import haml
+from haml.cache import CachedPreprocessor, FileSystemCache, MemoryCache, SingleFlight, cache_key, fingerprint, semantic_key
+
+from base import Base
+
+
+class TestCacheKey(Base):
+
+    def test_source(self):
+        self.assertEqual(cache_key('%p'), cache_key('%p'))
+        self.assertNotEqual(cache_key('%p'), cache_key('%div'))
+
+    def test_options(self):
+        self.assertNotEqual(cache_key('%p'), cache_key('%p', indent_str='  '))
+
+    def test_version(self):
+        key = cache_key('%p')
+        old_version, haml.cache.__version__ = haml.cache.__version__, '0.0.0'
+        try:
+            self.assertNotEqual(key, cache_key('%p'))
+        finally:
+            haml.cache.__version__ = old_version
+
+
+class TestFingerprint(Base):
+
+    def assertSame(self, a, b):
+        self.assertEqual(fingerprint(haml.parse_string(a)), fingerprint(haml.parse_string(b)))
+
+    def assertDifferent(self, a, b):
+        self.assertNotEqual(fingerprint(haml.parse_string(a)), fingerprint(haml.parse_string(b)))
+
+    def test_comments(self):
+        self.assertSame('%div\n  %p a', '-# About.\n%div\n  -# Nested\n    %b comment\n  %p a')
+
+    def test_whitespace(self):
+        self.assertSame('%div\n  %p= x\n%b', '\n%div\n\n\t%p= x\n%b\n\n')
+        self.assertSame(':javascript\n  a();\n%b', ':javascript\n\n    a();\n\n%b')
+
+    def test_changes(self):
+        self.assertDifferent('%p a', '%p b')
+        self.assertDifferent('%p a', '%div a')
+        self.assertDifferent('%p(a=1)', '%p(a=2)')
+        self.assertDifferent('%div\n  %p a', '%div\n%p a')
+        self.assertDifferent('%p= a', '%p= a|h')
+        self.assertDifferent('-# a\n%p', '/ a\n%p')
+        self.assertDifferent(':javascript\n  a();', ':css\n  a();')
+
+    def test_hidden_children(self):
+        # Comments still make their parent one with children.
+        self.assertDifferent('%pre>', '%pre>\n  -# note')
+        self.assertDifferent('/ c', '/ c\n  -# note')
+        self.assertSame('%pre>\n  -# note', '%pre>\n  -# other\n  -# notes')
+        self.assertDifferent('- z = 1', '- z = 1\n  ')
+
+    def test_semantic_key(self):
+        self.assertEqual(semantic_key(b'%p a\n'), semantic_key('-# comment\n%p a'))
+        self.assertNotEqual(semantic_key('%p a'), semantic_key('%p a', indent_str='  '))
+        self.assertNotEqual(semantic_key('%p a'), cache_key('%p a'))
+        # Falls back to the source if it doesn't parse.
+        self.assertEqual(semantic_key('%p(a=1'), cache_key('%p(a=1'))
+
+
+class TestMemoryCache(Base):
+
+    def test_lru(self):
+        cache = MemoryCache(maxsize=2)
+        cache.set('a', 'A')
+        cache.set('b', 'B')
+        self.assertEqual(cache.get('a'), 'A') # Now b is the oldest.
+        cache.set('c', 'C')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 'C')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats(), dict(hits=2, misses=1, evictions=1))
+
+
+class TestFileSystemCache(Base):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_roundtrip(self):
+        cache = FileSystemCache(os.path.join(self.directory, 'sub'))
+        self.assertEqual(cache.get('key'), None)
+        cache.set('key', u'<p>☃</p>')
+        self.assertEqual(FileSystemCache(cache.directory).get('key'), u'<p>☃</p>')
+        self.assertEqual(cache.stats(), dict(hits=0, misses=1, evictions=0))
+        self.assertEqual(os.listdir(cache.directory), ['key.mako'])
+
+
+class TestCachedPreprocessor(Base):
+
+    def test_hits(self):
+        preprocessor = CachedPreprocessor(MemoryCache())
+        for i in range(3):
+            mako = preprocessor('%p= x')
+        self.assertEqual(mako, haml.preprocessor('%p= x'))
+        self.assertEqual(preprocessor.cache.stats(), dict(hits=2, misses=1, evictions=0))
+        self.assertEqual(Template('%p= x', preprocessor=preprocessor).render_unicode(x=1), '<p>1</p>\n')
+
+    def test_options(self):
+        preprocessor = CachedPreprocessor(indent_str='  ')
+        self.assertEqual(preprocessor('%div\n  %p'), '<%! from haml import runtime as __HAML %>\\\n<div>\n  <p></p>\n</div>\n')
+
+
+    def test_concurrent_misses(self):
+        sets = []
+        class Cache(MemoryCache):
+            def set(self, key, value):
+                sets.append(key)
+                time.sleep(0.01)
+                super(Cache, self).set(key, value)
+        preprocessor = CachedPreprocessor(Cache())
+        results = []
+        barrier = threading.Barrier(64)
+        def run():
+            barrier.wait()
+            results.append(preprocessor('%p= x'))
+        threads = [threading.Thread(target=run) for i in range(64)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(sets), 1)
+        self.assertEqual(set(results), set([haml.preprocessor('%p= x')]))
+
+
+class TestSingleFlight(Base):
+
+    def stress(self, func, count=64):
+        flights = SingleFlight()
+        barrier = threading.Barrier(count)
+        results = []
+        def run():
+            barrier.wait()
+            try:
+                results.append(flights.do('key', func))
+            except Exception as e:
+                results.append(e)
+        threads = [threading.Thread(target=run) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return flights, results
+
+    def test_one_call(self):
+        calls = []
+        def func():
+            calls.append(1)
+            time.sleep(0.05)
+            return object()
+        flights, results = self.stress(func)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 64)
+        self.assertEqual(len(set(map(id, results))), 1)
+        self.assertEqual(flights.stats(), dict(calls=1, shared=63))
+        # Once finished, the next call runs again.
+        self.assertEqual(flights.do('key', lambda: 1), 1)
+
+    def test_shared_exception(self):
+        def func():
+            time.sleep(0.05)
+            raise ValueError('boom')
+        flights, results = self.stress(func)
+        self.assertEqual(flights.calls, 1)
+        self.assertEqual(len(results), 64)
+        self.assertTrue(all(isinstance(e, ValueError) for e in results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from unittest import main
+
+import haml
+from haml import filters
+
+from base import Base
+
+
+class TestFilterCache(Base):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.calls = []
+        self.version = '1.0'
+        self.filter = filters.cached('upper', lambda: self.version)(self.upper)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        filters._cache_configured = False
+        filters._versions.pop('upper', None)
+
+    def upper(self, src, loud=False):
+        self.calls.append(src)
+        return src.upper() + ('!' if loud else '')
+
+    def test_memory(self):
+        filters.configure_cache()
+        self.assertEqual([self.filter('a'), self.filter('a'), self.filter('b')], ['A', 'A', 'B'])
+        self.assertEqual(self.filter('a', loud=True), 'A!')
+        self.assertEqual(self.calls, ['a', 'b', 'a'])
+        self.assertEqual(filters.memory_cache.stats(), dict(hits=1, misses=3, evictions=0))
+
+    def test_disk(self):
+        filters.configure_cache(directory=self.directory)
+        self.assertEqual(self.filter('a'), 'A')
+        # As if in another process.
+        filters.configure_cache(directory=self.directory)
+        self.assertEqual(self.filter('a'), 'A')
+        self.assertEqual(self.calls, ['a'])
+        self.assertEqual(filters.disk_cache.stats(), dict(hits=1, misses=0, evictions=0))
+
+    def test_version(self):
+        filters.configure_cache(directory=self.directory)
+        self.filter('a')
+        filters._versions.pop('upper')
+        self.version = '2.0'
+        self.filter('a')
+        self.assertEqual(self.calls, ['a', 'a'])
+
+    def test_text(self):
+        filters.configure_cache(directory=self.directory)
+        self.filter = filters.cached('upper', lambda: self.version)(lambda src: src.upper().encode('utf-8'))
+        self.assertEqual(self.filter(''), '')
+        self.assertEqual(self.filter('\xe9'), '\xc9')
+        filters.configure_cache(directory=self.directory)
+        self.assertEqual(self.filter('\xe9'), '\xc9')
+        self.assertEqual(filters.disk_cache.stats()['hits'], 1)
+
+    def test_errors_not_cached(self):
+        filters.configure_cache(directory=self.directory)
+        def upper(src):
+            self.calls.append(src)
+            return filters._Uncached('error') if src == 'bad' else src.upper()
+        self.filter = filters.cached('upper', lambda: self.version)(upper)
+        self.assertEqual([self.filter('bad'), self.filter('bad')], ['error', 'error'])
+        self.assertTrue(isinstance(self.filter('bad'), filters._Uncached))
+        self.assertEqual(self.calls, ['bad', 'bad', 'bad'])
+
+    def test_disabled(self):
+        filters.configure_cache(maxsize=0)
+        self.filter('a')
+        self.filter('a')
+        self.assertEqual(self.calls, ['a', 'a'])
+
+    def test_less(self):
+        filters.configure_cache()
+        try:
+            out = filters.less('a { color: red; }')
+        except ImportError:
+            return
+        self.assertEqual(filters.less('a { color: red; }'), out)
+        self.assertEqual(filters.memory_cache.hits, 1)
+
+
+class TestWorkerPool(Base):
+
+    stub = [sys.executable, os.path.join(os.path.dirname(__file__), 'stub_compiler.py')]
+
+    def setUp(self):
+        self.pool = filters.WorkerPool(self.stub, size=2, timeout=5)
+
+    def tearDown(self):
+        self.pool.close()
+        filters.workers.clear()
+
+    def test_compile(self):
+        self.assertEqual(self.pool.compile('a\nb'), ('A\nB', ''))
+        self.assertEqual(self.pool.compile('error: x'), ('', 'error: x'))
+
+    def test_reuse(self):
+        pids = set(self.pool.compile('pid')[0] for i in range(5))
+        self.assertEqual(len(pids), 1)
+
+    def test_concurrent(self):
+        results = []
+        def compile(i):
+            results.append(self.pool.compile('src%d' % i))
+        threads = [threading.Thread(target=compile, args=(i, )) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), sorted(('SRC%d' % i, '') for i in range(20)))
+
+    def test_crash(self):
+        pid = self.pool.compile('pid')[0]
+        self.assertRaises(filters.WorkerError, self.pool.compile, 'crash')
+        self.assertEqual(self.pool.restarts, 2)
+        self.assertNotEqual(self.pool.compile('pid')[0], pid)
+
+    def test_malformed(self):
+        pid = self.pool.compile('pid')[0]
+        self.assertRaises(filters.WorkerError, self.pool.compile, 'garbage')
+        self.assertEqual(self.pool.compile('ok'), ('OK', ''))
+        self.assertNotEqual(self.pool.compile('pid')[0], pid)
+
+    def test_timeout(self):
+        self.pool.timeout = 0.2
+        self.assertRaises(filters.WorkerError, self.pool.compile, 'hang')
+        self.assertEqual(self.pool.compile('ok'), ('OK', ''))
+
+    def test_missing(self):
+        pool = filters.WorkerPool(['/does/not/exist'])
+        self.assertRaises(filters.WorkerError, pool.compile, 'a')
+
+    def test_filters(self):
+        filters.workers['sass'] = filters.workers['coffeescript'] = self.pool
+        filters.configure_cache(maxsize=0)
+        try:
+            self.assertEqual(filters.scss('a'), '<style>/*<![CDATA[*/A!/*]]>*/</style>')
+            self.assertEqual(filters.sass('error <x>'), '<div class="sass-error">error &lt;x&gt;</div>')
+            self.assertEqual(filters.coffeescript('b'), '<script>/*<![CDATA[*/B/*]]>*/</script>')
+        finally:
+            filters._cache_configured = False
+
+    def test_filter_errors_not_cached(self):
+        filters.workers['sass'] = self.pool
+        filters.configure_cache()
+        try:
+            self.assertEqual(filters.sass('error'), '<div class="sass-error">error</div>')
+            self.assertEqual(filters.sass('error'), '<div class="sass-error">error</div>')
+            self.assertEqual(filters.memory_cache.stats()['hits'], 0)
+            filters.sass('ok')
+            filters.sass('ok')
+            self.assertEqual(filters.memory_cache.stats()['hits'], 1)
+        finally:
+            filters._cache_configured = False
+
+    def test_failures_not_evaluated(self):
+        filters.workers['sass'] = self.pool
+        mako = haml.generate_mako(haml.parse_string(':sass\n  error here\n:sass\n  ok'))
+        self.assertTrue('<%block filter="__HAML_filter_sass">' in mako, mako)
+        self.assertTrue('<%text><style>/*<![CDATA[*/OK/*]]>*/</style></%text>' in mako, mako)
+
+
+class TestStaticFilters(Base):
+
+    def assertRuntime(self, source, filter='__HAML_filter_javascript', **options):
+        mako = haml.generate_mako(haml.parse_string(source), **options)
+        self.assertTrue('<%%block filter="%s">' % filter in mako, mako)
+
+    def test_static(self):
+        self.assertMako(
+            ':javascript\n  alert(1);\n%p',
+            '<%text><script>/*<![CDATA[*/alert(1);/*]]>*/</script></%text>\n<p></p>\n'
+        )
+
+    def test_empty(self):
+        for name in ('plain', 'escaped'):
+            self.assertHTML(':%s' % name, '\n')
+            self.assertHTML(':%s\n%%p' % name, '\n<p></p>\n')
+            self.assertHTML(':%s\n    \n%%p' % name, '\n<p></p>\n')
+            self.assertHTML('%%div\n  :%s\n  %%p' % name, '<div>\n\n\t<p></p>\n</div>\n')
+
+    def test_expressions(self):
+        self.assertRuntime(':javascript\n  alert(${x});')
+
+    def test_shadowed(self):
+        dynamic = "locals().get('javascript') or globals().get('javascript') or getattr(__HAML.filters, 'javascript', UNDEFINED)"
+        self.assertRuntime('-! javascript = str\n:javascript\n  alert(1);', dynamic)
+        self.assertRuntime('%p= javascript\n:javascript\n  alert(1);', dynamic)
+        self.assertRuntime(':javascript\n  alert(1);\n%p(title=javascript)', dynamic)
+
+    def test_opt_out(self):
+        self.assertRuntime(':javascript\n  alert(1);', runtime_filters=('javascript', ))
+        self.assertRuntime(':javascript\n  alert(1);', evaluate_filters=False)
+        filters.javascript.pure = False
+        try:
+            self.assertRuntime(':javascript\n  alert(1);')
+        finally:
+            filters.javascript.pure = True
+
+    def test_unknown(self):
+        self.assertRuntime(
+            '-! def upper(x): return x.upper()\n:upper\n  a',
+            "locals().get('upper') or globals().get('upper') or getattr(__HAML.filters, 'upper', UNDEFINED)"
+        )
+
+    def test_bound(self):
+        source = '- for x in xs:\n  :plain\n    ${x}\n  :plain\n    ${x}'
+        self.assertMako(source, '\n'.join([
+            '\\',
+            '% for x in xs: ',
+            '<%block filter="__HAML_filter_plain">\\',
+            '${x}</%block>',
+            '<%block filter="__HAML_filter_plain">\\',
+            '${x}</%block>',
+            '\\',
+            '% endfor',
+            '<%! ',
+            '__HAML_filter_plain = __HAML.filters.plain',
+            '%>\\',
+            '',
+        ]))
+        self.assertHTML(source, '1\n1\n2\n2\n', xs=[1, 2])
+
+
+if __name__ == "__main__":
+    main()
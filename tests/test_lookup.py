@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+from unittest import main
+
+from haml.cache import MemoryCache
+from haml.lookup import HamlTemplateLookup
+
+from base import Base, TempDirMixin
+
+
+class TestHamlTemplateLookup(TempDirMixin, Base):
+
+    def setUp(self):
+        super(TestHamlTemplateLookup, self).setUp()
+        self.write('page.haml', '%p= x\n<%include file="part.haml"/>')
+        self.write('part.haml', '%b part')
+
+    def test_render(self):
+        lookup = HamlTemplateLookup([self.templates])
+        self.assertEqual(lookup.get_template('page.haml').render_unicode(x=1), '<p>1</p>\n<b>part</b>\n\n')
+        self.assertEqual(lookup.stats()['compiles'], 2)
+
+    def test_persistent(self):
+        cache = os.path.join(self.directory, 'cache')
+        lookup = HamlTemplateLookup([self.templates], cache=cache)
+        lookup.get_template('page.haml').render_unicode(x=1)
+        # As if in a new process.
+        lookup = HamlTemplateLookup([self.templates], cache=cache)
+        self.assertEqual(lookup.get_template('page.haml').render_unicode(x=2), '<p>2</p>\n<b>part</b>\n\n')
+        stats = lookup.stats()
+        self.assertEqual((stats['compiles'], stats['loads']), (0, 2))
+
+    def test_batched_checks(self):
+        lookup = HamlTemplateLookup([self.templates], check_interval=3600)
+        lookup.get_template('page.haml').render_unicode(x=1)
+        for i in range(10):
+            lookup.get_template('page.haml')
+            lookup.get_template('part.haml')
+        self.assertEqual(lookup.stats()['stat_calls'], 0)
+
+        self.write('part.haml', '%i changed', mtime=time.time() + 10)
+        self.assertEqual(lookup.get_template('page.haml').render_unicode(x=1), '<p>1</p>\n<b>part</b>\n\n')
+        lookup.check()
+        self.assertEqual(lookup.get_template('page.haml').render_unicode(x=1), '<p>1</p>\n<i>changed</i>\n\n')
+        stats = lookup.stats()
+        self.assertEqual((stats['checks'], stats['stat_calls'], stats['reloads'], stats['compiles']), (1, 2, 1, 3))
+
+    def test_touched(self):
+        # A changed mtime with the same source doesn't recompile.
+        cache = MemoryCache()
+        lookup = HamlTemplateLookup([self.templates], cache=cache, check_interval=0)
+        lookup.get_template('part.haml')
+        self.write('part.haml', '%b part', mtime=time.time() + 10)
+        self.assertEqual(lookup.get_template('part.haml').render_unicode(), '<b>part</b>\n')
+        stats = lookup.stats()
+        self.assertEqual((stats['reloads'], stats['compiles'], stats['loads']), (1, 1, 1))
+
+    def test_semantic_keys(self):
+        # Editing a comment doesn't recompile.
+        lookup = HamlTemplateLookup([self.templates], check_interval=0, semantic_keys=True)
+        lookup.get_template('part.haml')
+        self.write('part.haml', '-# A comment.\n%b part', mtime=time.time() + 10)
+        self.assertEqual(lookup.get_template('part.haml').render_unicode(), '<b>part</b>\n')
+        self.write('part.haml', '%b changed', mtime=time.time() + 20)
+        self.assertEqual(lookup.get_template('part.haml').render_unicode(), '<b>changed</b>\n')
+        stats = lookup.stats()
+        self.assertEqual((stats['reloads'], stats['compiles'], stats['loads']), (2, 2, 1))
+
+    def test_semantic_keys_hidden_children(self):
+        lookup = HamlTemplateLookup([self.templates], check_interval=0, semantic_keys=True)
+        self.write('pre.haml', '%pre>')
+        self.assertTrue(lookup.get_template('pre.haml').render_unicode().endswith('<pre></pre>'))
+        # Renders differently, though only a comment was added.
+        self.write('pre.haml', '%pre>\n  -# note', mtime=time.time() + 10)
+        self.assertTrue(lookup.get_template('pre.haml').render_unicode().endswith('<pre>\n</pre>'))
+        self.assertEqual(lookup.stats()['compiles'], 2)
+
+    def test_options(self):
+        lookup = HamlTemplateLookup([self.templates])
+        other = HamlTemplateLookup([self.templates], default_filters=['h'])
+        self.assertNotEqual(lookup.module_key(b'%p', '/a'), other.module_key(b'%p', '/a'))
+        self.assertNotEqual(lookup.module_key(b'%p', '/a'), lookup.module_key(b'%p', '/b'))
+        self.assertEqual(lookup.module_key(b'%p', '/a'), HamlTemplateLookup().module_key(b'%p', '/a'))
+
+    def test_module_directory(self):
+        self.assertRaises(TypeError, HamlTemplateLookup, [self.templates], module_directory=self.directory)
+        self.assertRaises(TypeError, HamlTemplateLookup, [self.templates], module_writer=lambda source, path: None)
+
+    def test_concurrent_first_requests(self):
+        lookup = HamlTemplateLookup([self.templates])
+        barrier = threading.Barrier(64)
+        templates = []
+        def run():
+            barrier.wait()
+            templates.append(lookup.get_template('page.haml'))
+        threads = [threading.Thread(target=run) for i in range(64)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(templates), 64)
+        self.assertEqual(len(set(map(id, templates))), 1)
+        self.assertEqual(lookup.stats()['compiles'], 1)
+        self.assertEqual(templates[0].render_unicode(x=1), '<p>1</p>\n<b>part</b>\n\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,17 @@ before
 after
             '''.strip() + '\n')   
 
+    def test_mod_source_hoisted(self):
+        # Module blocks don't split the static text around them.
+        self.assertMako(
+            '''
+%p before
+-! i = 1
+%p after
+            '''.strip(),
+            '<p>before</p>\n<p>after</p>\n<%! \ni = 1\n%>\\\n'
+        )
+
     def test_mod_source_inline(self):
         self.assertHTML(
             '''
@@ -0,0 +1,203 @@
+import collections
+import random
+from unittest import main
+
+from six import StringIO
+
+import haml
+from haml.parse import Parser, reparse
+
+from base import Base
+
+
+class TestMatchPythonExpr(Base):
+
+    def match(self, method, lines, first, last):
+        parser = Parser()
+        parser._source = iter(lines[1:])
+        parser._buffer = collections.deque(lines[:1])
+        expr = getattr(parser, method)(first and set(first), set(last))
+        return expr, list(parser._buffer)
+
+    def assertMatch(self, lines, first, last, expected):
+        res = self.match('_match_python_expr', lines, first, last)
+        self.assertEqual(res[0], expected)
+        self.assertEqual(res, self.match('_match_python_expr_tokenize', lines, first, last))
+
+    def test_attributes(self):
+        self.assertMatch(['(a=1)rest'], '(', ')', '(a=1)')
+        self.assertMatch(['(a="x)", b=\'(\')rest'], '(', ')', '(a="x)", b=\'(\')')
+        self.assertMatch(['(f"{x}" + rb"\\"") r'], '(', ')', '(f"{x}" + rb"\\"")')
+
+    def test_multiline(self):
+        self.assertMatch(['(a=1,', '  b=2) rest'], '(', ')', '(a=1,  b=2)')
+        self.assertMatch(["(a='''x", "y''') z"], '(', ')', "(a='''xy''')")
+        self.assertMatch(['(a="x\\', 'y") rest'], '(', ')', '(a="x\\y")')
+        self.assertMatch(['(a=1 # c)', '  ) rest'], '(', ')', '(a=1 # c)  )')
+
+    def test_no_match(self):
+        self.assertMatch(['(a=[1,2}) x'], '(', ')', None)
+        self.assertMatch([' (a=1)'], '(', ')', None)
+        self.assertMatch([''], '(', ')', None)
+
+    def test_control(self):
+        self.assertMatch(['x in y[1:]: rest'], None, ':', 'x in y[1:]:')
+        self.assertMatch(['(y := 3): rest'], None, ':', '(y := 3):')
+        self.assertMatch(['x == ":": rest'], None, ':', 'x == ":":')
+
+    def test_tokenize_fallback(self):
+        # Unterminated strings are left to tokenize.
+        self.assertMatch(['(a="x', 'y") z'], '(', ')', '(a="xy")')
+
+
+class TestStreamingParse(Base):
+
+    source = '%div(a=1,\n    b=2)\n  %p\n    Hello\r\n- if x:\n  yes\n'
+
+    def test_parse_file(self):
+        self.assertEqual(
+            haml.generate_mako(haml.parse_file(StringIO(self.source))),
+            haml.generate_mako(haml.parse_string(self.source)),
+        )
+
+    def test_parse_iter(self):
+        lines = iter(self.source.splitlines(True))
+        node = haml.parse_iter(lines)
+        self.assertEqual(haml.generate_mako(node), haml.generate_mako(haml.parse_string(self.source)))
+        self.assertEqual(list(lines), [])
+
+
+class TestParserReuse(Base):
+
+    def test_reuse(self):
+        parser = Parser()
+        first = parser.parse_string('%p= x\n%div\n  %b')
+        second = parser.parse_string('%i y')
+        self.assertFalse(first is second)
+        self.assertTrue(parser.root is second)
+        self.assertEqual(haml.generate_mako(first), haml.generate_mako(haml.parse_string('%p= x\n%div\n  %b')))
+        self.assertEqual(haml.generate_mako(second), haml.generate_mako(haml.parse_string('%i y')))
+
+
+class TestCompactNodes(Base):
+
+    def test_slots(self):
+        root = haml.parse_string('%div\n  %p= x\n  -# comment\n  - if x:\n    a\n  - elif y:\n    b\n  - else:\n    c\n:plain\n  text')
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            self.assertFalse(hasattr(node, '__dict__'), node)
+            stack.extend(node.iter_all_children())
+
+    def test_leaves_share_children(self):
+        root = haml.parse_string('%p a\n%p b')
+        first, second = root.children
+        self.assertTrue(first.children is second.children)
+        first.add_child(haml.nodes.Content('c'))
+        self.assertEqual(len(first.children), 1)
+        self.assertEqual(len(second.children), 0)
+
+    def test_filter_lines(self):
+        filter_, = haml.parse_string(':plain\n\n    a\n      b\n    c').children
+        self.assertEqual(list(filter_.iter_dedented()), ['', 'a', '  b', 'c'])
+
+
+def ranges(node, depth=0):
+    yield depth, type(node).__name__, node.lineno, node.end_lineno
+    for child in node.iter_all_children():
+        for x in ranges(child, depth + 1):
+            yield x
+
+
+class TestLineNumbers(Base):
+
+    def test_ranges(self):
+        root = haml.parse_string('''%html
+  %body(a=1,
+        b=2)
+    - if x:
+      %p yes
+
+    - else:
+      %p no
+    :javascript
+      foo();
+%footer''')
+        self.assertEqual(list(ranges(root)), [
+            (0, 'Document', 1, 11),
+            (1, 'Tag', 1, 10),
+            (2, 'Tag', 2, 10),
+            (3, 'Control', 4, 8),
+            (4, 'Tag', 5, 6),
+            (5, 'Content', 5, 6),
+            (4, 'Control', 7, 8),
+            (5, 'Tag', 8, 8),
+            (6, 'Content', 8, 8),
+            (3, 'Filter', 9, 10),
+            (1, 'Tag', 11, 11),
+        ])
+
+    def test_multiline(self):
+        root = haml.parse_string('%p\nline |\nmore |\n%b')
+        self.assertEqual([(c.lineno, c.end_lineno) for c in root.children], [(1, 1), (2, 3), (4, 4)])
+
+
+class TestReparse(Base):
+
+    pieces = [
+        '%div', '  %p hi', '- if x:', '  %b yes', '- elif y:', '- else:', '  %i no', '',
+        ':javascript', '  a();', '%p(a=1,', '   b=2) t', '-# comment', '  hidden',
+        'plain text', '    deep', '= expr', '%p{"a": (1,', '  2)}', 'line |', 'more |',
+    ]
+
+    def assertReparse(self, lines, start, old_end, replacement):
+        root = Parser().parse(lines)
+        lines = lines[:start] + replacement + lines[old_end:]
+        root = reparse(root, lines, start, old_end, start + len(replacement))
+        expected = Parser().parse(lines)
+        self.assertEqual(haml.generate_mako(root), haml.generate_mako(expected))
+        self.assertEqual(list(ranges(root)), list(ranges(expected)))
+        return root
+
+    def test_edit(self):
+        lines = ['%div', '  %p a', '%div', '  %p b', '%div', '  %p c']
+        root = Parser().parse(lines)
+        first, third = root.children[0], root.children[2]
+        lines[3] = '  %p changed'
+        self.assertTrue(reparse(root, lines, 3, 4, 4) is root)
+        # Blocks which the edit can't affect are reused.
+        self.assertTrue(root.children[0] is first)
+        self.assertTrue(root.children[2] is third)
+        self.assertEqual(haml.generate_mako(root), haml.generate_mako(Parser().parse(lines)))
+
+    def test_insert_and_delete(self):
+        lines = ['%div', '  %p a', '%div', '  %p b', '%div', '  %p c']
+        self.assertReparse(lines, 2, 2, ['%span new', '  %b child'])
+        self.assertReparse(lines, 1, 4, [])
+        self.assertReparse(lines, 6, 6, ['  %p appended'])
+
+    def test_joins(self):
+        # Dedenting, indenting, and opening brackets change other blocks.
+        self.assertReparse(['%div', '  %p a', '%b'], 2, 3, ['  %b'])
+        self.assertReparse(['%div', '  %p a', '  %b'], 2, 3, ['%b'])
+        self.assertReparse(['%p', '%b', 'x) y'], 1, 2, ['%b(a=1,'])
+        self.assertReparse(['- if x:', '  a', '%p', '- else:', '  b'], 2, 3, [])
+        self.assertReparse(['- if x:', '  a', '- else:', '  b', '- else:'], 1, 2, ['- elif y:'])
+
+    def test_random_edits(self):
+        rng = random.Random(0)
+        for i in range(200):
+            lines = [rng.choice(self.pieces) for j in range(rng.randint(0, 15))]
+            start = rng.randint(0, len(lines))
+            old_end = rng.randint(start, min(len(lines), start + 3))
+            replacement = [rng.choice(self.pieces) for j in range(rng.randint(0, 3))]
+            try:
+                Parser().parse(lines)
+                Parser().parse(lines[:start] + replacement + lines[old_end:])
+            except Exception:
+                continue
+            self.assertReparse(lines, start, old_end, replacement)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+import sys
+from unittest import main
+
+from mako.lookup import TemplateLookup
+from six import StringIO
+
+import haml
+from haml import precompile
+
+from base import Base, TempDirMixin
+
+
+class TestPrecompile(TempDirMixin, Base):
+
+    def setUp(self):
+        super(TestPrecompile, self).setUp()
+        self.modules = os.path.join(self.directory, 'modules')
+        self.write('page.haml', '%p= x')
+        self.write('sub/part.haml', '%b= y')
+        self.write('notes.txt', 'not a template')
+
+    def statuses(self, results):
+        return sorted((uri, status) for uri, status, seconds, size, error in results)
+
+    def test_compile_and_skip(self):
+        results = precompile.compile_tree([self.templates], self.modules, jobs=2)
+        self.assertEqual(self.statuses(results), [('/page.haml', 'compiled'), ('/sub/part.haml', 'compiled')])
+        self.write('page.haml', '%p changed')
+        results = precompile.compile_tree([self.templates], self.modules, jobs=1)
+        self.assertEqual(self.statuses(results), [('/page.haml', 'compiled'), ('/sub/part.haml', 'skipped')])
+        results = precompile.compile_tree([self.templates], self.modules, jobs=1, force=True)
+        self.assertEqual(self.statuses(results), [('/page.haml', 'compiled'), ('/sub/part.haml', 'compiled')])
+
+    def test_mako_uses_modules(self):
+        precompile.compile_tree([self.templates], self.modules, jobs=1)
+        path = precompile.module_path(self.modules, '/sub/part.haml')
+        with open(path) as fh:
+            compiled = fh.read()
+        lookup = TemplateLookup([self.templates], module_directory=self.modules, preprocessor=haml.preprocessor)
+        self.assertEqual(lookup.get_template('/sub/part.haml').render_unicode(y=1), '<b>1</b>\n')
+        with open(path) as fh:
+            self.assertEqual(fh.read(), compiled)
+
+    def test_compile_args(self):
+        precompile.compile_tree([self.templates], self.modules, jobs=1, template_args=dict(default_filters=['h']))
+        path = precompile.module_path(self.modules, '/page.haml')
+        args = precompile.read_compile_args(path)
+        self.assertEqual(args['default_filters'], ['h'])
+        self.assertEqual(args, precompile.compile_args(dict(default_filters=('h', ))))
+        lookup = TemplateLookup(
+            [self.templates], module_directory=self.modules, preprocessor=haml.preprocessor, default_filters=['h'],
+        )
+        self.assertEqual(lookup.get_template('/page.haml').render_unicode(x='<'), '<p>&lt;</p>\n')
+
+        # Other args are a different compilation; unknown args are an error.
+        results = precompile.compile_tree([self.templates], self.modules, jobs=1, template_args=dict(default_filters=['h']))
+        self.assertEqual(self.statuses(results), [('/page.haml', 'skipped'), ('/sub/part.haml', 'skipped')])
+        results = precompile.compile_tree([self.templates], self.modules, jobs=1)
+        self.assertEqual(self.statuses(results), [('/page.haml', 'compiled'), ('/sub/part.haml', 'compiled')])
+        self.assertEqual(precompile.read_compile_args(path), precompile.compile_args())
+        self.assertRaises(TypeError, precompile.compile_tree, [self.templates], self.modules, template_args=dict(bogus=1))
+
+    def test_failure(self):
+        self.write('bad.haml', '%p(')
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = out = StringIO()
+        try:
+            code = precompile.main(['haml-compile', '-j', '1', '-m', self.modules, self.templates])
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        self.assertEqual(code, 1)
+        self.assertTrue('3 templates (2 compiled, 0 skipped, 1 failed)' in out.getvalue(), out.getvalue())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import gc
+import os
+from unittest import main, skipUnless
+
+from haml.bundle import BundleTemplateLookup, write_bundle
+from haml.lookup import HamlTemplateLookup
+from haml.prefork import find_uris, memory_usage, warm
+
+from base import Base, TempDirMixin
+
+
+class TestWarm(TempDirMixin, Base):
+
+    def setUp(self):
+        super(TestWarm, self).setUp()
+        self.write('page.haml', '%p= x')
+        self.write('emails/welcome.haml', '%b welcome')
+        self.write('bad.haml', '%p(')
+
+    def test_find_uris(self):
+        lookup = HamlTemplateLookup([self.templates])
+        self.assertEqual(find_uris(lookup, ['*.haml']), ['/bad.haml', '/emails/welcome.haml', '/page.haml'])
+        self.assertEqual(find_uris(lookup, ['emails/*', '/page.haml']), ['/emails/welcome.haml', '/page.haml'])
+
+    def test_warm(self):
+        lookup = HamlTemplateLookup([self.templates])
+        report = warm(lookup, ['*.haml'], freeze=False)
+        self.assertEqual(report['templates'], ['/emails/welcome.haml', '/page.haml'])
+        self.assertEqual(list(report['failed']), ['/bad.haml'])
+        self.assertEqual(lookup.stats()['compiles'], 2)
+        lookup.get_template('/page.haml')
+        self.assertEqual(lookup.stats()['compiles'], 2)
+
+    def test_bundle(self):
+        os.unlink(os.path.join(self.templates, 'bad.haml'))
+        bundle = os.path.join(self.directory, 'templates.bundle')
+        write_bundle(bundle, [self.templates], jobs=1)
+        lookup = BundleTemplateLookup(bundle)
+        self.assertEqual(find_uris(lookup, ['emails/*']), ['/emails/welcome.haml'])
+        report = warm(lookup, ['/page.haml', '*.haml', 'missing.haml'], freeze=False)
+        self.assertEqual(report['templates'], ['/emails/welcome.haml', '/page.haml'])
+        self.assertEqual(list(report['failed']), ['/missing.haml'])
+        self.assertEqual(sorted(lookup.load_times), ['/emails/welcome.haml', '/page.haml'])
+
+    def test_uris_not_found(self):
+        lookup = HamlTemplateLookup([self.templates])
+        report = warm(lookup, ['page.haml', 'missing.haml', 'missing/*'], freeze=False)
+        self.assertEqual(report['templates'], ['/page.haml'])
+        self.assertEqual(list(report['failed']), ['/missing.haml'])
+
+    @skipUnless(hasattr(gc, 'freeze'), 'needs gc.freeze')
+    def test_freeze(self):
+        lookup = HamlTemplateLookup([self.templates])
+        try:
+            warm(lookup, ['page.haml'])
+            self.assertTrue(gc.get_freeze_count() > 0)
+        finally:
+            gc.unfreeze()
+
+    @skipUnless(os.path.exists('/proc/self/statm'), 'needs /proc')
+    def test_memory_usage(self):
+        usage = memory_usage()
+        self.assertTrue(usage['rss'] > 0)
+        self.assertEqual(memory_usage(-1), {})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+from unittest import main
+
+import haml
+from haml.pycodegen import Template, generate_python
+
+from base import Base
+
+
+class TestPythonBackend(Base):
+
+    def assertBackends(self, source, expected, **kwargs):
+        html = Template(source).render(**kwargs)
+        self.assertEqual(html, expected)
+        self.assertEqual(html, haml.compile_template(source).render_unicode(**kwargs))
+
+    def test_tags(self):
+        self.assertBackends(
+            '!!! 5\n%html\n  %body#main.a(class_="b", data={"x": 1})\n    %p Hello\n    %br',
+            '<!DOCTYPE html>\n<html>\n\t<body id="main" class="a b" data-x="1">\n\t\t<p>Hello</p>\n\t\t<br />\n\t</body>\n</html>\n',
+        )
+
+    def test_dynamic_attributes(self):
+        self.assertBackends(
+            '%a.link(href=url, title=None) Link',
+            '<a class="link" href="/x?a=1&amp;b=2">Link</a>\n',
+            url='/x?a=1&b=2',
+        )
+
+    def test_expressions(self):
+        self.assertBackends(
+            '%p= name\n%p&= "<b>"\n%p Hello ${name.upper()|h}!',
+            '<p>World</p>\n<p>&lt;b&gt;</p>\n<p>Hello WORLD!</p>\n',
+            name='World',
+        )
+
+    def test_control(self):
+        self.assertBackends(
+            '- for i in range(3):\n  - if i == 0:\n    %p zero\n  - elif i == 1:\n    - pass\n  - else:\n    %p= i',
+            '<p>zero</p>\n<p>2</p>\n',
+        )
+
+    def test_python(self):
+        self.assertBackends(
+            '-! def shout(x):\n    return x.upper() + "!"\n- x = "hi"\n= shout(x)',
+            'HI!\n',
+        )
+
+    def test_whitespace_removal(self):
+        self.assertBackends(
+            '%img\n%pre><\n    foo\n    - if True:\n      = "bar"\n%img',
+            '<img /><pre>foo\nbar\n</pre><img />\n',
+        )
+
+    def test_filter(self):
+        self.assertBackends(
+            ':plain\n    Hello ${name}\n    ${"<&>"|h}',
+            'Hello World\n&lt;&amp;&gt;\n',
+            name='World',
+        )
+
+    def test_mixins(self):
+        self.assertBackends(
+            '@item(x)\n  %li= x\n  = caller.body()\n%ul\n  +item(1)\n    %b body\n  +item(x=2)',
+            '\n<ul>\n<li>1</li>\n\n\t<b>body</b>\n\n<li>2</li>\n\n</ul>\n',
+        )
+
+    def test_undefined(self):
+        self.assertRaises(NameError, Template('= missing').render)
+
+    def test_mako_tags(self):
+        self.assertRaises(ValueError, generate_python, haml.parse_string('%%inherit(file="x")'))
+
+    def test_file_encoding(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'page.haml')
+            with open(path, 'wb') as fh:
+                fh.write(u'%p caf\xe9 \u2603'.encode('utf-8'))
+            self.assertEqual(Template(filename=path).render(), u'<p>caf\xe9 \u2603</p>\n')
+            with open(path, 'wb') as fh:
+                fh.write(u'%p caf\xe9'.encode('latin-1'))
+            self.assertEqual(Template(filename=path, input_encoding='latin-1').render(), u'<p>caf\xe9</p>\n')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, haml.compile_template, '', backend='jinja')
+
+
+if __name__ == "__main__":
+    main()
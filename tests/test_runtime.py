@@ -0,0 +1,99 @@
+from unittest import main
+import html
+
+from markupsafe import Markup
+
+from haml import runtime
+
+from base import Base
+
+
+class TestEscapeAttribute(Base):
+
+    values = ['', 'plain', 'a & b', '<tag attr="x">', "it's", '&#34;', u'caf\xe9 \u2603', 1, None, ['"']]
+
+    def test_matches_html_escape(self):
+        for value in self.values:
+            expected = html.escape("%s" % value).replace('"', '&quot;')
+            self.assertEqual(runtime.escape_attribute(value), expected)
+            self.assertEqual(runtime._escape_text_html("%s" % value), expected)
+            if runtime._markupsafe_escape is not None:
+                self.assertEqual(runtime._escape_text_markupsafe("%s" % value), expected)
+
+    def test_public_markupsafe(self):
+        # As used by markupsafe versions without the private C escape.
+        escape = runtime._markupsafe_escape
+        runtime._markupsafe_escape = runtime._markupsafe_escape_public
+        try:
+            for value in self.values:
+                expected = html.escape("%s" % value).replace('"', '&quot;')
+                self.assertEqual(runtime._escape_text_markupsafe("%s" % value), expected)
+        finally:
+            runtime._markupsafe_escape = escape
+
+    def test_safe_markup(self):
+        self.assertEqual(runtime.escape_attribute(Markup('a &amp; b')), 'a &amp; b')
+        self.assertHTML('%a(title=title)', '<a title="&lt;b&gt;"></a>\n', title=Markup('&lt;b&gt;'))
+
+
+class TestAttributeStr(Base):
+
+    def test_fast_path(self):
+        self.assertEqual(
+            runtime.attribute_str({'class': 'a'}, checked=True, href='/x', id=[1, None, 'b'], class_='c', title=''),
+            ' id="1_b" class="a c" href="/x" checked="checked"'
+        )
+
+    def test_general_path(self):
+        self.assertEqual(
+            runtime.attribute_str(dataFoo=1, data=dict(bar=2), title='t'),
+            ' data-bar="2" data-foo="1" title="t"'
+        )
+        self.assertEqual(
+            runtime.attribute_str({'__adapt_camelcase': False}, dataFoo=1),
+            ' dataFoo="1"'
+        )
+
+    def test_bounded_memo(self):
+        memo = runtime._BoundedMemo(len, maxsize=2)
+        self.assertEqual([memo['a'], memo['bb'], memo['ccc']], [1, 2, 3])
+        self.assertEqual(list(memo), ['ccc'])
+
+
+class TestAttributeFormatter(Base):
+
+    def assertFormatter(self, const_attrs, **kwargs):
+        formatter = runtime.attribute_formatter(const_attrs, tuple(kwargs))
+        self.assertTrue(formatter)
+        self.assertEqual(
+            formatter(**kwargs),
+            runtime.attribute_str(const_attrs, **kwargs),
+        )
+
+    def test_matches_attribute_str(self):
+        self.assertFormatter({}, href='/x', title='A "quote" & <tag>')
+        self.assertFormatter({'class': 'a'}, class_=['b', None, ['c']], id=3)
+        self.assertFormatter({'id': 'a', 'class': 'b'}, id=['x', 1], title='t')
+        self.assertFormatter({'id': 'a'}, checked=True, selected=False, value=0)
+        self.assertFormatter({}, dataFooBar=1, httpEquiv='refresh')
+        self.assertFormatter({'__adapt_camelcase': False}, dataFooBar=1)
+
+    def test_dict_values(self):
+        self.assertFormatter({}, data=dict(a=1, b=2), title='x')
+
+    def test_unspecialised(self):
+        self.assertEqual(runtime.attribute_formatter({}, ('__obj_ref', )), None)
+        self.assertEqual(runtime.attribute_formatter({}, ('class', 'class_')), None)
+        self.assertEqual(runtime.attribute_formatter({}, ('aB', 'a-b')), None)
+
+    def test_generated(self):
+        self.assertMako(
+            '%a.x(href=url)\n%a.x(href=url)',
+            '<a${__HAML_attrs_1(href=url)|n}></a>\n<a${__HAML_attrs_1(href=url)|n}></a>\n'
+            "<%! \n__HAML_attrs_1 = __HAML.attribute_formatter({'class': 'x'}, ('href',))\n%>\\\n"
+        )
+        self.assertHTML('%a.x(href=url)', '<a class="x" href="/y"></a>\n', url='/y')
+
+
+if __name__ == "__main__":
+    main()
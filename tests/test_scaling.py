@@ -0,0 +1,76 @@
+import time
+from unittest import main
+
+import haml
+from haml import nodes
+from haml.codegen import Generator
+
+from base import Base
+
+
+class TestScaling(Base):
+
+    # Generous, so as not to be flaky on slow machines; these take well under
+    # a second here. See benchmarks/bench_scaling.py for bigger documents.
+    budget = 10.0
+
+    def assertWithinBudget(self, start):
+        self.assertLess(time.time() - start, self.budget)
+
+    def test_deep_inline(self):
+        # 10,000 levels is far beyond the recursion limit.
+        start = time.time()
+        node = haml.parse_string('%b ' * 10000 + 'x')
+        mako = Generator(indent_str='').generate(node)
+        self.assertWithinBudget(start)
+        self.assertTrue(mako.endswith('<b>x' + '</b>' * 10000 + '\n'))
+        self.assertEqual(mako.count('<b>'), 10000)
+
+    def test_deep_indented(self):
+        start = time.time()
+        node = haml.parse_string('\n'.join(' ' * i + '%i' for i in range(2000)))
+        mako = Generator(indent_str='').generate(node)
+        self.assertWithinBudget(start)
+        self.assertEqual(mako.count('<i>'), 2000)
+
+    def test_deep_tree(self):
+        root = parent = nodes.Document()
+        for i in range(10000):
+            child = nodes.Tag('div', None, None)
+            parent.add_child(child)
+            parent = child
+        parent.add_child(nodes.Content('x'))
+        start = time.time()
+        mako = Generator(indent_str='').generate(root)
+        self.assertWithinBudget(start)
+        self.assertEqual(mako.count('</div>'), 10000)
+
+    def test_wide_tree(self):
+        root = nodes.Document()
+        for i in range(30000):
+            tag = nodes.Tag('li', None, None)
+            tag.add_child(nodes.Content('item'))
+            root.add_child(tag)
+        start = time.time()
+        mako = Generator().generate(root)
+        self.assertWithinBudget(start)
+        self.assertEqual(mako.count('<li>'), 30000)
+
+    def test_many_strips(self):
+        # Every lstrip looks back past the no_strip tokens since the last
+        # content, but not past those which an earlier lstrip already has.
+        class Tokens(nodes.Base):
+            def render(self, engine):
+                yield '<p>'
+                for i in range(40000):
+                    yield engine.no_strip('<% x %>')
+                    yield '\n  '
+                    yield engine.lstrip
+        start = time.time()
+        mako = Generator().generate(Tokens())
+        self.assertWithinBudget(start)
+        self.assertEqual(mako, '<p>' + '<% x %>' * 40000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import marshal
+from unittest import main
+
+from six import BytesIO
+
+import haml
+from haml.cache import fingerprint
+from haml.parse import Parser, reparse
+from haml.serialize import TreeFormatError, dump, dumps, load, loads
+
+from base import Base
+
+
+source = '''\
+!!! 5
+%html
+  -# A comment.
+  %body#main.page(data={'a': 1})
+    %h1= title|h
+    - if items:
+      %ul
+        - for item in items:
+          %li<= item
+    - elif other:
+      %p Other.
+    - else:
+      %p Nothing.
+    :javascript
+      setup();
+        nested();
+    -! import os
+    - x = 1
+    @greet(name) = name
+    +greet('you')
+    / An HTML comment.
+    = first
+      second
+'''
+
+
+class TestSerialize(Base):
+
+    def assertRoundTrip(self, root):
+        loaded = loads(dumps(root))
+        self.assertEqual(haml.generate_mako(loaded), haml.generate_mako(root))
+        self.assertEqual(fingerprint(loaded), fingerprint(root))
+        return loaded
+
+    def test_round_trip(self):
+        root = haml.parse_string(source)
+        loaded = self.assertRoundTrip(root)
+        stack = [(root, loaded)]
+        while stack:
+            a, b = stack.pop()
+            self.assertTrue(type(a) is type(b))
+            self.assertEqual((a.lineno, a.end_lineno), (b.lineno, b.end_lineno))
+            stack.extend(zip(a.iter_all_children(), b.iter_all_children()))
+
+    def test_small(self):
+        for text in ('', '%p', 'text', '= x', '- if x:\n  a'):
+            self.assertRoundTrip(haml.parse_string(text))
+
+    def test_reparse(self):
+        lines = source.splitlines()
+        root = loads(dumps(Parser().parse(lines)))
+        lines[5] = '    - if not items:'
+        root = reparse(root, lines, 5, 6, 6)
+        self.assertEqual(haml.generate_mako(root), haml.generate_mako(Parser().parse(lines)))
+
+    def test_file(self):
+        fh = BytesIO()
+        dump(haml.parse_string(source), fh)
+        fh.seek(0)
+        self.assertEqual(haml.generate_mako(load(fh)), haml.generate_mako(haml.parse_string(source)))
+
+    def test_errors(self):
+        self.assertRaises(TreeFormatError, loads, b'not a tree')
+        self.assertRaises(TreeFormatError, loads, marshal.dumps(('PyHAML tree 0', ) + (None, ) * 5))
+        parts = list(marshal.loads(dumps(haml.parse_string('%p'))))
+        # A node class whose attributes have changed since.
+        parts[3] = tuple((name, attrs[:-1], kinds[:-1], count) for name, attrs, kinds, count in parts[3])
+        self.assertRaises(TreeFormatError, loads, marshal.dumps(tuple(parts)))
+
+
+if __name__ == "__main__":
+    main()
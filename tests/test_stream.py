@@ -0,0 +1,75 @@
+from unittest import main
+
+from mako.template import Template
+
+import haml
+from haml.stream import iter_render
+
+from base import Base
+
+
+source = '''
+%ul
+  - for i in items:
+    %li= i
+    !flush
+%p done
+'''.strip()
+
+
+class TestStream(Base):
+
+    templates = [
+        ('mako', lambda source: Template(source, preprocessor=haml.preprocessor)),
+        ('python', lambda source: haml.compile_template(source, backend='python')),
+    ]
+
+    def test_chunks(self):
+        for backend, compile in self.templates:
+            chunks = list(iter_render(compile(source), dict(items=[1, 2])))
+            self.assertEqual(chunks, [
+                '<ul>\n\t<li>1</li>\n',
+                '\t<li>2</li>\n',
+                '</ul>\n<p>done</p>\n',
+            ], backend)
+
+    def test_encoding(self):
+        for backend, compile in self.templates:
+            chunks = list(iter_render(compile(source), dict(items=[u'☃']), encoding='utf-8'))
+            self.assertEqual(b''.join(chunks), u'<ul>\n\t<li>☃</li>\n</ul>\n<p>done</p>\n'.encode('utf-8'), backend)
+
+    def test_whitespace(self):
+        # Flush points don't change the output.
+        self.assertMako('%p<\n  !flush\n  a', '<p><% __HAML.flush(context) %>a</p>\n')
+        self.assertHTML('%p<\n  !flush\n  a', '<p>a</p>\n')
+
+    def test_captured(self):
+        # Output within a filter is captured, so can't be flushed.
+        self.assertMako(':plain\n  !flush', '<%text>!flush</%text>\n')
+
+    def test_mixins(self):
+        for backend, compile in self.templates:
+            chunks = list(iter_render(compile('@m\n  a\n  !flush\n  b\n%p\n  +m\n!flush'), {}))
+            self.assertEqual(''.join(chunks), '\n<p>\na\nb\n</p>\n', backend)
+
+    def test_page_args(self):
+        template = Template('%%page(args="items")\n' + source, preprocessor=haml.preprocessor)
+        chunks = list(iter_render(template, dict(items=[1, 2])))
+        self.assertEqual(''.join(chunks), template.render_unicode(items=[1, 2]))
+        self.assertEqual(len(chunks), 3)
+
+    def test_error(self):
+        for backend, compile in self.templates:
+            chunks = iter_render(compile('%p first\n!flush\n= 1 / zero'), dict(zero=0))
+            self.assertEqual(next(chunks), '<p>first</p>\n')
+            self.assertRaises(ZeroDivisionError, list, chunks)
+
+    def test_close(self):
+        for backend, compile in self.templates:
+            chunks = iter_render(compile(source), dict(items=range(100)), max_pending=1)
+            next(chunks)
+            chunks.close()
+
+
+if __name__ == "__main__":
+    main()